@@ -0,0 +1,91 @@
+# Microbenchmarks of the per-request functions of app.py: build_data_object(), serialize_data(), convert_to_nested_html_table(),
+# the /search HTML document, the canned answer (demo) lookup and /describe (precomputed body and 304). Runs offline, the app is imported with a mock OpenAI configuration.
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage:
+#   python benchmark_app_functions.py --results 4 20 100 --repeat 5
+#   python benchmark_app_functions.py --json-output micro_baseline.json
+#   python benchmark_app_functions.py --baseline micro_baseline.json --max-regression 0.3   (exit code 1 on regressions)
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+# The app creates its OpenAI client on first use, no request is sent by these benchmarks
+os.environ.setdefault("OPENAI_SERVICE_TYPE", "openai")
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+os.environ.setdefault("OPENAI_BASE_URL", "http://127.0.0.1:9/v1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from openai.types.responses import Response
+import app
+from common_openai_functions import _get_search_results_from_response
+from utils import convert_to_nested_html_table
+from mock_openai_server import MockOpenAIServer, MockServerSettings
+from benchmark_results import save_results, compare_with_baseline, report_regressions
+
+
+# Returns the best average time per call in microseconds over 'repeat' rounds of 'number' calls
+def measure(fn, number, repeat):
+  fn()
+  best = float("inf")
+  for _ in range(repeat):
+    start_time = time.perf_counter()
+    for _ in range(number): fn()
+    best = min(best, (time.perf_counter() - start_time) / number)
+  return best * 1e6
+
+# SDK response with num_results file_search_call results, as returned by the mock server
+def make_response(query, num_results, chunk_size):
+  mock_server = MockOpenAIServer(settings=MockServerSettings(num_results=num_results, chunk_size=chunk_size))
+  return Response.model_validate(mock_server._build_response({"input": query, "tools": [{"type": "file_search", "vector_store_ids": ["vs_mock"], "max_num_results": num_results}]}))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Microbenchmarks of the app's per-request functions")
+  parser.add_argument("--results", type=int, nargs="+", default=[4, 20, 100])
+  parser.add_argument("--chunk-size", type=int, default=800)
+  parser.add_argument("--repeat", type=int, default=5)
+  parser.add_argument("--json-output", help="Write the results to this JSON file (e.g. as baseline)")
+  parser.add_argument("--baseline", help="Compare with this JSON file, exit code 1 on regressions")
+  parser.add_argument("--max-regression", type=float, default=0.3, help="Allowed increase of the time per call (0.3 = 30%%)")
+  args = parser.parse_args()
+
+  query = "What is the travel expense policy?"
+  demo_query = app.DEMO_RESPONSES[0]['query'] if app.DEMO_RESPONSES else "lorem ipsum"
+  benchmarks = [
+    ("canned answer hit", lambda: app.canned_answers.find(demo_query.upper()), 20000)
+    ,("canned answer miss", lambda: app.canned_answers.find(query), 20000)
+  ]
+  # /describe through the Flask test client (includes the routing overhead), the route logs to stdout
+  client = app.app.test_client()
+  with contextlib.redirect_stdout(io.StringIO()): describe_etag = client.get('/describe').headers['ETag']
+  def get_describe(headers=None):
+    with contextlib.redirect_stdout(io.StringIO()): return client.get('/describe', headers=headers)
+  benchmarks += [
+    ("describe", lambda: get_describe(), 5000)
+    ,("describe 304", lambda: get_describe({'If-None-Match': describe_etag}), 5000)
+  ]
+  for num_results in args.results:
+    response = make_response(query, num_results, args.chunk_size)
+    search_results = _get_search_results_from_response(response)
+    data = app.build_data_object(query, search_results, response)
+    number = max(10, 2000 // num_results)
+    benchmarks += [
+      (f"build_data_object {num_results}", lambda search_results=search_results, response=response: app.build_data_object(query, search_results, response), number * 10)
+      ,(f"serialize_data {num_results}", lambda data=data: app.serialize_data(data), number * 10)
+      ,(f"convert_to_nested_html_table {num_results}", lambda data=data: convert_to_nested_html_table(data), number)
+      ,(f"search html document {num_results}", lambda data=data: sum(len(chunk) for chunk in app.iter_search_html_document(data)), number)
+    ]
+
+  results = {}
+  print(f"{'function':<36} | {'us/call':>10}")
+  for name, fn, number in benchmarks:
+    results[name] = {"us_per_call": measure(fn, number, args.repeat)}
+    print(f"{name:<36} | {results[name]['us_per_call']:>10.1f}")
+  if args.json_output: save_results(args.json_output, results, vars(args))
+  if args.baseline:
+    regressions = compare_with_baseline(results, args.baseline, args.max_regression, relative_metrics=("us_per_call",))
+    sys.exit(report_regressions(regressions, args.baseline))
@@ -0,0 +1,70 @@
+# Microbenchmark of the canned answer lookup: indexed lookup (exact and fuzzy) vs. the former linear scan for growing table sizes
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage: python benchmark_canned_answers.py --sizes 100 1000 10000 100000 --lookups 2000
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from canned_answers import CannedAnswerIndex, open_canned_answers_buffer
+
+WORDS = "policy vacation travel expense laptop password reset printer holiday sick leave salary payroll onboarding contract office parking badge vpn email meeting room budget approval invoice training benefits insurance pension".split()
+
+
+def make_entries(num_entries):
+  random.seed(num_entries)
+  return [{"query": f"{' '.join(random.choices(WORDS, k=6))} {i}", "answer": f"Answer {i}", "source_markers": ["【", "】"], "sources": []} for i in range(num_entries)]
+
+# Linear scan with lower() on both sides for every entry (implementation before the index)
+def find_linear(entries, query):
+  for item in entries:
+    if item['query'].lower() == query.lower(): return item
+  return None
+
+# Returns the average time per call in microseconds
+def measure(fn, queries):
+  start_time = time.perf_counter()
+  for query in queries: fn(query)
+  return (time.perf_counter() - start_time) / len(queries) * 1e6
+
+# Replaces two characters of the query (typo)
+def add_typo(query):
+  position = random.randrange(1, len(query) - 2)
+  return query[:position] + "xy" + query[position + 2:]
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Canned answer lookup microbenchmark")
+  parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+  parser.add_argument("--lookups", type=int, default=2000)
+  parser.add_argument("--fuzzy-min-similarity", type=float, default=0.8)
+  args = parser.parse_args()
+
+  print(f"{'entries':>8} | {'load ms':>8} | {'linear hit us':>13} | {'linear miss us':>14} | {'index hit us':>12} | {'index miss us':>13} | {'fuzzy us':>8} | {'fuzzy found':>11}")
+  with tempfile.TemporaryDirectory() as directory:
+    for size in args.sizes:
+      entries = make_entries(size)
+      path = os.path.join(directory, f"canned_{size}.jsonl")
+      with open(path, "w", encoding="utf-8") as file:
+        file.write("\n".join(json.dumps(entry, ensure_ascii=False) for entry in entries))
+      start_time = time.perf_counter()
+      index = CannedAnswerIndex(open_canned_answers_buffer(path), build_ngrams=True)
+      load_ms = (time.perf_counter() - start_time) * 1000
+      hit_queries = [random.choice(entries)['query'].upper() for _ in range(args.lookups)]
+      miss_queries = [f"unknown question {i}" for i in range(args.lookups)]
+      typo_queries = [add_typo(query.lower()) for query in hit_queries]
+      # The linear scan gets slow for large tables, so it uses fewer lookups
+      linear_lookups = max(10, args.lookups * 1000 // max(size, 1000))
+      linear_hit = measure(lambda q: find_linear(entries, q), hit_queries[:linear_lookups])
+      linear_miss = measure(lambda q: find_linear(entries, q), miss_queries[:linear_lookups])
+      index_hit = measure(index.get, hit_queries)
+      index_miss = measure(index.get, miss_queries)
+      fuzzy_found = sum(1 for query in typo_queries[:200] if index.find_similar(query, args.fuzzy_min_similarity) is not None)
+      fuzzy = measure(lambda q: index.find_similar(q, args.fuzzy_min_similarity), typo_queries[:200])
+      print(f"{size:>8} | {load_ms:>8.1f} | {linear_hit:>13.1f} | {linear_miss:>14.1f} | {index_hit:>12.2f} | {index_miss:>13.2f} | {fuzzy:>8.1f} | {fuzzy_found / min(200, len(typo_queries)):>10.0%}")
@@ -0,0 +1,69 @@
+# Benchmark of startup and first-request latency of the Azure OpenAI client against the local mock server:
+# cold client (token and connection on the first request) vs. client warmed up with warm_up_openai_client() before the first request.
+# The Azure AD credential is replaced by a stub with configurable latency (DefaultAzureCredential takes 0.5-5 seconds on its first call).
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage: python benchmark_client_startup.py --token-latency 1.0 --connection-latency 0.1 --latency 0.3 --concurrency 4
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from azure.core.credentials import AccessToken
+from common_openai_functions import CoaiClientSettings, CoaiCachedTokenProvider, create_azure_openai_client, warm_up_openai_client
+from mock_openai_server import MockOpenAIServer, MockServerSettings
+
+
+# Credential stub: every get_token() call takes 'latency' seconds and returns a token valid for one hour
+class SlowCredential:
+  def __init__(self, latency):
+    self.latency = latency
+    self.calls = 0
+
+  def get_token(self, *scopes, **kwargs):
+    self.calls += 1
+    time.sleep(self.latency)
+    return AccessToken("mock-token", int(time.time()) + 3600)
+
+def create_client(server, token_latency, client_settings):
+  credential = SlowCredential(token_latency)
+  token_provider = CoaiCachedTokenProvider(credential, refresh_margin_seconds=client_settings.token_refresh_margin_seconds)
+  client = create_azure_openai_client(f"http://{server.host}:{server.port}", "2025-04-01-preview", None, False, client_settings, token_provider)
+  return client, token_provider, credential
+
+# Sends 'concurrency' requests at once (like the first requests after a worker start), returns the slowest latency in ms
+def send_requests(client, concurrency):
+  def send(_):
+    start_time = time.perf_counter()
+    client.responses.create(model="gpt-4o-mini", input="What is the travel expense policy?", tools=[{"type": "file_search", "vector_store_ids": ["vs_mock"]}])
+    return (time.perf_counter() - start_time) * 1000
+  with ThreadPoolExecutor(max_workers=concurrency) as executor: return max(executor.map(send, range(concurrency)))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Client startup and first-request latency benchmark")
+  parser.add_argument("--token-latency", type=float, default=1.0, help="Seconds per Azure AD token request of the credential stub")
+  parser.add_argument("--connection-latency", type=float, default=0.1, help="Seconds per new connection of the mock server (simulated TLS handshake)")
+  parser.add_argument("--latency", type=float, default=0.3, help="Seconds per Responses API call of the mock server")
+  parser.add_argument("--concurrency", type=int, default=4, help="Concurrent first requests and warmed-up connections")
+  args = parser.parse_args()
+
+  server = MockOpenAIServer(settings=MockServerSettings(latency=args.latency, connection_latency=args.connection_latency)).start()
+  client_settings = CoaiClientSettings()
+  print(f"{'client':<8} | {'warm-up ms':>10} | {'1st requests ms':>15} | {'2nd requests ms':>15} | {'token calls':>11} | {'connections':>11}")
+  for name, warm_up in [("cold", False), ("warm", True)]:
+    connections_before = server.stats.connections
+    client, token_provider, credential = create_client(server, args.token_latency, client_settings)
+    warm_up_ms = 0.0
+    if warm_up:
+      start_time = time.perf_counter()
+      warm_up_openai_client(client, token_provider, args.concurrency)
+      warm_up_ms = (time.perf_counter() - start_time) * 1000
+    first_ms = send_requests(client, args.concurrency)
+    second_ms = send_requests(client, args.concurrency)
+    print(f"{name:<8} | {warm_up_ms:>10.0f} | {first_ms:>15.0f} | {second_ms:>15.0f} | {credential.calls:>11} | {server.stats.connections - connections_before:>11}")
+    client.close()
+  server.stop()
@@ -0,0 +1,123 @@
+# Benchmark of the deployment pool with three local mock servers (two regions with a request quota, one that fails during an outage):
+#   1. throughput and errors at a load above the quota of a single deployment: single deployment vs. pool
+#   2. outage of one deployment in the middle of the run: calls per deployment and phase, circuit breaker ejection and probe
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage: python benchmark_deployment_pool.py --rps 4 --duration 30 --quota-rpm 120 --open-seconds 2
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import openai
+from common_openai_functions import create_openai_client, get_search_results_using_responses, retry_on_openai_errors, set_deployment_pool
+from deployment_pool import CircuitBreaker, DeploymentPool, PoolDeployment, PoolDeploymentConfig
+from request_deadline import set_request_deadline, DeadlineExceededError
+from mock_openai_server import MockOpenAIServer, MockServerSettings
+
+MODEL = "gpt-4o-mini"
+QUERY = "What is the travel expense policy?"
+
+
+# Pool with one OpenAI-type deployment per mock server (no SDK retries, failover and retries are done by the pool and retry_on_openai_errors())
+def create_pool(servers, open_seconds):
+  deployments = []
+  for name, server in servers.items():
+    config = PoolDeploymentConfig(name=name, service_type="openai", deployment_name=MODEL, endpoint=server.base_url, api_key="mock")
+    client = create_openai_client("mock", base_url=server.base_url).with_options(max_retries=0)
+    deployments.append(PoolDeployment(config, client, CircuitBreaker(failure_threshold=3, open_seconds=open_seconds), estimated_tokens_per_call=1210))
+  return DeploymentPool(deployments)
+
+# Sends requests at a fixed rate (open loop) with rate limit retries and a deadline per request.
+# Returns the sorted latencies of the successful requests in seconds and the error names of the failed requests.
+def run_load(client, rps, duration, deadline_seconds, on_tick=None):
+  latencies, errors = [], []
+  lock = threading.Lock()
+  def send(scheduled_at):
+    set_request_deadline(deadline_seconds)
+    try:
+      retry_on_openai_errors(lambda: get_search_results_using_responses(client, MODEL, QUERY, "vs_mock", 4, 0.0, 1000), indentation=4)
+      with lock: latencies.append(time.perf_counter() - scheduled_at)
+    except (DeadlineExceededError, openai.APIError) as e:
+      with lock: errors.append(type(e).__name__)
+  with ThreadPoolExecutor(max_workers=200) as executor:
+    start_time = time.perf_counter()
+    for i in range(int(rps * duration)):
+      scheduled_at = start_time + i / rps
+      delay = scheduled_at - time.perf_counter()
+      if delay > 0: time.sleep(delay)
+      if on_tick is not None: on_tick(scheduled_at - start_time)
+      executor.submit(send, scheduled_at)
+  return sorted(latencies), errors
+
+def print_row(name, latencies, errors, duration):
+  p50 = statistics.median(latencies) * 1000 if latencies else 0
+  p95 = statistics.quantiles(latencies, n=100, method="inclusive")[94] * 1000 if len(latencies) > 1 else p50
+  print(f"{name:<22} | {len(latencies) / duration:>8.1f} | {len(errors):>6} | {p50:>8.0f} | {p95:>8.0f}")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Deployment pool benchmark with local mock servers")
+  parser.add_argument("--rps", type=float, default=4, help="Offered load in requests per second")
+  parser.add_argument("--duration", type=float, default=30)
+  parser.add_argument("--quota-rpm", type=int, default=120, help="Request quota per minute of each regional deployment")
+  parser.add_argument("--latency", type=float, default=0.3)
+  parser.add_argument("--deadline", type=float, default=5.0, help="Deadline per request in seconds")
+  parser.add_argument("--open-seconds", type=float, default=2.0, help="Circuit breaker: seconds a failing deployment is skipped before a probe")
+  args = parser.parse_args()
+
+  def create_servers():
+    return {
+      "region-a": MockOpenAIServer(settings=MockServerSettings(latency=args.latency, jitter=0.05, quota_requests_per_minute=args.quota_rpm)).start()
+      ,"region-b": MockOpenAIServer(settings=MockServerSettings(latency=args.latency * 1.5, jitter=0.05, quota_requests_per_minute=args.quota_rpm)).start()
+      ,"region-c": MockOpenAIServer(settings=MockServerSettings(latency=args.latency, jitter=0.05)).start()
+    }
+
+  print(f"Offered load {args.rps} requests/sec for {args.duration} secs, quota {args.quota_rpm} requests/min for region-a and region-b, deadline {args.deadline} secs")
+  print(f"{'':<22} | {'ok req/s':>8} | {'errors':>6} | {'p50 ms':>8} | {'p95 ms':>8}")
+
+  servers = create_servers()
+  client = create_openai_client("mock", base_url=servers["region-a"].base_url).with_options(max_retries=0)
+  latencies, errors = run_load(client, args.rps, args.duration, args.deadline)
+  print_row("single deployment", latencies, errors, args.duration)
+  for server in servers.values(): server.stop()
+
+  servers = create_servers()
+  pool = create_pool({name: servers[name] for name in ("region-a", "region-b")}, args.open_seconds)
+  set_deployment_pool(pool)
+  latencies, errors = run_load(client, args.rps, args.duration, args.deadline)
+  print_row("pool (a, b)", latencies, errors, args.duration)
+  for server in servers.values(): server.stop()
+
+  # Outage: region-c answers every call with 500 in the middle third of the run
+  servers = create_servers()
+  pool = create_pool(servers, args.open_seconds)
+  set_deployment_pool(pool)
+  phases = [(0, "before"), (args.duration / 3, "outage"), (args.duration * 2 / 3, "after")]
+  calls_by_phase = {}
+  current_phase = [None]
+  def on_tick(elapsed):
+    phase = [name for start, name in phases if elapsed >= start][-1]
+    if phase == current_phase[0]: return
+    if current_phase[0] is not None: calls_by_phase[current_phase[0]] = {name: stats["calls"] for name, stats in pool.get_stats().items()}
+    current_phase[0] = phase
+    servers["region-c"].settings.error_ratio = 1.0 if phase == "outage" else 0.0
+  latencies, errors = run_load(client, args.rps, args.duration, args.deadline, on_tick)
+  calls_by_phase[current_phase[0]] = {name: stats["calls"] for name, stats in pool.get_stats().items()}
+  print_row("pool (a, b, c) outage", latencies, errors, args.duration)
+  set_deployment_pool(None)
+
+  print()
+  print(f"{'calls per phase':<22} | " + " | ".join(f"{name:>9}" for name in servers))
+  previous = {name: 0 for name in servers}
+  for _, phase in phases:
+    print(f"{phase:<22} | " + " | ".join(f"{calls_by_phase[phase][name] - previous[name]:>9}" for name in servers))
+    previous = calls_by_phase[phase]
+  for name, stats in pool.get_stats().items():
+    print(f"  {name}: circuit {stats['circuit']}, opened {stats['circuit_opened']} times, {stats['failures']} failures, {stats['rate_limited']} rate limited, latency {stats['latency_ms']} ms")
+  for server in servers.values(): server.stop()
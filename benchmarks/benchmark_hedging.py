@@ -0,0 +1,95 @@
+# Benchmark of hedged and deadline-aware upstream calls against the local mock server with a latency tail:
+#   1. latency percentiles and upstream request count of Responses API calls without and with hedging (HedgingPolicy)
+#   2. time until a request fails under heavy rate limiting, without and with a request deadline (retries that can't finish in time are not started)
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage: python benchmark_hedging.py --calls 300 --concurrency 8 --latency 0.3 --slow-ratio 0.05 --slow-latency 3 --deadline 3
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import openai
+from common_openai_functions import create_http_client, get_search_results_using_responses, retry_on_openai_errors, set_hedging_policy
+from hedging import HedgingPolicy
+from request_deadline import set_request_deadline, DeadlineExceededError
+from mock_openai_server import MockOpenAIServer, MockServerSettings
+
+MODEL = "gpt-4o-mini"
+QUERY = "What is the travel expense policy?"
+
+
+def create_client(server):
+  # No SDK retries, so every upstream request is counted by the mock server and retried by retry_on_openai_errors() only
+  return openai.OpenAI(api_key="mock", base_url=server.base_url, http_client=create_http_client(), max_retries=0)
+
+# Sends 'calls' search requests with 'concurrency' threads, returns the sorted latencies in seconds and the number of errors.
+# deadline_seconds: request deadline set in every thread (None = no deadline)
+def run_calls(client, calls, concurrency, deadline_seconds=None):
+  def send(_):
+    set_request_deadline(deadline_seconds)
+    start_time = time.perf_counter()
+    try:
+      retry_on_openai_errors(lambda: get_search_results_using_responses(client, MODEL, QUERY, "vs_mock", 4, 0.0, 1000), indentation=4)
+      error = False
+    except (DeadlineExceededError, openai.APIError):
+      error = True
+    return time.perf_counter() - start_time, error
+  with ThreadPoolExecutor(max_workers=concurrency) as executor: results = list(executor.map(send, range(calls)))
+  return sorted(latency for latency, _ in results), sum(1 for _, error in results if error)
+
+def get_percentile(sorted_values, percentile):
+  return statistics.quantiles(sorted_values, n=100, method="inclusive")[percentile - 1]
+
+def print_row(name, latencies, errors, upstream_requests):
+  p50, p95, p99 = (get_percentile(latencies, p) * 1000 for p in (50, 95, 99))
+  print(f"{name:<26} | {p50:>8.0f} | {p95:>8.0f} | {p99:>8.0f} | {latencies[-1] * 1000:>8.0f} | {errors:>6} | {upstream_requests:>8}")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Hedging and request deadline benchmark")
+  parser.add_argument("--calls", type=int, default=300)
+  parser.add_argument("--concurrency", type=int, default=8)
+  parser.add_argument("--latency", type=float, default=0.3, help="Mock server: seconds per Responses API call")
+  parser.add_argument("--jitter", type=float, default=0.05)
+  parser.add_argument("--slow-ratio", type=float, default=0.05, help="Mock server: share of calls that take --slow-latency seconds")
+  parser.add_argument("--slow-latency", type=float, default=3.0)
+  parser.add_argument("--percentile", type=float, default=95, help="Hedging delay: percentile of the observed latency")
+  parser.add_argument("--rate-limit-ratio", type=float, default=0.9, help="Mock server: share of calls answered with 429 in the deadline test")
+  parser.add_argument("--deadline", type=float, default=3.0, help="Request deadline in seconds for the deadline test")
+  parser.add_argument("--deadline-calls", type=int, default=8)
+  args = parser.parse_args()
+
+  server = MockOpenAIServer(settings=MockServerSettings(latency=args.latency, jitter=args.jitter, slow_ratio=args.slow_ratio, slow_latency=args.slow_latency)).start()
+  client = create_client(server)
+  print(f"Mock server: {args.latency * 1000:.0f} ms +/- {args.jitter * 1000:.0f} ms per call, {args.slow_ratio:.0%} of the calls take {args.slow_latency * 1000:.0f} ms")
+  print(f"{'':<26} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'max ms':>8} | {'errors':>6} | {'upstream':>8}")
+  policies = [
+    ("no hedging", None)
+    # The fixed delay is used until the latency tracker has enough samples, then the observed percentile
+    ,(f"hedging (p{args.percentile:.0f} delay)", HedgingPolicy(percentile=args.percentile, min_delay_seconds=0.05, fixed_delay_seconds=args.latency * 2))
+  ]
+  for name, policy in policies:
+    set_hedging_policy(policy)
+    requests_before = server.stats.requests
+    latencies, errors = run_calls(client, args.calls, args.concurrency)
+    print_row(name, latencies, errors, server.stats.requests - requests_before)
+    if policy is not None:
+      stats = policy.get_stats()
+      print(f"  {stats['hedged']} hedged ({stats['hedged'] / stats['calls']:.1%} extra upstream calls), {stats['hedge_wins']} answered by the hedge, {stats['skipped']} skipped, delay {policy.get_delay_seconds(MODEL) * 1000:.0f} ms")
+  set_hedging_policy(None)
+
+  print()
+  print(f"Rate limiting: {args.rate_limit_ratio:.0%} of the calls answered with 429 (Retry-After {server.settings.retry_after:.0f} sec), {args.deadline_calls} requests")
+  print(f"{'':<26} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'max ms':>8} | {'errors':>6} | {'upstream':>8}")
+  server.settings.rate_limit_ratio = args.rate_limit_ratio
+  server.settings.slow_ratio = 0.0
+  for name, deadline_seconds in [("no deadline", None), (f"deadline {args.deadline:.0f} sec", args.deadline)]:
+    requests_before = server.stats.requests
+    latencies, errors = run_calls(client, args.deadline_calls, args.deadline_calls, deadline_seconds)
+    print_row(name, latencies, errors, server.stats.requests - requests_before)
+  server.stop()
@@ -0,0 +1,100 @@
+# Benchmark of the /search HTML rendering: previous recursive string renderer vs. streaming generator renderer (time and peak memory)
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage: python benchmark_html_renderer.py --sources 100 500 2000 --text-length 4000 --repeat 5
+
+import argparse
+import html
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from utils import iter_nested_html_table, iter_chunks
+
+DOCUMENT_START = """<!DOCTYPE html><html><head><meta charset="utf-8"><title>Search Results</title></head><body>"""
+DOCUMENT_END = "</body></html>"
+
+
+# Implementation before the streaming renderer (copied for comparison)
+def previous_convert_to_nested_html_table(data: Any, max_depth: int = 10) -> str:
+  def handle_value(v: Any, depth: int) -> str:
+    if depth >= max_depth: return html.escape(str(v))
+    if isinstance(v, dict): return handle_dict(v, depth + 1)
+    elif isinstance(v, list): return handle_list(v, depth + 1)
+    else: return html.escape(str(v))
+
+  def handle_list(items: List[Any], depth: int) -> str:
+    if not items or depth >= max_depth: return html.escape(str(items))
+    if not any(isinstance(item, (dict, list)) for item in items): return html.escape(str(items))
+    rows = [f"<tr><td>[{i}]</td><td>{handle_value(item, depth)}</td></tr>" for i, item in enumerate(items)]
+    return f"<table border=1>{''.join(rows)}</table>"
+
+  def handle_dict(d: Dict[str, Any], depth: int) -> str:
+    if not d or depth >= max_depth: return html.escape(str(d))
+    rows = [f"<tr><td>{html.escape(str(k))}</td><td>{handle_value(v, depth)}</td></tr>" for k, v in d.items()]
+    return f"<table border=1>{''.join(rows)}</table>"
+  return handle_value(data, 1)
+
+# Data object as returned by /search with the given number of sources
+def make_data(num_sources, text_length):
+  random.seed(num_sources)
+  words = "lorem ipsum dolor sit amet consectetur adipiscing elit <b>sed</b> & do eiusmod tempor".split()
+  def make_text():
+    text = " ".join(random.choices(words, k=text_length // 5))
+    return text[:text_length]
+  return {
+    "query": "What is the travel expense policy?"
+    ,"answer": "The policy is described in 【Travel Policy.pdf】."
+    ,"source_markers": ["【", "】"]
+    ,"sources": [{"data": make_text(), "source": f"https://contoso.sharepoint.com/sites/hr/Shared%20Documents/Document {i:04d}.pdf", "metadata": {"page": i % 40, "title": f"Document {i}", "tags": ["hr", "policy"]}} for i in range(num_sources)]
+  }
+
+def render_previous(data):
+  table_html = previous_convert_to_nested_html_table(data)
+  return len(f"{DOCUMENT_START}{table_html}{DOCUMENT_END}")
+
+# Consumes the streamed chunks like the WSGI server does, returns the number of characters sent
+def render_streaming(data, max_string_length=0, max_list_items=0):
+  def iter_document():
+    yield DOCUMENT_START
+    yield from iter_nested_html_table(data, max_string_length=max_string_length, max_list_items=max_list_items)
+    yield DOCUMENT_END
+  return sum(len(chunk) for chunk in iter_chunks(iter_document()))
+
+# Returns (best time in ms, peak memory in KB, output characters)
+def measure(fn, repeat):
+  times = []
+  for _ in range(repeat):
+    start_time = time.perf_counter()
+    length = fn()
+    times.append(time.perf_counter() - start_time)
+  tracemalloc.start()
+  fn()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return min(times) * 1000, peak / 1024, length
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="HTML renderer benchmark for /search results")
+  parser.add_argument("--sources", type=int, nargs="+", default=[100, 500, 2000])
+  parser.add_argument("--text-length", type=int, default=4000)
+  parser.add_argument("--max-text-length", type=int, default=2000, help="Truncation limit of the streaming renderer with limits (SEARCH_HTML_MAX_TEXT_LENGTH)")
+  parser.add_argument("--max-list-items", type=int, default=100, help="List limit of the streaming renderer with limits (SEARCH_HTML_MAX_LIST_ITEMS)")
+  parser.add_argument("--repeat", type=int, default=5)
+  args = parser.parse_args()
+
+  print(f"{'sources':>7} | {'renderer':<26} | {'time ms':>8} | {'peak KB':>9} | {'output KB':>9}")
+  for num_sources in args.sources:
+    data = make_data(num_sources, args.text_length)
+    for name, fn in [
+      ("previous", lambda: render_previous(data))
+      ,("streaming", lambda: render_streaming(data))
+      ,("streaming with limits", lambda: render_streaming(data, args.max_text_length, args.max_list_items))
+    ]:
+      elapsed_ms, peak_kb, length = measure(fn, args.repeat)
+      print(f"{num_sources:>7} | {name:<26} | {elapsed_ms:>8.1f} | {peak_kb:>9.0f} | {length / 1024:>9.0f}")
@@ -0,0 +1,68 @@
+# Load test of the client-side rate limiter against a local mock OpenAI server that enforces a quota and answers with 429
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage: python benchmark_rate_limiter.py --requests 300 --concurrency 32 --quota-requests-per-minute 600
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from common_openai_functions import *
+from rate_limiter import RateLimiter, set_request_priority, PRIORITY_QUERY, PRIORITY_SEARCH
+from mock_openai_server import MockOpenAIServer, MockServerSettings
+
+
+# Sends num_requests searches from concurrency threads, 1 in 4 with /search priority. Returns (elapsed secs, errors, latencies by priority).
+def run_load(base_url, num_requests, concurrency):
+  client = openai.OpenAI(api_key="mock", base_url=base_url, max_retries=0)
+  latencies = {PRIORITY_QUERY: [], PRIORITY_SEARCH: []}
+  def search(i):
+    priority = PRIORITY_SEARCH if i % 4 == 0 else PRIORITY_QUERY
+    set_request_priority(priority)
+    start_time = time.perf_counter()
+    retry_on_openai_errors(lambda: get_search_results_using_responses(client, "mock-deployment", f"query {i}", "vs_mock", 4, 0, 100), retries=8, backoff_seconds=0.5)
+    latencies[priority].append(time.perf_counter() - start_time)
+  errors = 0
+  start_time = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    for future in [executor.submit(search, i) for i in range(num_requests)]:
+      try: future.result()
+      except Exception: errors += 1
+  elapsed = time.perf_counter() - start_time
+  client.close()
+  return elapsed, errors, latencies
+
+def print_result(name, num_requests, elapsed, errors, rate_limited, latencies):
+  print(f"  {name}: {(num_requests - errors) / elapsed:.1f} successful requests/sec, {rate_limited} x 429 from server, {errors} failed requests (retries exhausted)")
+  for priority, priority_name in [(PRIORITY_QUERY, "/query"), (PRIORITY_SEARCH, "/search")]:
+    values = latencies[priority]
+    if len(values) > 1: print(f"    {priority_name:<8} p50={statistics.median(values):6.2f} s, p95={statistics.quantiles(values, n=20)[-1]:6.2f} s")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Rate limiter load test against a local mock OpenAI server with quota")
+  parser.add_argument("--requests", type=int, default=300)
+  parser.add_argument("--concurrency", type=int, default=32)
+  parser.add_argument("--latency", type=float, default=0.2)
+  parser.add_argument("--quota-requests-per-minute", type=int, default=600)
+  parser.add_argument("--quota-tokens-per-minute", type=int, default=0)
+  parser.add_argument("--configure-limits", action="store_true", help="Configure the limits in the rate limiter instead of learning them from the response headers")
+  args = parser.parse_args()
+
+  for name, rate_limiter in [
+    ("Without rate limiter", None)
+    ,("With rate limiter", RateLimiter(requests_per_minute=args.quota_requests_per_minute if args.configure_limits else 0, tokens_per_minute=args.quota_tokens_per_minute if args.configure_limits else 0))
+  ]:
+    random.seed(1)
+    settings = MockServerSettings(latency=args.latency, jitter=args.latency / 4, quota_requests_per_minute=args.quota_requests_per_minute, quota_tokens_per_minute=args.quota_tokens_per_minute)
+    server = MockOpenAIServer(settings=settings).start()
+    set_rate_limiter(rate_limiter)
+    elapsed, errors, latencies = run_load(server.base_url, args.requests, args.concurrency)
+    print_result(name, args.requests, elapsed, errors, server.stats.rate_limited, latencies)
+    server.stop()
+  set_rate_limiter(None)
@@ -0,0 +1,48 @@
+# Benchmark results as JSON files and comparison with a baseline, used by load_test.py and benchmark_app_functions.py to catch regressions
+# Copyright 2025, Karsten Held (MIT License)
+
+import json
+import platform
+import sys
+import time
+from typing import Dict, List, Optional
+
+
+# Writes {"created_at", "python", "platform", "settings", "results": {name: {metric: value}}}
+def save_results(path: str, results: Dict[str, Dict[str, float]], settings: Optional[Dict] = None):
+  document = {
+    "created_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+    ,"python": sys.version.split()[0]
+    ,"platform": platform.platform()
+    ,"settings": settings or {}
+    ,"results": results
+  }
+  with open(path, "w", encoding="utf-8") as file: json.dump(document, file, indent=2)
+  print(f"Results written to '{path}'.")
+
+# Returns a message per regression against the baseline file. Lower values are better for all metrics:
+# relative_metrics regress if they grow by more than max_regression (0.2 = 20%), absolute_metrics if they grow by more than their tolerance.
+# Names and metrics missing in either file are skipped.
+def compare_with_baseline(results: Dict[str, Dict[str, float]], baseline_path: str, max_regression: float, relative_metrics=(), absolute_metrics: Optional[Dict[str, float]] = None) -> List[str]:
+  with open(baseline_path, "r", encoding="utf-8") as file: baseline = json.load(file).get("results", {})
+  regressions = []
+  for name, metrics in results.items():
+    baseline_metrics = baseline.get(name)
+    if baseline_metrics is None: continue
+    for metric in relative_metrics:
+      if metric not in metrics or metric not in baseline_metrics: continue
+      limit = baseline_metrics[metric] * (1 + max_regression)
+      if metrics[metric] > limit: regressions.append(f"{name}: {metric} {metrics[metric]:.2f} > {baseline_metrics[metric]:.2f} (+{max_regression:.0%})")
+    for metric, tolerance in (absolute_metrics or {}).items():
+      if metric not in metrics or metric not in baseline_metrics: continue
+      if metrics[metric] > baseline_metrics[metric] + tolerance: regressions.append(f"{name}: {metric} {metrics[metric]:.4f} > {baseline_metrics[metric]:.4f} (+{tolerance})")
+  return regressions
+
+# Prints the regressions and returns the process exit code (1 if there are regressions)
+def report_regressions(regressions: List[str], baseline_path: str) -> int:
+  if not regressions:
+    print(f"No regressions compared to '{baseline_path}'.")
+    return 0
+  print(f"{len(regressions)} regression(s) compared to '{baseline_path}':")
+  for regression in regressions: print(f"  {regression}")
+  return 1
@@ -0,0 +1,51 @@
+# Latency and token cost per search backend ('responses', 'vector_store_search', 'retrieval_only') against a local mock OpenAI server
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage: python benchmark_search_backends.py --requests 50 --latency 0.8 --search-latency 0.1
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from common_openai_functions import *
+from mock_openai_server import MockOpenAIServer, MockServerSettings
+
+
+# Runs the given number of sequential searches with one backend. Returns (latencies in secs, total tokens).
+def run_backend(client, backend_name, num_requests):
+  latencies = []
+  total_tokens = 0
+  for i in range(num_requests):
+    start_time = time.perf_counter()
+    search_results, response = get_search_results(client, backend_name, "mock-model", f"query {i}", "vs_mock", 4, 0, 100)
+    latencies.append(time.perf_counter() - start_time)
+    if response is not None and response.usage: total_tokens += response.usage.total_tokens
+  return latencies, total_tokens
+
+def print_result(backend_name, latencies, total_tokens):
+  p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+  print(f"  {backend_name:<20}: p50={statistics.median(latencies)*1000:7.1f} ms, p95={p95*1000:7.1f} ms, tokens/request={total_tokens / len(latencies):7.1f}")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Search backend latency and cost benchmark against a local mock OpenAI server")
+  parser.add_argument("--requests", type=int, default=30)
+  parser.add_argument("--latency", type=float, default=0.8, help="Latency of Responses API calls (search + generation)")
+  parser.add_argument("--search-latency", type=float, default=0.1, help="Latency of vector store searches")
+  parser.add_argument("--jitter", type=float, default=0.05)
+  args = parser.parse_args()
+
+  for vector_store_search in [True, False]:
+    settings = MockServerSettings(latency=args.latency, jitter=args.jitter, search_latency=args.search_latency, vector_store_search=vector_store_search)
+    server = MockOpenAIServer(settings=settings).start()
+    client = openai.OpenAI(api_key="mock", base_url=server.base_url, max_retries=0)
+    print(f"Service {'with' if vector_store_search else 'without'} vector store search API ({server.base_url}):")
+    for backend_name in SEARCH_BACKENDS.keys():
+      latencies, total_tokens = run_backend(client, backend_name, args.requests)
+      used_backend_name = resolve_search_backend(client, backend_name)
+      print_result(backend_name if used_backend_name == backend_name else f"{backend_name} -> {used_backend_name}", latencies, total_tokens)
+    client.close()
+    server.stop()
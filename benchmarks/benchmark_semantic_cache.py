@@ -0,0 +1,72 @@
+# Microbenchmark of the semantic cache: lookup and store time for growing numbers of entries and embedding sizes,
+# snapshot load time (memory-mapped) and the hit ratio of reworded queries with the local embedding (no mock server or model needed)
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage: python benchmark_semantic_cache.py --sizes 1000 10000 50000 --dimensions 256 1536 --lookups 500
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import numpy as np
+from semantic_cache import SemanticCache, create_local_embedding_function
+
+WORDS = "policy vacation travel expense laptop password reset printer holiday sick leave salary payroll onboarding contract office parking badge vpn email meeting room budget approval invoice training benefits insurance pension".split()
+BODY = b'{"data":{"query":"q","answer":"a","source_markers":["\\u3010","\\u3011"],"sources":[]}}'
+
+
+# Returns the average time per call in microseconds
+def measure(fn, items):
+  start_time = time.perf_counter()
+  for item in items: fn(item)
+  return (time.perf_counter() - start_time) / len(items) * 1e6
+
+def random_vectors(count, dimensions):
+  vectors = np.random.default_rng(count).standard_normal((count, dimensions)).astype(np.float32)
+  return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+# Share of reworded queries (word order, case, punctuation, one extra word) found with the local embedding
+def measure_reworded_hit_ratio(num_queries, min_similarity):
+  random.seed(1)
+  cache = SemanticCache(create_local_embedding_function(256), "local-256", capacity=num_queries, min_similarity=min_similarity)
+  queries = [" ".join(random.sample(WORDS, 6)) for _ in range(num_queries)]
+  for query in queries: cache.set(cache.embed(query), "scope", ["vs"], query, {"query": query}, BODY)
+  hits = 0
+  for query in queries:
+    words = query.split()
+    words[0], words[1] = words[1], words[0]
+    hit = cache.get(cache.embed(" ".join(words).upper() + " please?"), "scope")
+    hits += 1 if hit is not None and hit.query == query else 0
+  return hits / num_queries
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Semantic cache microbenchmark")
+  parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+  parser.add_argument("--dimensions", type=int, nargs="+", default=[256, 1536])
+  parser.add_argument("--lookups", type=int, default=500)
+  parser.add_argument("--min-similarity", type=float, default=0.8)
+  args = parser.parse_args()
+
+  print(f"{'entries':>8} | {'dims':>5} | {'lookup us':>9} | {'store us':>8} | {'matrix MB':>9} | {'save ms':>8} | {'load ms':>8}")
+  with tempfile.TemporaryDirectory() as directory:
+    for dimensions in args.dimensions:
+      for size in args.sizes:
+        path = os.path.join(directory, f"cache_{size}_{dimensions}")
+        cache = SemanticCache(lambda text: None, "benchmark", capacity=size, min_similarity=args.min_similarity, path=path, save_interval_seconds=1e9)
+        vectors = random_vectors(size, dimensions)
+        store_us = measure(lambda i: cache.set(vectors[i], "scope", ["vs"], f"query {i}", {"query": f"query {i}"}, BODY), range(size))
+        queries = random_vectors(args.lookups, dimensions)
+        lookup_us = measure(lambda query: cache.get(query, "scope"), queries)
+        start_time = time.perf_counter()
+        cache.save()
+        save_ms = (time.perf_counter() - start_time) * 1000
+        start_time = time.perf_counter()
+        SemanticCache(lambda text: None, "benchmark", capacity=size, path=path)
+        load_ms = (time.perf_counter() - start_time) * 1000
+        print(f"{size:>8} | {dimensions:>5} | {lookup_us:>9.1f} | {store_us:>8.1f} | {size * dimensions * 4 / 1e6:>9.1f} | {save_ms:>8.1f} | {load_ms:>8.1f}")
+  print(f"Reworded queries found with the local embedding (min similarity {args.min_similarity}): {measure_reworded_hit_ratio(1000, args.min_similarity):.0%}")
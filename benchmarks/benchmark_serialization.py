@@ -0,0 +1,117 @@
+# Benchmark of the per-request result handling: SDK response -> search results -> data object -> JSON body.
+# Compares the previous representation (dataclasses with __dict__, Flask's stdlib JSON encoding) with slots result types and the JSON_ENCODER backends.
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage: python benchmark_serialization.py --results 4 20 100 --chunk-size 800 --repeat 2000
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Dict, List, Literal, Optional, Union
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from openai.types.responses import Response
+from common_openai_functions import _get_search_results_from_response
+import json_encoder
+from mock_openai_server import MockOpenAIServer, MockServerSettings
+
+SOURCE_URL = "https://contoso.sharepoint.com/sites/hr/Shared%20Documents/"
+
+
+# Result types and copy loop before the slots change (copied for comparison)
+@dataclass
+class PreviousSearchContent:
+  text: str
+  type: Literal["text"]
+
+@dataclass
+class PreviousSearchResponse:
+  content: List[PreviousSearchContent]
+  file_id: str
+  filename: str
+  score: float
+  attributes: Optional[Dict[str, Union[str, float, bool]]] = None
+  vector_store_id: Optional[str] = None
+
+def previous_get_search_results(response):
+  file_search_call = next((item for item in response.output if item.type == 'file_search_call'), None)
+  search_results = []
+  for result in file_search_call.results:
+    content = [PreviousSearchContent(text=result.text, type="text")]
+    item = PreviousSearchResponse(attributes=result.attributes, content=content, file_id=result.file_id, filename=result.filename, score=result.score)
+    search_results.append(item)
+  return search_results
+
+def previous_build_data_object(query, search_results, response):
+  sources = []
+  for result in search_results:
+    source = {"data": result.content[0].text if result.content else "", "source": f"{SOURCE_URL}{result.filename}", "metadata": result.attributes}
+    sources.append(source)
+  return {"query": query, "answer": response.output_text, "source_markers": ["【", "】"], "sources": sources}
+
+# Flask's default JSON provider (jsonify): sorted keys, ASCII escapes, encoded to bytes by the response
+def previous_serialize(data):
+  return json.dumps({'data': data}, sort_keys=True, ensure_ascii=True, separators=(',', ':')).encode("utf-8")
+
+def previous_request(query, response):
+  search_results = previous_get_search_results(response)
+  data = previous_build_data_object(query, search_results, response)
+  return data, previous_serialize(data)
+
+
+# Same as build_data_object() / build_sources() in app.py
+def build_data_object(query, search_results, response):
+  return {
+    "query": query
+    ,"answer": response.output_text
+    ,"source_markers": ["【", "】"]
+    ,"sources": [{"data": result.content[0].text if result.content else "", "source": f"{SOURCE_URL}{result.filename}", "metadata": result.attributes} for result in search_results]
+  }
+
+def current_request(query, response):
+  search_results = _get_search_results_from_response(response)
+  data = build_data_object(query, search_results, response)
+  return data, json_encoder.dumps_bytes({'data': data})
+
+
+# Returns (microseconds per request, peak KB per request, memory blocks allocated and still referenced by the results, body KB)
+def measure(fn, query, response, repeat):
+  fn(query, response)
+  start_time = time.perf_counter()
+  for _ in range(repeat): fn(query, response)
+  elapsed_us = (time.perf_counter() - start_time) / repeat * 1e6
+  tracemalloc.start()
+  blocks_before = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+  result = fn(query, response)
+  peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+  blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename")) - blocks_before
+  tracemalloc.stop()
+  return elapsed_us, peak_kb, blocks, len(result[1]) / 1024
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Result representation and JSON serialization benchmark")
+  parser.add_argument("--results", type=int, nargs="+", default=[4, 20, 100])
+  parser.add_argument("--chunk-size", type=int, default=800)
+  parser.add_argument("--repeat", type=int, default=2000)
+  args = parser.parse_args()
+
+  print(f"orjson installed: {json_encoder.orjson is not None}")
+  print(f"{'results':>7} | {'variant':<26} | {'us/request':>10} | {'peak KB':>8} | {'live blocks':>11} | {'body KB':>7}")
+  for num_results in args.results:
+    query = "What is the travel expense policy?"
+    mock_server = MockOpenAIServer(settings=MockServerSettings(num_results=num_results, chunk_size=args.chunk_size))
+    response = Response.model_validate(mock_server._build_response({"input": query, "tools": [{"type": "file_search", "vector_store_ids": ["vs_mock"], "max_num_results": num_results}]}))
+    variants = [("previous (dataclass, stdlib)", previous_request)]
+    for encoder_name in (["orjson"] if json_encoder.orjson is not None else []) + ["stdlib"]:
+      def run(query, response, encoder_name=encoder_name):
+        json_encoder.json_encoder_name = encoder_name
+        return current_request(query, response)
+      variants.append((f"slots, {encoder_name}", run))
+    for name, fn in variants:
+      elapsed_us, peak_kb, blocks, body_kb = measure(fn, query, response, max(1, args.repeat * 4 // num_results))
+      print(f"{num_results:>7} | {name:<26} | {elapsed_us:>10.1f} | {peak_kb:>8.1f} | {blocks:>11} | {body_kb:>7.1f}")
@@ -0,0 +1,208 @@
+# Load test of the web app: replays a JSONL request file against /query, /search and /describe at a target rate (open loop)
+# and reports latency percentiles, throughput and error rates per endpoint. By default the app is started against the local
+# mock OpenAI server, so the test runs fully offline.
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage:
+#   python load_test.py --rps 20 --duration 30 --latency 0.5 --jitter 0.2 --rate-limit-ratio 0.05
+#   python load_test.py --server gunicorn --workers 2 --threads 8 --app-env RESPONSE_CACHE_ENABLED=false
+#   python load_test.py --target-url http://localhost:5000 --rps 5 --duration 60      (app that is already running)
+#   python load_test.py --json-output baseline.json                                   (save results)
+#   python load_test.py --baseline baseline.json --max-regression 0.2                 (exit code 1 if p95 or error rate regress)
+#
+# Request file: one request per line, {"method": "POST", "path": "/query", "body": {...}} or {"method": "GET", "path": "/search", "params": {...}}.
+# Lines with only {"query": "..."} are sent to /query. Optional "name" groups requests in the report (default: method, path and format).
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import httpx
+from mock_openai_server import MockOpenAIServer, MockServerSettings
+from benchmark_results import save_results, compare_with_baseline, report_regressions
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SRC_DIRECTORY = os.path.join(BENCHMARKS_DIRECTORY, "..", "src")
+
+
+@dataclass
+class LoadTestRequest:
+  name: str
+  method: str
+  path: str
+  params: Dict = field(default_factory=dict)
+  body: Dict = None
+
+@dataclass
+class EndpointResult:
+  latencies: List[float] = field(default_factory=list)   # seconds from the scheduled start to the complete response body
+  statuses: Dict[str, int] = field(default_factory=dict)
+  errors: int = 0
+
+def load_requests(path) -> List[LoadTestRequest]:
+  requests = []
+  with open(path, "r", encoding="utf-8") as file:
+    for line in file:
+      if not line.strip(): continue
+      item = json.loads(line)
+      if "path" not in item: item = {"method": "POST", "path": "/query", "body": {"data": {"query": item["query"]}}}
+      params = item.get("params") or {}
+      name = item.get("name") or f"{item['method']} {item['path']}" + (f" ({params['format']})" if "format" in params else "")
+      requests.append(LoadTestRequest(name=name, method=item["method"], path=item["path"], params=params, body=item.get("body")))
+  return requests
+
+def get_free_port():
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    return s.getsockname()[1]
+
+# Starts the app in a subprocess ('python app.py' or gunicorn) with the given environment, returns (process, base url)
+def start_app(args, app_env):
+  port = get_free_port()
+  env = {**os.environ, **app_env, "PORT": str(port)}
+  if args.server == "gunicorn":
+    command = ["gunicorn", f"--bind=127.0.0.1:{port}", f"--workers={args.workers}", f"--threads={args.threads}", "app:app"]
+  else:
+    command = [sys.executable, "app.py"]
+  log_file = open(args.app_log, "w", encoding="utf-8") if args.app_log else subprocess.DEVNULL
+  process = subprocess.Popen(command, cwd=SRC_DIRECTORY, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+  base_url = f"http://127.0.0.1:{port}"
+  deadline = time.monotonic() + 60
+  while time.monotonic() < deadline:
+    if process.poll() is not None: raise RuntimeError(f"App exited with code {process.returncode}, see --app-log")
+    try:
+      if httpx.get(f"{base_url}/alive", timeout=1).status_code == 200: return process, base_url
+    except httpx.HTTPError:
+      pass
+    time.sleep(0.2)
+  process.terminate()
+  raise RuntimeError("App did not start within 60 seconds")
+
+# Sends the requests round robin at a fixed rate for the given duration. Latency is measured from the scheduled start,
+# so requests that wait for a free client thread are counted as slow instead of being sent later (no coordinated omission).
+def run_load(base_url, requests, rps, duration, max_concurrency, timeout) -> Dict[str, EndpointResult]:
+  results: Dict[str, EndpointResult] = {}
+  lock = threading.Lock()
+  client = httpx.Client(base_url=base_url, timeout=timeout, limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency))
+
+  def send(request: LoadTestRequest, scheduled_at: float):
+    status = "error"
+    try:
+      response = client.request(request.method, request.path, params=request.params or None, json=request.body)
+      response.read()
+      status = str(response.status_code)
+    except httpx.HTTPError as e:
+      status = type(e).__name__
+    latency = time.perf_counter() - scheduled_at
+    with lock:
+      result = results.setdefault(request.name, EndpointResult())
+      result.latencies.append(latency)
+      result.statuses[status] = result.statuses.get(status, 0) + 1
+      if not status.isdigit() or int(status) >= 400: result.errors += 1
+
+  total_requests = int(rps * duration)
+  with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="load-test") as executor:
+    start_time = time.perf_counter()
+    for i in range(total_requests):
+      scheduled_at = start_time + i / rps
+      delay = scheduled_at - time.perf_counter()
+      if delay > 0: time.sleep(delay)
+      executor.submit(send, requests[i % len(requests)], scheduled_at)
+  client.close()
+  return results
+
+def get_percentile(sorted_values, percentile):
+  if len(sorted_values) == 1: return sorted_values[0]
+  return statistics.quantiles(sorted_values, n=100, method="inclusive")[percentile - 1]
+
+# Returns {name: {requests, errors, error_rate, rps, p50_ms, p95_ms, p99_ms, max_ms}} including a 'total' row
+def summarize(results: Dict[str, EndpointResult], elapsed) -> Dict[str, Dict[str, float]]:
+  all_results = EndpointResult()
+  for result in results.values():
+    all_results.latencies.extend(result.latencies)
+    all_results.errors += result.errors
+  summary = {}
+  for name, result in sorted(results.items()) + [("total", all_results)]:
+    latencies = sorted(result.latencies)
+    if not latencies: continue
+    summary[name] = {
+      "requests": len(latencies)
+      ,"errors": result.errors
+      ,"error_rate": result.errors / len(latencies)
+      ,"rps": len(latencies) / elapsed
+      ,"p50_ms": get_percentile(latencies, 50) * 1000
+      ,"p95_ms": get_percentile(latencies, 95) * 1000
+      ,"p99_ms": get_percentile(latencies, 99) * 1000
+      ,"max_ms": latencies[-1] * 1000
+    }
+  return summary
+
+def print_summary(summary, results):
+  print(f"{'endpoint':<26} | {'requests':>8} | {'errors':>6} | {'error %':>7} | {'req/s':>6} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'max ms':>8}")
+  for name, row in summary.items():
+    print(f"{name:<26} | {row['requests']:>8} | {row['errors']:>6} | {row['error_rate']:>7.2%} | {row['rps']:>6.1f} | {row['p50_ms']:>8.1f} | {row['p95_ms']:>8.1f} | {row['p99_ms']:>8.1f} | {row['max_ms']:>8.1f}")
+  for name, result in sorted(results.items()):
+    unexpected = {status: count for status, count in result.statuses.items() if status != "200"}
+    if unexpected: print(f"  {name}: {', '.join(f'{status}: {count}' for status, count in sorted(unexpected.items()))}")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Load test of the web app with a local mock OpenAI server")
+  parser.add_argument("--requests-file", default=os.path.join(BENCHMARKS_DIRECTORY, "load_test_requests.jsonl"))
+  parser.add_argument("--rps", type=float, default=10, help="Target requests per second (open loop)")
+  parser.add_argument("--duration", type=float, default=20, help="Seconds of load")
+  parser.add_argument("--max-concurrency", type=int, default=200, help="Max in-flight requests of the load generator")
+  parser.add_argument("--timeout", type=float, default=60)
+  parser.add_argument("--target-url", help="Test an already running app instead of starting it with the mock server")
+  parser.add_argument("--server", choices=["flask", "gunicorn"], default="flask", help="How the app is started ('gunicorn' is not available on Windows)")
+  parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+  parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+  parser.add_argument("--app-env", action="append", default=[], help="Additional environment variable for the app, e.g. RESPONSE_CACHE_ENABLED=false (repeatable)")
+  parser.add_argument("--app-log", help="File for the output of the app (default: discarded)")
+  parser.add_argument("--latency", type=float, default=0.5, help="Mock server: seconds per Responses API call")
+  parser.add_argument("--jitter", type=float, default=0.2, help="Mock server: random +/- seconds per call")
+  parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Mock server: share of calls answered with 429")
+  parser.add_argument("--num-results", type=int, default=4, help="Mock server: file_search_call results per response")
+  parser.add_argument("--json-output", help="Write the results to this JSON file (e.g. as baseline)")
+  parser.add_argument("--baseline", help="Compare p95 latency and error rate with this JSON file, exit code 1 on regressions")
+  parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed p95 increase compared to the baseline (0.2 = 20%%)")
+  args = parser.parse_args()
+
+  requests = load_requests(args.requests_file)
+  mock_server = None
+  app_process = None
+  base_url = args.target_url
+  if base_url is None:
+    mock_server = MockOpenAIServer(settings=MockServerSettings(latency=args.latency, jitter=args.jitter, rate_limit_ratio=args.rate_limit_ratio, num_results=args.num_results)).start()
+    app_env = {"OPENAI_SERVICE_TYPE": "openai", "OPENAI_API_KEY": "mock", "OPENAI_BASE_URL": mock_server.base_url}
+    app_env.update(item.split("=", 1) for item in args.app_env)
+    app_process, base_url = start_app(args, app_env)
+    print(f"App started with '{args.server}' at {base_url}, mock OpenAI server at {mock_server.base_url}")
+
+  try:
+    print(f"Sending {int(args.rps * args.duration)} requests ({len(requests)} distinct) at {args.rps} requests/sec for {args.duration} secs...")
+    start_time = time.perf_counter()
+    results = run_load(base_url, requests, args.rps, args.duration, args.max_concurrency, args.timeout)
+    elapsed = time.perf_counter() - start_time
+  finally:
+    if app_process is not None:
+      app_process.terminate()
+      app_process.wait(timeout=30)
+    if mock_server is not None: mock_server.stop()
+
+  summary = summarize(results, elapsed)
+  print_summary(summary, results)
+  if mock_server is not None: print(f"Mock server: {mock_server.stats.requests} upstream requests, {mock_server.stats.rate_limited} rate limited, max {mock_server.stats.max_in_flight} in flight")
+  if args.json_output: save_results(args.json_output, summary, vars(args))
+  if args.baseline:
+    regressions = compare_with_baseline(summary, args.baseline, args.max_regression, relative_metrics=("p95_ms",), absolute_metrics={"error_rate": 0.01})
+    sys.exit(report_regressions(regressions, args.baseline))
@@ -0,0 +1,314 @@
+# Local mock of the OpenAI / Azure OpenAI Responses API for benchmarks (no network access or API key needed)
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage: python mock_openai_server.py --port 8765 --latency 0.5 --jitter 0.1 --rate-limit-ratio 0.05
+# Then point the app to it with OPENAI_SERVICE_TYPE=openai, OPENAI_API_KEY=mock and OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+
+
+@dataclass
+class MockServerSettings:
+  latency: float = 0.5            # seconds until the response is returned
+  jitter: float = 0.0             # random +/- seconds added to latency
+  rate_limit_ratio: float = 0.0   # share of requests answered with HTTP 429
+  retry_after: float = 1.0        # value of the Retry-After header of 429 responses
+  num_results: int = 4            # file_search_call results per response
+  chunk_size: int = 800           # characters per result text
+  search_latency: float = 0.1     # seconds until a vector store search (no generation) is returned
+  vector_store_search: bool = True  # if False, '/vector_stores/{id}/search' returns 404 (like older Azure OpenAI API versions)
+  quota_requests_per_minute: int = 0  # Responses API quota like an Azure OpenAI deployment (0 = unlimited), exceeding it returns 429
+  quota_tokens_per_minute: int = 0
+  connection_latency: float = 0.0  # seconds spent on every new connection before the first request (simulates DNS, TCP and TLS handshakes)
+  slow_ratio: float = 0.0         # share of Responses API calls that take slow_latency instead of latency (latency tail)
+  slow_latency: float = 5.0
+  error_ratio: float = 0.0        # share of Responses API calls answered with HTTP 500
+
+@dataclass
+class MockServerStats:
+  requests: int = 0
+  rate_limited: int = 0
+  server_errors: int = 0
+  in_flight: int = 0
+  max_in_flight: int = 0
+  connections: int = 0
+  paths: Dict[str, int] = field(default_factory=dict)
+
+# Tokens of one mock response (usage.total_tokens), charged against quota_tokens_per_minute
+_RESPONSE_TOTAL_TOKENS = 1210
+
+_LOREM = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. Nullam semper, lectus ullamcorper sagittis fermentum, nisi risus luctus ante, quis porttitor magna massa id diam. "
+
+
+class MockOpenAIServer:
+  def __init__(self, host="127.0.0.1", port=0, settings: MockServerSettings = None):
+    self.host = host
+    self.port = port
+    self.settings = settings or MockServerSettings()
+    self.stats = MockServerStats()
+    self._server = None
+    self._loop = None
+    self._thread = None
+    # Quota buckets for the Responses API, refilled continuously. Like Azure OpenAI, bursts are limited to 10 seconds worth of quota.
+    self._quota_requests = self.settings.quota_requests_per_minute / 6
+    self._quota_tokens = self.settings.quota_tokens_per_minute / 6
+    self._quota_updated_at = time.monotonic()
+
+  @property
+  def base_url(self):
+    return f"http://{self.host}:{self.port}/v1"
+
+  # Starts the server on its own event loop in a daemon thread. Returns self, so it can be used as 'server = MockOpenAIServer().start()'.
+  def start(self):
+    started = threading.Event()
+    def run():
+      self._loop = asyncio.new_event_loop()
+      self._server = self._loop.run_until_complete(asyncio.start_server(self._handle_connection, self.host, self.port, backlog=4096))
+      self.port = self._server.sockets[0].getsockname()[1]
+      started.set()
+      self._loop.run_forever()
+    self._thread = threading.Thread(target=run, name="mock-openai-server", daemon=True)
+    self._thread.start()
+    started.wait()
+    return self
+
+  def stop(self):
+    if self._loop is None: return
+    async def shutdown():
+      self._server.close()
+      for task in asyncio.all_tasks():
+        if task is not asyncio.current_task(): task.cancel()
+    asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+    self._loop.call_soon_threadsafe(self._loop.stop)
+    self._thread.join()
+
+  def serve_forever(self):
+    async def run():
+      self._server = await asyncio.start_server(self._handle_connection, self.host, self.port, backlog=4096)
+      self.port = self._server.sockets[0].getsockname()[1]
+      print(f"Mock OpenAI server listening on {self.base_url}")
+      async with self._server: await self._server.serve_forever()
+    asyncio.run(run())
+
+  # Minimal HTTP/1.1 handling with keep-alive, enough for httpx and requests
+  async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    self.stats.connections += 1
+    try:
+      if self.settings.connection_latency: await asyncio.sleep(self.settings.connection_latency)
+      while True:
+        request_line = await reader.readline()
+        if not request_line: break
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+          line = await reader.readline()
+          if line in (b"\r\n", b"\n", b""): break
+          name, value = line.decode("latin-1").split(":", 1)
+          headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", "0")))
+        path = target.split("?", 1)[0]
+        status, response_headers, response_body = await self._handle_request(method, path, headers, body)
+        await self._write_response(writer, status, response_headers, response_body)
+        if headers.get("connection", "").lower() == "close": break
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError, ValueError):
+      pass
+    finally:
+      writer.close()
+
+  # body is either bytes or an async generator of bytes chunks (sent with chunked transfer encoding)
+  async def _write_response(self, writer, status, headers, body):
+    reasons = {200: "OK", 404: "Not Found", 429: "Too Many Requests"}
+    head = f"HTTP/1.1 {status} {reasons.get(status, 'Error')}\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    if isinstance(body, bytes):
+      writer.write(head.encode("latin-1") + f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+      await writer.drain()
+      return
+    writer.write(head.encode("latin-1") + b"Transfer-Encoding: chunked\r\n\r\n")
+    async for chunk in body:
+      writer.write(f"{len(chunk):x}\r\n".encode("latin-1") + chunk + b"\r\n")
+      await writer.drain()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+  async def _handle_request(self, method, path, headers, body) -> Tuple[int, Dict[str, str], bytes]:
+    self.stats.requests += 1
+    self.stats.paths[path] = self.stats.paths.get(path, 0) + 1
+    self.stats.in_flight += 1
+    self.stats.max_in_flight = max(self.stats.max_in_flight, self.stats.in_flight)
+    try:
+      delay = max(0.0, self.settings.latency + random.uniform(-self.settings.jitter, self.settings.jitter))
+      if self.settings.slow_ratio and random.random() < self.settings.slow_ratio: delay = self.settings.slow_latency
+      request_body = json.loads(body) if body else {}
+      # Cheap request without latency, used by the client warm-up
+      if method == "GET" and path.endswith("/models"):
+        return 200, {"Content-Type": "application/json"}, json.dumps({"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model", "created": 0, "owned_by": "mock"}]}).encode("utf-8")
+      quota_headers = {}
+      if method == "POST" and path.endswith("/responses"):
+        quota_error, quota_headers = self._consume_quota()
+        if quota_error is not None: return quota_error
+      if method == "POST" and path.endswith("/responses") and request_body.get("stream"):
+        # Streams spend half of the latency before the search results and the other half generating the answer
+        await asyncio.sleep(delay / 2)
+        if self._is_server_error(): return self._build_server_error()
+        if not self._is_rate_limited():
+          return 200, {"Content-Type": "text/event-stream", **quota_headers}, self._stream_response(request_body, delay / 2)
+        return self._build_rate_limit_error()
+      if method == "POST" and path.endswith("/search") and "/vector_stores/" in path:
+        if not self.settings.vector_store_search: return 404, {"Content-Type": "application/json"}, json.dumps({"error": {"code": "404", "message": "Resource not found"}}).encode("utf-8")
+        await asyncio.sleep(max(0.0, self.settings.search_latency + random.uniform(-self.settings.jitter, self.settings.jitter) / 2))
+        if self._is_rate_limited(): return self._build_rate_limit_error()
+        return 200, {"Content-Type": "application/json"}, json.dumps(self._build_vector_store_search_page(request_body)).encode("utf-8")
+      await asyncio.sleep(delay)
+      if self._is_server_error(): return self._build_server_error()
+      if self._is_rate_limited(): return self._build_rate_limit_error()
+      # Azure OpenAI uses '/openai/responses', OpenAI uses '/v1/responses'
+      if method == "POST" and path.endswith("/responses"):
+        return 200, {"Content-Type": "application/json", **quota_headers}, json.dumps(self._build_response(request_body)).encode("utf-8")
+      return 404, {"Content-Type": "application/json"}, json.dumps({"error": {"message": f"Unknown path '{path}'", "type": "invalid_request_error"}}).encode("utf-8")
+    finally:
+      self.stats.in_flight -= 1
+
+  # Consumes one request and the tokens of one response from the quota. Returns (error_response or None, x-ratelimit-* headers).
+  def _consume_quota(self):
+    settings = self.settings
+    if not settings.quota_requests_per_minute and not settings.quota_tokens_per_minute: return None, {}
+    now = time.monotonic()
+    elapsed_minutes = (now - self._quota_updated_at) / 60.0
+    self._quota_updated_at = now
+    self._quota_requests = min(settings.quota_requests_per_minute / 6, self._quota_requests + elapsed_minutes * settings.quota_requests_per_minute)
+    self._quota_tokens = min(settings.quota_tokens_per_minute / 6, self._quota_tokens + elapsed_minutes * settings.quota_tokens_per_minute)
+    tokens = _RESPONSE_TOTAL_TOKENS
+    missing_requests = (1 - self._quota_requests) if settings.quota_requests_per_minute else 0
+    missing_tokens = (tokens - self._quota_tokens) if settings.quota_tokens_per_minute else 0
+    if missing_requests > 0 or missing_tokens > 0:
+      self.stats.rate_limited += 1
+      retry_after = max(missing_requests * 60.0 / settings.quota_requests_per_minute if missing_requests > 0 else 0, missing_tokens * 60.0 / settings.quota_tokens_per_minute if missing_tokens > 0 else 0)
+      status, headers, body = self._build_rate_limit_error()
+      headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+      headers["retry-after-ms"] = str(int(retry_after * 1000))
+      return (status, {**headers, **self._get_quota_headers()}, body), {}
+    if settings.quota_requests_per_minute: self._quota_requests -= 1
+    if settings.quota_tokens_per_minute: self._quota_tokens -= tokens
+    return None, self._get_quota_headers()
+
+  def _get_quota_headers(self):
+    headers = {}
+    if self.settings.quota_requests_per_minute:
+      headers["x-ratelimit-limit-requests"] = str(self.settings.quota_requests_per_minute)
+      headers["x-ratelimit-remaining-requests"] = str(max(0, int(self._quota_requests)))
+    if self.settings.quota_tokens_per_minute:
+      headers["x-ratelimit-limit-tokens"] = str(self.settings.quota_tokens_per_minute)
+      headers["x-ratelimit-remaining-tokens"] = str(max(0, int(self._quota_tokens)))
+    return headers
+
+  def _is_rate_limited(self):
+    if self.settings.rate_limit_ratio and random.random() < self.settings.rate_limit_ratio:
+      self.stats.rate_limited += 1
+      return True
+    return False
+
+  def _is_server_error(self):
+    if self.settings.error_ratio and random.random() < self.settings.error_ratio:
+      self.stats.server_errors += 1
+      return True
+    return False
+
+  def _build_server_error(self):
+    error = {"error": {"message": "The server had an error while processing your request (mock).", "type": "server_error", "param": None, "code": None}}
+    return 500, {"Content-Type": "application/json"}, json.dumps(error).encode("utf-8")
+
+  def _build_rate_limit_error(self):
+    error = {"error": {"message": "Rate limit reached (mock).", "type": "rate_limit_error", "param": None, "code": "rate_limit_exceeded"}}
+    return 429, {"Content-Type": "application/json", "Retry-After": str(self.settings.retry_after)}, json.dumps(error).encode("utf-8")
+
+  # Yields the server-sent events of a streamed response: created, file_search_call done, output text deltas, completed
+  async def _stream_response(self, request_body, generation_seconds):
+    def sse(event):
+      return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode("utf-8")
+    response = self._build_response(request_body)
+    file_search_call, message = response["output"]
+    yield sse({"type": "response.created", "sequence_number": 0, "response": {**response, "status": "in_progress", "output": [], "usage": None}})
+    yield sse({"type": "response.output_item.done", "sequence_number": 1, "output_index": 0, "item": file_search_call})
+    words = message["content"][0]["text"].split(" ")
+    for i, word in enumerate(words):
+      await asyncio.sleep(generation_seconds / len(words))
+      delta = word if i == 0 else " " + word
+      yield sse({"type": "response.output_text.delta", "sequence_number": i + 2, "item_id": message["id"], "output_index": 1, "content_index": 0, "delta": delta})
+    yield sse({"type": "response.completed", "sequence_number": len(words) + 2, "response": response})
+
+  def _build_search_results(self, query, num_results):
+    text = (_LOREM * (self.settings.chunk_size // len(_LOREM) + 1))[:self.settings.chunk_size]
+    return [{
+      "file_id": f"file-{i:04d}"
+      ,"filename": f"Document {i:04d}.pdf"
+      ,"score": round(0.95 - i * 0.05, 4)
+      ,"text": f"{query} {text}"
+      ,"attributes": {"page": i + 1}
+    } for i in range(num_results)]
+
+  # Builds a vector store search results page as returned by '/vector_stores/{id}/search'
+  def _build_vector_store_search_page(self, request_body):
+    query = request_body.get("query", "")
+    num_results = min(self.settings.num_results, request_body.get("max_num_results", self.settings.num_results))
+    results = self._build_search_results(query, num_results)
+    data = [{"file_id": r["file_id"], "filename": r["filename"], "score": r["score"], "attributes": r["attributes"], "content": [{"type": "text", "text": r["text"]}]} for r in results]
+    return {"object": "vector_store.search_results.page", "search_query": [query], "data": data, "has_more": False, "next_page": None}
+
+  # Builds a Responses API response object with a file_search_call (including results) and an output message
+  def _build_response(self, request_body):
+    query = request_body.get("input", "")
+    query = query if isinstance(query, str) else json.dumps(query)
+    tools = request_body.get("tools") or []
+    num_results = min(self.settings.num_results, next((t.get("max_num_results", self.settings.num_results) for t in tools if t.get("type") == "file_search"), self.settings.num_results))
+    answer = f"Mock answer for '{query}'."
+    return {
+      "id": f"resp_{uuid.uuid4().hex}"
+      ,"object": "response"
+      ,"created_at": int(time.time())
+      ,"status": "completed"
+      ,"model": request_body.get("model", "mock-model")
+      ,"output": [
+        {"id": f"fs_{uuid.uuid4().hex}", "type": "file_search_call", "status": "completed", "queries": [query], "results": self._build_search_results(query, num_results)}
+        ,{"id": f"msg_{uuid.uuid4().hex}", "type": "message", "role": "assistant", "status": "completed", "content": [{"type": "output_text", "text": answer, "annotations": []}]}
+      ]
+      ,"parallel_tool_calls": True
+      ,"tool_choice": "auto"
+      ,"tools": tools
+      ,"temperature": request_body.get("temperature", 1.0)
+      ,"top_p": 1.0
+      ,"usage": {"input_tokens": _RESPONSE_TOTAL_TOKENS - 10, "input_tokens_details": {"cached_tokens": 0}, "output_tokens": 10, "output_tokens_details": {"reasoning_tokens": 0}, "total_tokens": _RESPONSE_TOTAL_TOKENS}
+    }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Local mock of the OpenAI Responses API")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8765)
+  parser.add_argument("--latency", type=float, default=0.5)
+  parser.add_argument("--jitter", type=float, default=0.0)
+  parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+  parser.add_argument("--retry-after", type=float, default=1.0)
+  parser.add_argument("--num-results", type=int, default=4)
+  parser.add_argument("--chunk-size", type=int, default=800)
+  parser.add_argument("--search-latency", type=float, default=0.1)
+  parser.add_argument("--no-vector-store-search", action="store_true", help="Return 404 for vector store searches (like older Azure OpenAI API versions)")
+  parser.add_argument("--quota-requests-per-minute", type=int, default=0)
+  parser.add_argument("--quota-tokens-per-minute", type=int, default=0)
+  parser.add_argument("--connection-latency", type=float, default=0.0, help="Seconds spent on every new connection (simulated TLS handshake)")
+  parser.add_argument("--slow-ratio", type=float, default=0.0, help="Share of calls that take --slow-latency seconds")
+  parser.add_argument("--slow-latency", type=float, default=5.0)
+  parser.add_argument("--error-ratio", type=float, default=0.0, help="Share of calls answered with HTTP 500")
+  args = parser.parse_args()
+  settings = MockServerSettings(latency=args.latency, jitter=args.jitter, rate_limit_ratio=args.rate_limit_ratio, retry_after=args.retry_after, num_results=args.num_results, chunk_size=args.chunk_size, search_latency=args.search_latency, vector_store_search=not args.no_vector_store_search
+    ,quota_requests_per_minute=args.quota_requests_per_minute, quota_tokens_per_minute=args.quota_tokens_per_minute, connection_latency=args.connection_latency
+    ,slow_ratio=args.slow_ratio, slow_latency=args.slow_latency, error_ratio=args.error_ratio)
+  MockOpenAIServer(args.host, args.port, settings).serve_forever()
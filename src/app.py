@@ -1,14 +1,34 @@
 import os
-from flask import Flask, send_from_directory, jsonify, request
+import html
+import atexit
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from flask import Flask, send_from_directory, jsonify, request, Response, stream_with_context
 from dataclasses import asdict
 from demodata import DEMO_RESPONSES, CRAWLER_SETTINGS
 from common_openai_functions import *
+from response_cache import create_response_cache_from_env, build_cache_key
+from canned_answers import create_canned_answers_from_env
+from semantic_cache import create_semantic_cache_from_env
+from crawler_settings import create_crawler_settings_store_from_env
+from json_encoder import init_json_provider, dumps, dumps_bytes
+from request_metrics import start_request_timings, get_request_timings, finish_request_timings, time_phase, iter_timed, render_metrics
+from single_flight import create_single_flight_from_env
+from request_deadline import set_request_deadline, DeadlineExceededError
+from hedging import create_hedging_policy_from_env
+from deployment_pool import load_deployment_pool_configs_from_env, create_deployment_pool
+from rate_limiter import create_rate_limiter_from_env, set_request_priority, PRIORITY_QUERY, PRIORITY_BATCH, PRIORITY_SEARCH
 from utils import *
 
 app = Flask(__name__)
+# orjson for jsonify() and request.get_json() if installed, see JSON_ENCODER
+init_json_provider(app)
 
-# Global variables
+# Global variables, the client is created on first use by get_openai_client()
 openai_client = None
+# Pool of deployments for all Responses API calls (OPENAI_DEPLOYMENT_POOL), None = all calls go to openai_client
+deployment_pool = None
 
 openai_service_type = os.getenv("OPENAI_SERVICE_TYPE", "openai")
 openai_api_key = os.environ.get('OPENAI_API_KEY')
@@ -22,22 +42,195 @@ azure_openai_model_deployment_name = os.getenv("AZURE_OPENAI_MODEL_DEPLOYMENT_NA
 default_search_vector_store_id = os.getenv("DEFAULT_SEARCH_VECTOR_STORE_ID", "<your_default_vector_store_id>")
 default_sharepoint_source_url = os.getenv("DEFAULT_SHAREPOINT_SOURCE_URL", "https://<your_tenant>.sharepoint.com/sites/<your_site>/Shared%20Documents/")
 
-# Initialize OpenAI client
+# Search parameters used by /query and /search (also part of the response cache key)
+search_max_num_results = 4
+search_temperature = 0
+search_max_output_tokens = 100
+
+# Search backend used by /query and by /search if no 'backend' parameter is given: 'responses', 'vector_store_search' or 'retrieval_only'
+default_search_backend = os.getenv("SEARCH_BACKEND", "responses")
+
+# Limits of the HTML format of /search: characters per text (e.g. the chunk text of a source) and items per list, 0 = unlimited
+search_html_max_text_length = int(os.getenv("SEARCH_HTML_MAX_TEXT_LENGTH", "2000"))
+search_html_max_list_items = int(os.getenv("SEARCH_HTML_MAX_LIST_ITEMS", "100"))
+
+# Deadlines per route in seconds (0 = none). Clients can shorten them with the 'X-Request-Timeout' header (seconds), e.g. to the front end's own timeout.
+# Upstream calls get the remaining time as timeout and rate limit retries that can't finish in time are not started (504 instead).
+request_timeouts_by_endpoint = {
+  'query': float(os.getenv("QUERY_TIMEOUT_SECONDS", "15"))
+  ,'search': float(os.getenv("SEARCH_TIMEOUT_SECONDS", "30"))
+}
+batch_item_timeout_seconds = float(os.getenv("BATCH_ITEM_TIMEOUT_SECONDS", "30"))
+
+# If 'true', responses carry a Server-Timing header with the time spent in each phase (exposes internal timings to clients)
+server_timing_enabled = os.getenv("SERVER_TIMING_ENABLED", "false").lower() in ['true']
+
+# Canned answers returned by /query without a search: DEMO_RESPONSES plus the optional CANNED_ANSWERS_PATH file (reloaded on change)
+canned_answers = create_canned_answers_from_env(DEMO_RESPONSES)
+
+# Response cache in front of get_search_results_using_responses(). None if disabled.
+response_cache = create_response_cache_from_env()
+
+# Embeds a query with the embedding deployment of the semantic cache (SEMANTIC_CACHE_EMBEDDING_MODEL). Shorter vectors make lookups faster,
+# the lookup time grows with entries x dimensions (about 2 ms for 10,000 entries with 1536 dimensions, see benchmark_semantic_cache.py).
+semantic_cache_embedding_dimensions = int(os.getenv("SEMANTIC_CACHE_EMBEDDING_DIMENSIONS", "512"))
+def embed_query(text):
+  return retry_on_openai_errors(lambda:get_embeddings(get_openai_client(), semantic_cache.embedding_name, [text], semantic_cache_embedding_dimensions)[0], indentation=2, retries=2)
+
+# Semantic answer cache for /query: answers of previous queries with a similar meaning. None if disabled or numpy is not installed.
+# Entries of a vector store are invalidated when its version (file counts and size) changes.
+semantic_cache = create_semantic_cache_from_env(embed_query, lambda vsid: get_vector_store_version(get_openai_client(), vsid))
+if semantic_cache is not None and semantic_cache.path: atexit.register(semantic_cache.save)
+
+# Coalesces concurrent identical upstream calls. None if disabled. Across workers only with the sqlite tier of the response cache, where waiting workers find the result.
+single_flight = create_single_flight_from_env(shared_result_store=response_cache is not None and response_cache.is_shared_across_processes())
+
+# Client-side rate limiter for all Responses API calls (request and token buckets per deployment). None if disabled.
+rate_limiter = create_rate_limiter_from_env()
+set_rate_limiter(rate_limiter)
+
+# Worker pool shared by all /query/batch requests of a worker process, so concurrent batches don't multiply the upstream load
+batch_max_queries = int(os.getenv("BATCH_MAX_QUERIES", "1000"))
+batch_executor = ThreadPoolExecutor(max_workers=int(os.getenv("BATCH_MAX_CONCURRENCY", "8")), thread_name_prefix="query-batch")
+
+# Federated search over the vector stores of multiple domains: per-store timeout and worker pool for the parallel searches
+federated_search_timeout_seconds = float(os.getenv("FEDERATED_SEARCH_TIMEOUT_SECONDS", "10"))
+federated_executor = ThreadPoolExecutor(max_workers=int(os.getenv("FEDERATED_SEARCH_MAX_CONCURRENCY", "16")), thread_name_prefix="federated-search")
+
+# Crawler settings: CRAWLER_SETTINGS_PATH (reloaded when the file changes) or demodata.CRAWLER_SETTINGS. The snapshot holds the vector stores
+# per domain, the document library urls and the pre-serialized /describe body, so requests don't derive them from the settings again.
+crawler_settings = create_crawler_settings_store_from_env(CRAWLER_SETTINGS, default_sharepoint_source_url)
+
+# Returns the vector store ids to search for the given domain keys (None = all domains).
+# Without domain keys, falls back to default_search_vector_store_id if no vector stores are configured.
+# Raises ValueError for unknown domain keys and for requested domains without vector stores (they must not be answered from another corpus).
+def get_vector_store_ids_for_domains(domain_keys):
+  vector_store_ids_by_domain = crawler_settings.get().vector_store_ids_by_domain
+  unknown_keys = [key for key in (domain_keys or []) if key not in vector_store_ids_by_domain]
+  if unknown_keys: raise ValueError(f"Unknown domain(s): {', '.join(unknown_keys)}. Supported: {', '.join(vector_store_ids_by_domain.keys())}")
+  vector_store_ids = []
+  for key in (domain_keys if domain_keys else vector_store_ids_by_domain.keys()):
+    for vector_store_id in vector_store_ids_by_domain[key]:
+      if vector_store_id not in vector_store_ids: vector_store_ids.append(vector_store_id)
+  if vector_store_ids: return vector_store_ids
+  if domain_keys: raise ValueError(f"Domain(s) without searchable vector store: {', '.join(domain_keys)}")
+  return [default_search_vector_store_id]
+
+# Returns the domain keys from a list or a comma separated string, or None if not given
+def parse_domain_keys(value):
+  if not value: return None
+  if isinstance(value, str): value = value.split(',')
+  return [str(key).strip() for key in value if str(key).strip()] or None
+
+# Connection pool and timeouts of the OpenAI clients (OPENAI_HTTP_*), Azure AD token provider shared by all clients
+openai_client_settings = get_client_settings_from_env()
+azure_ad_token_provider = None
+
+# Number of pooled connections opened by warm_up() before the first request, 0 = only fetch the Azure AD token
+openai_warm_up_connections = int(os.getenv("OPENAI_WARM_UP_CONNECTIONS", "2"))
+
+# Initialize OpenAI client. openai_client is set last, so get_openai_client() never returns it before the pool and hedging clients exist.
 def init_openai_client():
-  global openai_client
+  global openai_client, azure_ad_token_provider, deployment_pool
+  if openai_client is not None: return
+  client = None
   try:
     if openai_service_type == "openai":
-      openai_client = create_openai_client(openai_api_key)
+      client = create_openai_client(openai_api_key, openai_client_settings)
     elif openai_service_type == "azure_openai":
-      openai_client = create_azure_openai_client(azure_openai_endpoint, azure_openai_api_version, azure_openai_api_key, azure_openai_use_key_authentication)
+      if not azure_openai_use_key_authentication: azure_ad_token_provider = create_azure_ad_token_provider(openai_client_settings.token_refresh_margin_seconds)
+      client = create_azure_openai_client(azure_openai_endpoint, azure_openai_api_version, azure_openai_api_key, azure_openai_use_key_authentication, openai_client_settings, azure_ad_token_provider)
+    # Responses API calls go to the pool if configured, vector store searches and embeddings stay on the client above
+    deployment_pool_configs = load_deployment_pool_configs_from_env(azure_openai_api_version, azure_openai_api_key, azure_openai_use_key_authentication, openai_api_key
+      ,openai_service_type, azure_openai_endpoint if openai_service_type == "azure_openai" else os.getenv("OPENAI_BASE_URL"))
+    if deployment_pool_configs:
+      deployment_pool = create_deployment_pool([create_pool_deployment_clients(config) for config in deployment_pool_configs])
+      print(f"Deployment pool: {', '.join(deployment.name + (' (vector stores)' if deployment.config.vector_stores else '') for deployment in deployment_pool.deployments)}")
+    set_deployment_pool(deployment_pool)
+    init_hedging_clients()
+    openai_client = client
   except Exception as e:
     print(f"Error initializing OpenAI client of type '{openai_service_type}': {str(e)}")
     raise
 
-# Initialize the client at module level
-init_openai_client()
-
-
+# Returns (config, client) of a deployment in the pool. Azure OpenAI deployments share the Azure AD token provider and the connection settings.
+def create_pool_deployment_clients(config):
+  global azure_ad_token_provider
+  if config.service_type == "openai":
+    client = create_openai_client(config.api_key, openai_client_settings, config.endpoint)
+  elif config.service_type == "azure_openai":
+    if not config.use_key_authentication and azure_ad_token_provider is None: azure_ad_token_provider = create_azure_ad_token_provider(openai_client_settings.token_refresh_margin_seconds)
+    client = create_azure_openai_client(config.endpoint, config.api_version, config.api_key, config.use_key_authentication, openai_client_settings, azure_ad_token_provider)
+  else:
+    raise ValueError(f"Deployment pool: unknown service type '{config.service_type}' of deployment '{config.name}'")
+  # The pool fails over to another deployment instead of retrying on the same one
+  return config, client.with_options(max_retries=0)
+
+# The clients are created on first use instead of at import time, so the worker process starts faster (creating a client loads the
+# TLS certificates, about 70 ms per client). gunicorn workers create them in warm_up() before their first request.
+openai_client_lock = threading.Lock()
+
+def get_openai_client():
+  if openai_client is None:
+    with openai_client_lock: init_openai_client()
+  return openai_client
+
+# Hedged upstream calls (HEDGING_ENABLED): calls that take longer than the observed p95 latency are sent a second time, to a secondary
+# Azure OpenAI resource in another region if HEDGING_SECONDARY_AZURE_OPENAI_ENDPOINT is set (same API version and authentication).
+# Calls with file_search are only hedged to that resource if it holds the same vector stores (HEDGING_SECONDARY_VECTOR_STORES).
+hedging_policy = create_hedging_policy_from_env()
+hedging_secondary_azure_openai_endpoint = os.getenv("HEDGING_SECONDARY_AZURE_OPENAI_ENDPOINT")
+set_hedging_policy(hedging_policy)
+
+# Creates the secondary client of the hedging policy, called by init_openai_client() after the Azure AD token provider exists
+def init_hedging_clients():
+  if hedging_policy is None or openai_service_type != "azure_openai" or not hedging_secondary_azure_openai_endpoint: return
+  hedging_secondary_azure_openai_api_key = os.getenv("HEDGING_SECONDARY_AZURE_OPENAI_API_KEY")
+  hedging_policy.secondary_client = create_azure_openai_client(hedging_secondary_azure_openai_endpoint, azure_openai_api_version, hedging_secondary_azure_openai_api_key, azure_openai_use_key_authentication, openai_client_settings, azure_ad_token_provider)
+
+# Fetches the Azure AD token and opens pooled connections, so the first request doesn't pay for credential discovery and TLS handshakes.
+# Called per worker process by gunicorn's post_fork hook (gunicorn.conf.py) and before app.run(). Errors are logged, not raised.
+def warm_up():
+  start_time = log_function_header("warm_up")
+  warm_up_openai_client(get_openai_client(), azure_ad_token_provider, openai_warm_up_connections)
+  for deployment in (deployment_pool.deployments if deployment_pool is not None else []):
+    warm_up_openai_client(deployment.client, None, openai_warm_up_connections)
+  log_function_footer("warm_up", start_time)
+
+
+
+# Starts the phase timers of each request. The request metrics are recorded when the response is closed, i.e. after streamed responses are complete.
+@app.before_request
+def start_request_metrics():
+  start_request_timings(request.endpoint or 'unknown')
+  set_request_deadline(get_request_timeout_seconds())
+
+# Returns the deadline of the current request in seconds: the route's timeout, shortened by the client's 'X-Request-Timeout' header
+def get_request_timeout_seconds():
+  timeout_seconds = request_timeouts_by_endpoint.get(request.endpoint) or None
+  try:
+    client_timeout_seconds = float(request.headers.get('X-Request-Timeout', '0'))
+  except ValueError:
+    client_timeout_seconds = 0
+  if client_timeout_seconds > 0: timeout_seconds = min(timeout_seconds, client_timeout_seconds) if timeout_seconds else client_timeout_seconds
+  return timeout_seconds
+
+# Upstream calls that could not finish before the request deadline
+@app.errorhandler(DeadlineExceededError)
+@app.errorhandler(openai.APITimeoutError)
+def deadline_exceeded(e):
+  print(f"  Deadline exceeded: {str(e)}")
+  return jsonify({'error': 'The request could not be answered in time'}), 504, {'Content-Type': 'application/json'}
+
+@app.after_request
+def finish_request_metrics(response):
+  timings = get_request_timings()
+  if timings is None: return response
+  # Streamed responses send the headers before the phases are done
+  if server_timing_enabled and not response.is_streamed: response.headers['Server-Timing'] = timings.get_server_timing_header()
+  method, status = request.method, response.status_code
+  response.call_on_close(lambda: finish_request_timings(timings, method, status))
+  return response
 
 @app.route('/')
 def home():
@@ -58,147 +251,498 @@ def favicon():
 def ignore_default_doc():
   return home()
 
-@app.route('/describe', methods=['POST'])
+# Returns the tool description for the front end. The body is pre-serialized with the crawler settings snapshot; GET requests with
+# 'If-None-Match' get 304 while the settings are unchanged (the front end calls /describe at the start of every session).
+@app.route('/describe', methods=['GET', 'POST'])
 def describe():
   function_name = 'describe()'
   start_time = log_function_header(function_name)
-  # extract tenant url from default_sharepoint_source_url (part until 3rd /)
-  sharepoint_tenant_url = '/'.join(default_sharepoint_source_url.split('/')[:3]) + '/'
-
-  # Extract domains from crawler settings
-  domains = [
-    {
-      'name': dom.get('name', ''),
-      'description': dom.get('description', '')
-    } for dom in CRAWLER_SETTINGS.get('domains', [])
-  ]
-  
-  # Prepare response
-  response = {
-    'data': {
-      'description': 'This tool can search the content of SharePoint documents.',
-      'domains': domains,
-      'content_root': sharepoint_tenant_url
-      # 'favicon': 'AAABAAAIACoJQAANgA...APgfAAA='  # base64, optional
-    }
-  }
+  settings = crawler_settings.get()
+  headers = {'ETag': f'"{settings.describe_etag}"', 'Cache-Control': 'no-cache'}
   log_function_footer(function_name, start_time)
-  return jsonify(response), 200, {'Content-Type': 'application/json'}
+  if request.method == 'GET' and request.if_none_match.contains(settings.describe_etag): return '', 304, headers
+  return settings.describe_body, 200, {'Content-Type': 'application/json', **headers}
 
 @app.route('/query', methods=['POST'])
 def query():
   function_name = 'query()'
   start_time = log_function_header(function_name)
-  vsid = default_search_vector_store_id
+  try:
+    set_request_priority(PRIORITY_QUERY)
+
+    # Get request data
+    with time_phase('parse'): request_data = request.get_json()
+    if not request_data or 'data' not in request_data or 'query' not in request_data['data']:
+      return jsonify({'error': 'Invalid request format'}), 400, {'Content-Type': 'application/json'}
+
+    query = request_data['data']['query']
+
+    # Optional scope: 'args': { 'domains': ['<domain key>', ...] }. Without scope all domains are searched.
+    args = request_data['data'].get('args') or {}
+    try:
+      vsids = get_vector_store_ids_for_domains(parse_domain_keys(args.get('domains') or args.get('domain')))
+    except ValueError as e:
+      return jsonify({'error': str(e)}), 400, {'Content-Type': 'application/json'}
+    vsid = vsids[0] if len(vsids) == 1 else vsids
+
+    if query and vsid:
+      print(f"  Query: {truncate_string(query,80)}")
+
+      # Search for matching query in canned answers
+      with time_phase('canned_answer_lookup'): data = canned_answers.find(query)
+      if data is not None:
+        if is_stream_requested(): return create_sse_response(stream_data_object(data))
+        return jsonify({'data': data}), 200, {'Content-Type': 'application/json'}
+
+      if is_stream_requested(): return create_sse_response(stream_search_data(query, vsid, use_semantic_cache=True))
+      data, body, response = get_search_data(query, vsid, use_semantic_cache=True)
+      return body, 200, {'Content-Type': 'application/json'}
+
+
+    # By default return empty response with correct structure
+    data = {
+      'query': query,
+      'answer': '',
+      'source_markers': ['【', '】'],
+      'sources': []
+    }
+    if is_stream_requested(): return create_sse_response(stream_data_object(data))
+    return jsonify({'data': data}), 200, {'Content-Type': 'application/json'}
+  finally:
+    log_function_footer(function_name, start_time)
+
+# Accepts a list of queries and returns one NDJSON line per query as soon as it is finished (not in request order):
+#   request:  { "data": { "queries": [ "<query>" | { "query": "<query>", "vsid": "<optional vector store id>", "domains": [<optional domain keys>], "id": <optional, echoed> }, ... ] } }
+#   response: { "index": <position in request>, "id": <id>, "data": { <same as /query> } } or { "index": ..., "id": ..., "error": "<message>" }
+@app.route('/query/batch', methods=['POST'])
+def query_batch():
+  function_name = 'query_batch()'
+  start_time = log_function_header(function_name)
 
-  # Get request data
-  request_data = request.get_json()
-  if not request_data or 'data' not in request_data or 'query' not in request_data['data']:
+  with time_phase('parse'): request_data = request.get_json(silent=True)
+  if not request_data or not isinstance(request_data.get('data'), dict) or not isinstance(request_data['data'].get('queries'), list):
     return jsonify({'error': 'Invalid request format'}), 400, {'Content-Type': 'application/json'}
+  items = request_data['data']['queries']
+  if len(items) > batch_max_queries:
+    return jsonify({'error': f"Too many queries ({len(items)}), maximum is {batch_max_queries}"}), 400, {'Content-Type': 'application/json'}
+  print(f"  Queries: {len(items)}")
+
+  def generate():
+    futures = {batch_executor.submit(get_batch_item_result, item): index for index, item in enumerate(items)}
+    try:
+      for future in as_completed(futures):
+        index = futures[future]
+        item = items[index]
+        result = {'index': index, 'id': item.get('id') if isinstance(item, dict) else None}
+        try:
+          result['data'] = future.result()
+        except Exception as e:
+          print(f"  Error in batch item {index}: {str(e)}")
+          result['error'] = str(e)
+        yield dumps(result) + "\n"
+    finally:
+      # Client disconnected or all done: don't start queries that nobody will receive
+      for future in futures: future.cancel()
+      log_function_footer(function_name, start_time)
+  return Response(stream_with_context(generate()), 200, {'Content-Type': 'application/x-ndjson', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Returns the data object for one /query/batch item. Runs in the batch worker pool.
+def get_batch_item_result(item):
+  set_request_priority(PRIORITY_BATCH)
+  set_request_deadline(batch_item_timeout_seconds)
+  query = item if isinstance(item, str) else (item.get('query') if isinstance(item, dict) else None)
+  if not isinstance(query, str): raise ValueError("Missing 'query'")
+  vsid = item.get('vsid') if isinstance(item, dict) else None
+  if not vsid:
+    vsids = get_vector_store_ids_for_domains(parse_domain_keys(item.get('domains') if isinstance(item, dict) else None))
+    vsid = vsids[0] if len(vsids) == 1 else vsids
+  if not query:
+    return {'query': query, 'answer': '', 'source_markers': ['【', '】'], 'sources': []}
+  with time_phase('canned_answer_lookup'): data = canned_answers.find(query)
+  if data is not None: return data
+  data, body, response = get_search_data(query, vsid, use_semantic_cache=True)
+  return data
 
-  query = request_data['data']['query']
-
-  if query and vsid:
-    print(f"  Query: {truncate_string(query,80)}")
-
-    # Search for matching query in demo responses
-    for item in DEMO_RESPONSES:
-      if item['query'].lower() == query.lower():
-        return jsonify({'data': {
-          'query': item['query'],
-          'answer': item['answer'],
-          'source_markers': item['source_markers'],
-          'sources': item['sources']
-        }}), 200, {'Content-Type': 'application/json'}
-
+# Serializes a data object into the '{"data": ...}' JSON body (UTF-8 bytes) returned by /query and /search
+def serialize_data(data):
+  return dumps_bytes({'data': data})
+
+# Returns (data, body, response) for the given query. Served from the response cache if possible, in which case response is None.
+# body is the serialized '{"data": data}' JSON, so cache hits skip build_data_object() and serialization.
+# With use_semantic_cache (/query), exact cache misses are looked up in the semantic cache before the search runs.
+def get_search_data(query, vsid, backend=None, use_semantic_cache=False):
+  backend = backend or default_search_backend
+  cache_key, data, body = get_cached_search_data(query, vsid, backend)
+  if data is not None: return data, body, None
+  semantic_lookup = None
+  if use_semantic_cache:
+    semantic_lookup, data, body = get_semantic_cached_search_data(query, vsid, backend)
+    if data is not None: return data, body, None
+  if single_flight is None:
+    data, body, response, complete = fetch_search_data(query, vsid, backend, cache_key)
+    if complete: set_semantic_cached_search_data(semantic_lookup, query, data, body)
+    return data, body, response
+
+  # Concurrent identical requests wait for one upstream call and share its result
+  flight_key = cache_key or build_cache_key(query, vsid, azure_openai_model_deployment_name, search_max_num_results, search_temperature, backend=backend)
+  def recheck():
+    cached_response = response_cache.get(cache_key) if cache_key is not None else None
+    return None if cached_response is None else (cached_response.data, cached_response.body, None, True)
+  (data, body, response, complete), shared = single_flight.do(flight_key, lambda: fetch_search_data(query, vsid, backend, cache_key), recheck)
+  if shared:
+    print(f"  Coalesced with identical in-flight request.")
+    # Near-duplicate keys can coalesce queries that are written differently
+    if data['query'] != query:
+      data = {**data, 'query': query}
+      body = serialize_data(data)
+  elif complete:
+    set_semantic_cached_search_data(semantic_lookup, query, data, body)
+  return data, body, response
+
+# Calls the search backend (with rate limit retries), builds the data object and stores it in the response cache. Returns (data, body, response, complete).
+# complete is False for federated searches where some vector stores were skipped or failed: these results are returned but not cached.
+def fetch_search_data(query, vsid, backend, cache_key):
+  complete = True
+  if isinstance(vsid, list):
+    search_results, response, complete = get_federated_search_results(query, vsid, generate_answer=(backend == 'responses'))
+  else:
     search_results, response = retry_on_openai_errors(
-      lambda:get_search_results_using_responses(openai_client, azure_openai_model_deployment_name, query, vsid, 4, 0, 100)
+      lambda:get_search_results(get_openai_client(), backend, azure_openai_model_deployment_name, query, vsid, search_max_num_results, search_temperature, search_max_output_tokens)
       ,indentation=2
     )
+  with time_phase('build_data_object'): data = build_data_object(query, search_results, response)
+  with time_phase('serialize'): body = serialize_data(data)
+  if cache_key is not None and complete: response_cache.set(cache_key, data, body)
+  return data, body, response, complete
+
+# Searches multiple vector stores in parallel and merges the results by score. Latency is bounded by the slowest store up to federated_search_timeout_seconds,
+# stores that don't answer in time or fail are left out. If generate_answer is True, the answer is generated from the merged top results.
+# Returns (search_results, response, complete), complete is False if stores were left out. Raises DeadlineExceededError (504) if no store answered in time.
+def get_federated_search_results(query, vsids, generate_answer):
+  # Each search gets a copy of the request context (e.g. the request priority for the rate limiter)
+  futures = {federated_executor.submit(contextvars.copy_context().run, search_vector_store, query, vsid): vsid for vsid in vsids}
+  done, not_done = wait(futures, timeout=federated_search_timeout_seconds)
+  for future in not_done:
+    future.cancel()
+    print(f"  Vector store '{futures[future]}' did not answer within {federated_search_timeout_seconds} seconds, skipped.")
+  search_result_lists = []
+  errors = []
+  for future in done:
+    try:
+      search_result_lists.append(future.result())
+    except Exception as e:
+      print(f"  Vector store '{futures[future]}' failed: {str(e)}")
+      errors.append(e)
+  if not search_result_lists and errors: raise errors[0]
+  if not search_result_lists: raise DeadlineExceededError(f"None of the {len(vsids)} vector stores answered within {federated_search_timeout_seconds} seconds.")
+  complete = len(search_result_lists) == len(vsids)
+  search_results = merge_search_results(search_result_lists, search_max_num_results)
+  print(f"  Federated search: {len(search_result_lists)} of {len(vsids)} vector stores, {len(search_results)} merged results{'' if complete else ' (not cached)'}.")
+  response = None
+  if generate_answer and search_results:
+    response = retry_on_openai_errors(
+      lambda:get_answer_for_search_results(get_openai_client(), azure_openai_model_deployment_name, query, search_results, search_temperature, search_max_output_tokens)
+      ,indentation=2
+    )
+  return search_results, response, complete
 
-    data = build_data_object(query, search_results, response)
-    return jsonify({'data': data}), 200, {'Content-Type': 'application/json'}
-
-
-  # By default return empty response with correct structure
-  return jsonify({'data': {
-    'query': query,
-    'answer': '',
-    'source_markers': ['【', '】'],
-    'sources': []
-  }}), 200, {'Content-Type': 'application/json'}
-
-  log_function_footer(function_name, start_time)
-
-# Convert search_results to data object as required by /query endpoint with array of sources { "data": "<text>", "source": "<url>", "metadata": { <attributes> } }
-def build_data_object(query, search_results, response):
+# Returns the search results of a single vector store for a federated search, without answer
+def search_vector_store(query, vsid):
+  # The per-store timeout also ends the HTTP request, so slow stores don't keep the worker busy after they were skipped
+  client = get_openai_client().with_options(timeout=federated_search_timeout_seconds)
+  search_results, response = retry_on_openai_errors(
+    lambda:get_search_results(client, 'retrieval_only', azure_openai_model_deployment_name, query, vsid, search_max_num_results, search_temperature, search_max_output_tokens)
+    ,indentation=2
+    ,retries=2
+  )
+  return search_results
+
+# Returns (cache_key, data, body) from the response cache. data and body are None on a cache miss, cache_key is None if caching is disabled.
+def get_cached_search_data(query, vsid, backend):
+  if response_cache is None: return None, None, None
+  cache_key = response_cache.make_key(query, vsid, azure_openai_model_deployment_name, search_max_num_results, search_temperature, backend)
+  with time_phase('cache_lookup'): cached_response = response_cache.get(cache_key)
+  if cached_response is None: return cache_key, None, None
+  print(f"  Response cache hit.")
+  # Near-duplicate hits return the query as asked by the current user
+  if cached_response.data['query'] != query:
+    data = {**cached_response.data, 'query': query}
+    return cache_key, data, serialize_data(data)
+  return cache_key, cached_response.data, cached_response.body
+
+# Returns (lookup, data, body) from the semantic cache. lookup (embedding, scope, vector store ids) is passed to set_semantic_cached_search_data()
+# after the search. It is None if the semantic cache is disabled or the query could not be embedded, data and body are None on a miss.
+def get_semantic_cached_search_data(query, vsid, backend):
+  if semantic_cache is None: return None, None, None
+  vsids = vsid if isinstance(vsid, list) else [vsid]
+  # Same parameters as the response cache key, without the query
+  scope = build_cache_key("", vsids, azure_openai_model_deployment_name, search_max_num_results, search_temperature, backend=backend)
+  with time_phase('semantic_cache_lookup'):
+    semantic_cache.check_versions(vsids)
+    try:
+      vector = semantic_cache.embed(query)
+      hit = semantic_cache.get(vector, scope)
+    except Exception as e:
+      print(f"  Semantic cache lookup failed: {str(e)}")
+      semantic_cache.record_error()
+      return None, None, None
+  lookup = (vector, scope, vsids)
+  if hit is None: return lookup, None, None
+  print(f"  Semantic cache hit (similarity {hit.similarity:.3f}): {truncate_string(hit.query, 80)}")
+  # The answer of the similar query is returned for the query as asked by the current user
+  data = {**hit.data, 'query': query}
+  return lookup, data, serialize_data(data)
+
+# Stores the result of a search in the semantic cache. Results without sources are not stored, so they don't answer similar queries.
+def set_semantic_cached_search_data(lookup, query, data, body):
+  if lookup is None or not data['sources']: return
+  vector, scope, vsids = lookup
+  semantic_cache.set(vector, scope, vsids, query, data, body)
+
+# Streaming version of get_search_data(). Yields (event_type, value) tuples:
+#   ("sources", data object without 'answer') -> as soon as the search results are available
+#   ("answer_delta", str)                     -> for each chunk of the answer
+#   ("data", data object)                     -> the complete data object, same as returned by get_search_data()
+def stream_search_data(query, vsid, backend=None, use_semantic_cache=False):
+  backend = backend or default_search_backend
+  # Only the Responses API with a single vector store streams, other backends and federated searches return all results at once
+  if backend != "responses" or isinstance(vsid, list):
+    data, body, response = get_search_data(query, vsid, backend, use_semantic_cache)
+    yield from stream_data_object(data)
+    return
+  cache_key, data, body = get_cached_search_data(query, vsid, backend)
+  if data is not None:
+    yield from stream_data_object(data)
+    return
+  semantic_lookup = None
+  if use_semantic_cache:
+    semantic_lookup, data, body = get_semantic_cached_search_data(query, vsid, backend)
+    if data is not None:
+      yield from stream_data_object(data)
+      return
+  # Streams always use the sync client, the generator runs in the request thread anyway
   sources = []
-  sourceDocLibUrl = default_sharepoint_source_url
-  if not sourceDocLibUrl.endswith("/"): sourceDocLibUrl += "/"
-  for result in search_results:
-    source = {
+  for event_type, value in stream_search_results_using_responses(get_openai_client(), azure_openai_model_deployment_name, query, vsid, search_max_num_results, search_temperature, search_max_output_tokens, indentation=2):
+    if event_type == "search_results":
+      sources = build_sources(value)
+      yield "sources", {"query": query, "source_markers": ["【", "】"], "sources": sources}
+    elif event_type == "output_text_delta":
+      yield "answer_delta", value
+    elif event_type == "completed":
+      data = {"query": query, "answer": value.output_text, "source_markers": ["【", "】"], "sources": sources}
+      if cache_key is not None or semantic_lookup is not None:
+        body = serialize_data(data)
+        if cache_key is not None: response_cache.set(cache_key, data, body)
+        set_semantic_cached_search_data(semantic_lookup, query, data, body)
+      yield "data", data
+
+# Yields the events of stream_search_data() for an already complete data object (canned answers, cache hits)
+def stream_data_object(data):
+  yield "sources", {"query": data['query'], "source_markers": data['source_markers'], "sources": data['sources']}
+  if data['answer']: yield "answer_delta", data['answer']
+  yield "data", data
+
+# Returns True if the client asked for a streamed response with '?stream=1' or 'Accept: text/event-stream'
+def is_stream_requested():
+  return request.args.get('stream', '').lower() in ['1', 'true'] or 'text/event-stream' in request.headers.get('Accept', '')
+
+# Formats a single server-sent event with JSON data
+def format_sse(event, data):
+  return f"event: {event}\ndata: {dumps(data)}\n\n"
+
+# Returns a server-sent events response for the events of stream_search_data(). Events:
+#   'sources' -> {"query", "source_markers", "sources"}, 'delta' -> {"delta": "<answer chunk>"}, 'done' -> {"data": <data object>}, 'error' -> {"error": "<message>"}
+def create_sse_response(events):
+  def generate():
+    try:
+      for event_type, value in events:
+        if event_type == "sources": yield format_sse('sources', value)
+        elif event_type == "answer_delta": yield format_sse('delta', {'delta': value})
+        elif event_type == "data": yield format_sse('done', {'data': value})
+    except Exception as e:
+      print(f"  Error: {str(e)}")
+      yield format_sse('error', {'error': str(e)})
+  return Response(stream_with_context(generate()), 200, {'Content-Type': 'text/event-stream; charset=utf-8', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Returns a HTML response for the events of stream_search_data() that is flushed progressively: query, then sources, then the answer as it is generated
+def create_html_stream_response(query, events):
+  def generate():
+    yield f"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>Search Results</title></head><body><table border=1><tr><td>query</td><td>{html.escape(query)}</td></tr>"""
+    answer_started = False
+    try:
+      for event_type, value in events:
+        if event_type == "sources":
+          yield f"<tr><td>sources</td><td>{''.join(iter_search_html_table(value['sources']))}</td></tr>"
+        elif event_type == "answer_delta":
+          if not answer_started: yield "<tr><td>answer</td><td>"
+          answer_started = True
+          yield html.escape(value)
+    except Exception as e:
+      print(f"  Error: {str(e)}")
+      if answer_started: yield "</td></tr>"
+      answer_started = False
+      yield f"<tr><td>error</td><td>{html.escape(str(e))}</td></tr>"
+    if answer_started: yield "</td></tr>"
+    yield "</table></body></html>"
+  return Response(stream_with_context(generate()), 200, {'Content-Type': 'text/html; charset=utf-8', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Yields the HTML table of the given data with the /search limits for long texts and lists
+def iter_search_html_table(data):
+  return iter_nested_html_table(data, max_string_length=search_html_max_text_length, max_list_items=search_html_max_list_items)
+
+# Yields the HTML document of /search for the given data object
+def iter_search_html_document(data):
+  yield """<!DOCTYPE html><html><head><meta charset="utf-8"><title>Search Results</title></head><body>"""
+  yield from iter_search_html_table(data)
+  yield "</body></html>"
+
+# Convert search_results to the array of sources as required by /query endpoint { "data": "<text>", "source": "<url>", "metadata": { <attributes> } }
+# The texts are shared with the search results (no copies), they are copied only once when the body is serialized
+def build_sources(search_results):
+  settings = crawler_settings.get()
+  source_urls_by_vector_store_id, default_source_url = settings.source_urls_by_vector_store_id, settings.default_source_url
+  return [
+    {
       "data": result.content[0].text if result.content else "",
-      "source": f"{sourceDocLibUrl}{result.filename}",
+      "source": f"{source_urls_by_vector_store_id.get(result.vector_store_id, default_source_url)}{result.filename}",
       "metadata": result.attributes
-    }
-    sources.append(source)
+    } for result in search_results
+  ]
+
+# Convert search_results to data object as required by /query endpoint with array of sources { "data": "<text>", "source": "<url>", "metadata": { <attributes> } }
+# response is None for search backends that do not generate an answer
+def build_data_object(query, search_results, response):
   data = {
     "query": query
-    ,"answer": response.output_text
+    ,"answer": response.output_text if response is not None else ""
     ,"source_markers": ["【", "】"]
-    ,"sources": sources
+    ,"sources": build_sources(search_results)
   }
   return data
   
 
+# Returns the response cache hit/miss counters
+@app.route('/cache/stats')
+def cache_stats():
+  if response_cache is None: return jsonify({'data': {'enabled': False}}), 200, {'Content-Type': 'application/json'}
+  return jsonify({'data': {'enabled': True, **response_cache.get_stats()}}), 200, {'Content-Type': 'application/json'}
+
+# Returns the semantic cache counters
+@app.route('/semanticcache/stats')
+def semantic_cache_stats():
+  if semantic_cache is None: return jsonify({'data': {'enabled': False}}), 200, {'Content-Type': 'application/json'}
+  return jsonify({'data': {'enabled': True, **semantic_cache.get_stats()}}), 200, {'Content-Type': 'application/json'}
+
+# Removes the semantic cache entries of a vector store, e.g. after it was re-indexed by the crawler: { "data": { "vsid": "<vector store id>" } }
+# Without 'vsid' all entries are removed.
+@app.route('/semanticcache/invalidate', methods=['POST'])
+def semantic_cache_invalidate():
+  if semantic_cache is None: return jsonify({'data': {'enabled': False}}), 200, {'Content-Type': 'application/json'}
+  request_data = request.get_json(silent=True) or {}
+  vsid = (request_data.get('data') or {}).get('vsid') or None
+  return jsonify({'data': {'enabled': True, 'invalidated': semantic_cache.invalidate(vsid)}}), 200, {'Content-Type': 'application/json'}
+
+# Returns the routing state per deployment of the pool (circuit, in flight, latency, errors, tokens)
+@app.route('/deployments/stats')
+def deployments_stats():
+  if deployment_pool is None: return jsonify({'data': {'enabled': False}}), 200, {'Content-Type': 'application/json'}
+  return jsonify({'data': {'enabled': True, 'deployments': deployment_pool.get_stats()}}), 200, {'Content-Type': 'application/json'}
+
+# Returns the hedging counters (hedged calls and which call answered first)
+@app.route('/hedging/stats')
+def hedging_stats():
+  if hedging_policy is None: return jsonify({'data': {'enabled': False}}), 200, {'Content-Type': 'application/json'}
+  return jsonify({'data': {'enabled': True, **hedging_policy.get_stats()}}), 200, {'Content-Type': 'application/json'}
+
+# Returns the request coalescing counters
+@app.route('/singleflight/stats')
+def single_flight_stats():
+  if single_flight is None: return jsonify({'data': {'enabled': False}}), 200, {'Content-Type': 'application/json'}
+  return jsonify({'data': {'enabled': True, **single_flight.get_stats()}}), 200, {'Content-Type': 'application/json'}
+
+# Returns request, phase and upstream latency histograms, token usage and retry counters in the Prometheus text format (per worker process)
+@app.route('/metrics')
+def metrics():
+  return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# Returns the canned answer counters and the number of loaded entries
+@app.route('/cannedanswers/stats')
+def canned_answers_stats():
+  return jsonify({'data': canned_answers.get_stats()}), 200, {'Content-Type': 'application/json'}
+
+# Returns the rate limiter counters and remaining quota per deployment
+@app.route('/ratelimit/stats')
+def rate_limit_stats():
+  if rate_limiter is None: return jsonify({'data': {'enabled': False}}), 200, {'Content-Type': 'application/json'}
+  return jsonify({'data': {'enabled': True, 'deployments': rate_limiter.get_stats()}}), 200, {'Content-Type': 'application/json'}
+
 # https://platform.openai.com/docs/guides/tools-file-search
 # https://github.com/openai/openai-python/blob/main/src/openai/resources/responses/responses.py
 @app.route('/search')
 def search():
   function_name = 'search()'
   start_time = log_function_header(function_name)
+  try:
+    set_request_priority(PRIORITY_SEARCH)
+
+    # Get query parameters
+    query = request.args.get('query')
+    vsid = request.args.get('vsid')
+    domain = request.args.get('domain')
+    format = request.args.get('format', 'html')
+    backend = request.args.get('backend', default_search_backend)
+    # '&answer=false' returns only the search results, without generating an answer
+    if request.args.get('answer', 'true').lower() in ['false', '0'] and backend == 'responses': backend = 'retrieval_only'
+
+    if not query:
+      message = "Missing 'query' parameter"
+      if format == 'json': return jsonify({"error": message}), 400, {'Content-Type': 'application/json'}
+      else: return message, 400, {'Content-Type': 'text/plain'}
+    if not vsid and not domain:
+      message = "Missing 'vsid' (vector store id) or 'domain' (comma separated domain keys) parameter"
+      if format == 'json': return jsonify({"error": message}), 400, {'Content-Type': 'application/json'}
+      else: return message, 400, {'Content-Type': 'text/plain'}
+    if not vsid:
+      try:
+        vsids = get_vector_store_ids_for_domains(parse_domain_keys(domain))
+      except ValueError as e:
+        if format == 'json': return jsonify({"error": str(e)}), 400, {'Content-Type': 'application/json'}
+        else: return str(e), 400, {'Content-Type': 'text/plain'}
+      vsid = vsids[0] if len(vsids) == 1 else vsids
+
+    if backend not in SEARCH_BACKENDS:
+      message = f"Unknown 'backend' parameter '{backend}'. Supported: {', '.join(SEARCH_BACKENDS.keys())}"
+      if format == 'json': return jsonify({"error": message}), 400, {'Content-Type': 'application/json'}
+      else: return message, 400, {'Content-Type': 'text/plain'}
 
-  # Get query parameters
-  query = request.args.get('query')
-  vsid = request.args.get('vsid')
-  format = request.args.get('format', 'html')
-  
-  if not query:
-    message = "Missing 'query' parameter"
-    if format == 'json': return jsonify({"error": message}), 400, {'Content-Type': 'application/json'}
-    else: return message, 400, {'Content-Type': 'text/plain'}
-  if not vsid:
-    message = "Missing 'vsid' (vector store id) parameter"
-    if format == 'json': return jsonify({"error": message}), 400, {'Content-Type': 'application/json'}
-    else: return message, 400, {'Content-Type': 'text/plain'}
+    print(f"  Query: {truncate_string(query,80)}")
 
-  print(f"  Query: {truncate_string(query,80)}")
+    if is_stream_requested():
+      if format == 'json' or 'text/event-stream' in request.headers.get('Accept', ''): return create_sse_response(stream_search_data(query, vsid, backend))
+      return create_html_stream_response(query, stream_search_data(query, vsid, backend))
 
-  # try:
-  search_results, response = retry_on_openai_errors(
-    lambda:get_search_results_using_responses(openai_client, azure_openai_model_deployment_name, query, vsid, 4, 0, 100)
-    ,indentation=2
-  )
-  data = build_data_object(query, search_results, response)
+    # try:
+    data, body, response = get_search_data(query, vsid, backend)
 
-  print(f"  Response: {truncate_string(response.output_text,80)}")
-  print(f"  status='{response.status}', tool_choice='{response.tool_choice}', input_tokens={response.usage.input_tokens}, output_tokens={response.usage.output_tokens}")
-  # except Exception as e:
-  #   print(f"    Error: {str(e)}")
-  #   return jsonify({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+    print(f"  Response: {truncate_string(data['answer'],80)}")
+    if response is not None:
+      print(f"  status='{response.status}', tool_choice='{response.tool_choice}', input_tokens={response.usage.input_tokens}, output_tokens={response.usage.output_tokens}")
+    # except Exception as e:
+    #   print(f"    Error: {str(e)}")
+    #   return jsonify({"error": str(e)}), 500, {'Content-Type': 'application/json'}
 
-  # If no match found, return empty response with correct structure
-  if format == 'json':
-    return jsonify({"data": data}), 200, {'Content-Type': 'application/json'}
-  else:
-    # For HTML response, convert the data dict to HTML table and wrap in proper HTML document
-    table_html = convert_to_nested_html_table(data)
-    output_html = f"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>Search Results</title></head><body>{table_html}</body></html>"""
-    return output_html, 200, {'Content-Type': 'text/html; charset=utf-8'}
-    
-  log_function_footer(function_name, start_time)
+    # If no match found, return empty response with correct structure
+    if format == 'json':
+      return body, 200, {'Content-Type': 'application/json'}
+    else:
+      # For HTML response, stream the data dict as HTML table in a proper HTML document
+      return Response(stream_with_context(iter_timed(iter_chunks(iter_search_html_document(data)), 'render_html')), 200, {'Content-Type': 'text/html; charset=utf-8'})
+
+  finally:
+    log_function_footer(function_name, start_time)
 
 if __name__ == '__main__':
+  warm_up()
   app.run(
     host='0.0.0.0',      # Required for Azure
     port=int(os.environ.get('PORT', 5000)),
@@ -0,0 +1,239 @@
+# Canned answers for /query: hash index over a JSONL file (memory-mapped, shared between workers) with optional n-gram fuzzy matching and hot reload
+# Copyright 2025, Karsten Held (MIT License)
+
+import json
+import mmap
+import os
+import threading
+import time
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from response_cache import normalize_query
+from utils import truncate_string
+
+# Fuzzy matching: character n-gram size, maximum number of posting list entries scanned per lookup and number of candidates verified
+NGRAM_SIZE = 3
+FUZZY_MAX_SCANNED_POSTINGS = 20000
+FUZZY_MAX_CANDIDATES = 8
+
+
+# Exact lookups ignore case and whitespace differences (same behavior as the former linear scan, which compared lower-cased queries)
+def normalize_canned_query(query: str) -> str:
+  return " ".join(query.casefold().split())
+
+def get_ngrams(query: str, n: int = NGRAM_SIZE) -> set:
+  padded = f" {normalize_query(query, near_duplicate=True)} "
+  return {padded[i:i+n] for i in range(max(1, len(padded) - n + 1))}
+
+# Returns the /query data object of a canned answer entry { "query", "answer", "source_markers" (optional), "sources" }
+def to_data_object(entry: Dict[str, Any]) -> Dict[str, Any]:
+  return {
+    'query': entry['query'],
+    'answer': entry.get('answer', ''),
+    'source_markers': entry.get('source_markers') or ['【', '】'],
+    'sources': entry.get('sources') or []
+  }
+
+
+# Immutable index over a buffer of JSONL lines (mmap of the file or bytes). Entries are parsed only on lookup, so the per-process
+# memory is one hash -> entry number dict plus offset arrays. The mmap pages are shared by all gunicorn workers via the page cache.
+class CannedAnswerIndex:
+  def __init__(self, buffer, build_ngrams: bool = False):
+    self._buffer = buffer
+    self._offsets = array('Q')
+    self._lengths = array('I')
+    self._entry_numbers: Dict[int, int] = {}      # hash(normalized query) -> entry number, later lines win
+    self._ngram_postings: Dict[str, array] = {}   # n-gram -> entry numbers
+    self._ngram_counts = array('H')
+    self.invalid_lines = 0
+    position = 0
+    size = len(buffer)
+    while position < size:
+      end = buffer.find(b"\n", position)
+      if end < 0: end = size
+      line = buffer[position:end].strip()
+      if line:
+        try:
+          query = json.loads(line)['query']
+          if not isinstance(query, str): raise ValueError("'query' is not a string")
+        except (ValueError, KeyError, TypeError):
+          self.invalid_lines += 1
+        else:
+          self._add(query, position, end - position, build_ngrams)
+      position = end + 1
+
+  def _add(self, query: str, offset: int, length: int, build_ngrams: bool):
+    entry_number = len(self._offsets)
+    self._offsets.append(offset)
+    self._lengths.append(length)
+    self._entry_numbers[hash(normalize_canned_query(query))] = entry_number
+    if build_ngrams:
+      ngrams = get_ngrams(query)
+      self._ngram_counts.append(min(len(ngrams), 65535))
+      for ngram in ngrams:
+        postings = self._ngram_postings.get(ngram)
+        if postings is None:
+          postings = self._ngram_postings[ngram] = array('I')
+        postings.append(entry_number)
+
+  def __len__(self) -> int:
+    return len(self._entry_numbers)
+
+  def _read_entry(self, entry_number: int) -> Dict[str, Any]:
+    offset = self._offsets[entry_number]
+    return json.loads(self._buffer[offset:offset + self._lengths[entry_number]])
+
+  # Returns the entry with the same normalized query or None
+  def get(self, query: str) -> Optional[Dict[str, Any]]:
+    normalized_query = normalize_canned_query(query)
+    entry_number = self._entry_numbers.get(hash(normalized_query))
+    if entry_number is None: return None
+    entry = self._read_entry(entry_number)
+    # Hash collision check
+    if normalize_canned_query(entry['query']) != normalized_query: return None
+    return entry
+
+  # Returns (entry, similarity) of the most similar query with a Dice coefficient over n-grams >= min_similarity, or None.
+  # Candidates are collected from the rarest n-grams of the query only, so the lookup cost does not grow with the number of entries.
+  def find_similar(self, query: str, min_similarity: float) -> Optional[tuple[Dict[str, Any], float]]:
+    if not self._ngram_postings: return None
+    query_ngrams = get_ngrams(query)
+    postings_list = sorted((self._ngram_postings[ngram] for ngram in query_ngrams if ngram in self._ngram_postings), key=len)
+    candidate_counts = Counter()
+    scanned_postings = 0
+    for postings in postings_list:
+      if scanned_postings and scanned_postings + len(postings) > FUZZY_MAX_SCANNED_POSTINGS: break
+      candidate_counts.update(postings)
+      scanned_postings += len(postings)
+    best = None
+    for entry_number, _ in candidate_counts.most_common(FUZZY_MAX_CANDIDATES):
+      # Upper bound of the similarity from the n-gram counts, skips candidates that can't reach the threshold without parsing them
+      entry_ngram_count = self._ngram_counts[entry_number]
+      if 2.0 * min(len(query_ngrams), entry_ngram_count) / (len(query_ngrams) + entry_ngram_count) < min_similarity: continue
+      entry = self._read_entry(entry_number)
+      entry_ngrams = get_ngrams(entry['query'])
+      similarity = 2.0 * len(query_ngrams & entry_ngrams) / (len(query_ngrams) + len(entry_ngrams))
+      if similarity >= min_similarity and (best is None or similarity > best[1]):
+        best = (entry, similarity)
+    return best
+
+
+# Opens a canned answers file as buffer for CannedAnswerIndex. JSONL files are memory-mapped, JSON files (one array of entries) are converted to JSONL in memory.
+def open_canned_answers_buffer(path: str):
+  with open(path, "rb") as file:
+    if os.fstat(file.fileno()).st_size == 0: return b""
+    first_byte = file.read(64).lstrip()[:1]
+    if first_byte == b"[":
+      file.seek(0)
+      return encode_jsonl(json.load(file))
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def encode_jsonl(entries: List[Dict[str, Any]]) -> bytes:
+  return "\n".join(json.dumps(entry, ensure_ascii=False) for entry in entries).encode("utf-8")
+
+@dataclass
+class CannedAnswerStats:
+  exact_hits: int = 0
+  fuzzy_hits: int = 0
+  misses: int = 0
+  reloads: int = 0
+  reload_errors: int = 0
+
+
+# Canned answers from a file (reloaded when it changes) and built-in entries (demodata.DEMO_RESPONSES). File entries take precedence.
+# Replace the file atomically (write a temporary file, then rename): a file truncated in place while it is memory-mapped can crash the workers.
+class CannedAnswers:
+  def __init__(self, path: Optional[str] = None, builtin_entries: Optional[List[Dict[str, Any]]] = None, fuzzy_min_similarity: float = 0, reload_interval_seconds: float = 5):
+    self.path = path
+    self.fuzzy_min_similarity = fuzzy_min_similarity
+    self.reload_interval_seconds = reload_interval_seconds
+    self.stats = CannedAnswerStats()
+    self._builtin_index = CannedAnswerIndex(encode_jsonl(builtin_entries or []), build_ngrams=fuzzy_min_similarity > 0)
+    self._file_index: Optional[CannedAnswerIndex] = None
+    self._file_signature = None
+    self._next_reload_check = 0.0
+    self._loaded_at = None
+    self._reload_lock = threading.Lock()
+    self.reload_if_changed(force=True)
+
+  # Returns the /query data object of the matching canned answer or None
+  def find(self, query: str) -> Optional[Dict[str, Any]]:
+    self.reload_if_changed()
+    indexes = [index for index in (self._file_index, self._builtin_index) if index is not None]
+    for index in indexes:
+      entry = index.get(query)
+      if entry is not None:
+        self.stats.exact_hits += 1
+        return to_data_object(entry)
+    if self.fuzzy_min_similarity > 0:
+      best = None
+      for index in indexes:
+        match = index.find_similar(query, self.fuzzy_min_similarity)
+        if match is not None and (best is None or match[1] > best[1]): best = match
+      if best is not None:
+        self.stats.fuzzy_hits += 1
+        print(f"  Canned answer: fuzzy match '{truncate_string(best[0]['query'], 80)}' (similarity {best[1]:.2f})")
+        return to_data_object(best[0])
+    self.stats.misses += 1
+    return None
+
+  # Rebuilds the file index if the file was modified, at most every reload_interval_seconds. Other threads keep using the old index meanwhile.
+  def reload_if_changed(self, force: bool = False):
+    if not self.path: return
+    now = time.monotonic()
+    if not force and now < self._next_reload_check: return
+    if not self._reload_lock.acquire(blocking=force): return
+    try:
+      self._next_reload_check = now + self.reload_interval_seconds
+      try:
+        stat = os.stat(self.path)
+      except OSError:
+        if self._file_index is not None or force: print(f"Canned answers: file '{self.path}' not found.")
+        self._file_index = None
+        self._file_signature = None
+        return
+      signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+      if signature == self._file_signature: return
+      try:
+        start_time = time.perf_counter()
+        index = CannedAnswerIndex(open_canned_answers_buffer(self.path), build_ngrams=self.fuzzy_min_similarity > 0)
+      except (OSError, ValueError) as e:
+        self.stats.reload_errors += 1
+        print(f"Canned answers: loading '{self.path}' failed: {str(e)}")
+        return
+      # The old index (and its mmap) is released when the last lookup using it has finished
+      self._file_index = index
+      self._file_signature = signature
+      self._loaded_at = time.time()
+      if not force: self.stats.reloads += 1
+      print(f"Canned answers: loaded {len(index)} entries from '{self.path}' in {time.perf_counter() - start_time:.3f} secs" + (f" ({index.invalid_lines} invalid lines skipped)" if index.invalid_lines else "") + ".")
+    finally:
+      self._reload_lock.release()
+
+  def get_stats(self) -> Dict[str, Any]:
+    file_index = self._file_index
+    return {
+      "file_entries": len(file_index) if file_index is not None else 0
+      ,"builtin_entries": len(self._builtin_index)
+      ,"exact_hits": self.stats.exact_hits
+      ,"fuzzy_hits": self.stats.fuzzy_hits
+      ,"misses": self.stats.misses
+      ,"reloads": self.stats.reloads
+      ,"reload_errors": self.stats.reload_errors
+      ,"path": self.path
+      ,"loaded_at": self._loaded_at
+      ,"fuzzy_min_similarity": self.fuzzy_min_similarity
+    }
+
+
+# Creates the canned answers from environment variables and the built-in entries
+def create_canned_answers_from_env(builtin_entries: Optional[List[Dict[str, Any]]] = None) -> CannedAnswers:
+  return CannedAnswers(
+    path=os.getenv("CANNED_ANSWERS_PATH") or None
+    ,builtin_entries=builtin_entries
+    ,fuzzy_min_similarity=float(os.getenv("CANNED_ANSWERS_FUZZY_MIN_SIMILARITY", "0"))
+    ,reload_interval_seconds=float(os.getenv("CANNED_ANSWERS_RELOAD_INTERVAL_SECONDS", "5"))
+  )
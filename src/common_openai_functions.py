@@ -2,10 +2,11 @@
 # Copyright 2025, Karsten Held (MIT License)
 
 import os
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import openai
 import httpx
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from typing import List, Optional, Union, Iterable, Literal, Dict
 from openai.types.responses import (ResponseInputParam,ResponseTextConfigParam,ToolParam)
 from openai.types.responses.response_includable import ResponseIncludable
@@ -15,21 +16,30 @@ from openai.types.shared_params.reasoning import Reasoning
 from openai.types.responses import response_create_params
 from openai._types import NOT_GIVEN, NotGiven
 from openai._types import Headers, Query, Body
+from rate_limiter import RateLimiter, get_retry_after_seconds
+from request_metrics import time_phase, time_upstream_call, record_retry, record_token_usage, record_deadline_exceeded, upstream_latency
+from request_deadline import DeadlineExceededError, check_deadline, get_remaining_seconds, can_finish_in_time
+from hedging import HedgingPolicy
+from deployment_pool import DeploymentPool
+import random
 import time
 
 
-@dataclass
+# Search results are created for every result of every request, slots keep them small and fast to create
+@dataclass(slots=True)
 class CoaiSearchContent:
   text: str
   type: Literal["text"]
 
-@dataclass
+@dataclass(slots=True)
 class CoaiSearchResponse:
   content: List[CoaiSearchContent]
   file_id: str
   filename: str
   score: float
   attributes: Optional[Dict[str, Union[str, float, bool]]] = None
+  # Vector store the result was found in, set by get_search_results() and stream_search_results_using_responses() (selects the document library url)
+  vector_store_id: Optional[str] = None
 
 # Copy the needed parameters from create() function (current version: 1.79.0):
 # https://github.com/openai/openai-python/blob/main/src/openai/resources/responses/responses.py
@@ -46,7 +56,7 @@ class CoaiResponseParams:
   reasoning: Optional[Reasoning] | NotGiven = NOT_GIVEN
   service_tier: Optional[Literal["auto", "default", "flex"]] | NotGiven = NOT_GIVEN
   store: Optional[bool] | NotGiven = NOT_GIVEN
-  stream: Optional[Literal[False]] | NotGiven = NOT_GIVEN
+  stream: Optional[bool] | NotGiven = NOT_GIVEN
   temperature: Optional[float] | NotGiven = NOT_GIVEN
   text: ResponseTextConfigParam | NotGiven = NOT_GIVEN
   tool_choice: response_create_params.ToolChoice | NotGiven = NOT_GIVEN
@@ -63,39 +73,280 @@ class CoaiResponseParams:
 
 
 
-def create_openai_client(api_key):
-  return openai.OpenAI(api_key=api_key)
+# Connection pool, timeouts and token refresh of the OpenAI / Azure OpenAI clients, see get_client_settings_from_env()
+@dataclass
+class CoaiClientSettings:
+  max_connections: int = 100
+  max_keepalive_connections: int = 20
+  keepalive_expiry_seconds: float = 30
+  http2: bool = False
+  timeout_seconds: float = 600          # read / write timeout (default of the openai package)
+  connect_timeout_seconds: float = 5
+  token_refresh_margin_seconds: float = 300  # Azure AD tokens are refreshed this long before they expire
+
+def get_client_settings_from_env() -> CoaiClientSettings:
+  return CoaiClientSettings(
+    max_connections=int(os.getenv("OPENAI_HTTP_MAX_CONNECTIONS", "100"))
+    ,max_keepalive_connections=int(os.getenv("OPENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    ,keepalive_expiry_seconds=float(os.getenv("OPENAI_HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+    ,http2=os.getenv("OPENAI_HTTP2", "false").lower() in ['true']
+    ,timeout_seconds=float(os.getenv("OPENAI_TIMEOUT_SECONDS", "600"))
+    ,connect_timeout_seconds=float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+    ,token_refresh_margin_seconds=float(os.getenv("AZURE_AD_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+  )
+
+# Returns the keyword arguments for openai.DefaultHttpxClient (httpx.Client with the defaults of the openai package)
+def _get_http_client_args(client_settings: CoaiClientSettings) -> Dict:
+  http2 = client_settings.http2
+  if http2:
+    try:
+      import h2  # noqa: F401 (needed by httpx for HTTP/2)
+    except ImportError:
+      print(f"OpenAI client: HTTP/2 needs the 'h2' package (pip install httpx[http2]), using HTTP/1.1.")
+      http2 = False
+  return {
+    "limits": httpx.Limits(max_connections=client_settings.max_connections, max_keepalive_connections=client_settings.max_keepalive_connections, keepalive_expiry=client_settings.keepalive_expiry_seconds)
+    ,"timeout": httpx.Timeout(client_settings.timeout_seconds, connect=client_settings.connect_timeout_seconds)
+    ,"http2": http2
+  }
+
+def create_http_client(client_settings: Optional[CoaiClientSettings] = None) -> httpx.Client:
+  return openai.DefaultHttpxClient(**_get_http_client_args(client_settings or CoaiClientSettings()))
+
+
+
+# Azure AD bearer token provider with cache. DefaultAzureCredential walks its credential chain on the first call, which can take seconds,
+# so the token is fetched eagerly by warm_up() and then refreshed by a background thread refresh_margin_seconds before it expires.
+# Requests only wait for the credential if the cached token is (almost) expired. Can be shared by several clients.
+class CoaiCachedTokenProvider:
+  def __init__(self, credential, scope: str = "https://cognitiveservices.azure.com/.default", refresh_margin_seconds: float = 300):
+    self.credential = credential
+    self.scope = scope
+    self.refresh_margin_seconds = refresh_margin_seconds
+    self._token = None  # azure.core.credentials.AccessToken
+    self._init_process_state()
+
+  # Threads and locks don't survive fork(), so they are created per process
+  def _init_process_state(self):
+    self._pid = os.getpid()
+    self._lock = threading.Lock()
+    self._refresh_thread = None
+
+  def __call__(self) -> str:
+    if self._pid != os.getpid(): self._init_process_state()
+    token = self._token
+    if token is None or token.expires_on - time.time() < 60: token = self.refresh(min_validity_seconds=60)
+    self._start_refresh_thread()
+    return token.token
+
+  # Fetches the token and starts the background refresh (call before the first request)
+  def warm_up(self):
+    if self._pid != os.getpid(): self._init_process_state()
+    self.refresh(min_validity_seconds=self.refresh_margin_seconds)
+    self._start_refresh_thread()
+
+  # Returns the cached token or fetches a new one if it expires within min_validity_seconds
+  def refresh(self, min_validity_seconds: float):
+    with self._lock:
+      token = self._token
+      if token is None or token.expires_on - time.time() < min_validity_seconds:
+        start_time = time.perf_counter()
+        token = self.credential.get_token(self.scope)
+        self._token = token
+        print(f"Azure AD token acquired in {time.perf_counter() - start_time:.3f} secs, valid for {token.expires_on - time.time():.0f} secs.")
+      return token
+
+  def _start_refresh_thread(self):
+    if self._refresh_thread is not None: return
+    with self._lock:
+      if self._refresh_thread is not None: return
+      self._refresh_thread = threading.Thread(target=self._refresh_loop, name="azure-ad-token-refresh", daemon=True)
+      self._refresh_thread.start()
+
+  def _refresh_loop(self):
+    while True:
+      token = self._token
+      wait_seconds = token.expires_on - self.refresh_margin_seconds - time.time() if token is not None else 0
+      # At least 5 seconds between refreshes, in case the credential returns tokens that expire within the margin
+      time.sleep(max(5.0, wait_seconds))
+      try:
+        self.refresh(min_validity_seconds=self.refresh_margin_seconds)
+      except Exception as e:
+        print(f"Azure AD token refresh failed, retrying in 30 seconds: {str(e)}")
+        time.sleep(30)
+
+# Creates the cached token provider with DefaultAzureCredential (managed identity or service principal, whatever is configured in the environment variables)
+def create_azure_ad_token_provider(refresh_margin_seconds: float = 300) -> CoaiCachedTokenProvider:
+  # Imported here, azure.identity takes about 100 ms to import and is only needed for managed identity authentication
+  from azure.identity import DefaultAzureCredential
+  return CoaiCachedTokenProvider(DefaultAzureCredential(), refresh_margin_seconds=refresh_margin_seconds)
+
+
+# base_url: None = OPENAI_BASE_URL or api.openai.com
+def create_openai_client(api_key, client_settings: Optional[CoaiClientSettings] = None, base_url=None):
+  return openai.OpenAI(api_key=api_key, base_url=base_url, http_client=create_http_client(client_settings))
 
 # Create an Azure OpenAI client using either managed identity or API key authentication.
-def create_azure_openai_client(azure_endpoint, api_version, api_key, use_key_authentication):  
+# token_provider can be shared with other clients (e.g. the clients of a deployment pool), by default a new CoaiCachedTokenProvider is created.
+def create_azure_openai_client(azure_endpoint, api_version, api_key, use_key_authentication, client_settings: Optional[CoaiClientSettings] = None, token_provider=None):
+  http_client = create_http_client(client_settings)
   if use_key_authentication:
-    return openai.AzureOpenAI( api_version=api_version, azure_endpoint=azure_endpoint, api_key=api_key)
+    return openai.AzureOpenAI( api_version=api_version, azure_endpoint=azure_endpoint, api_key=api_key, http_client=http_client)
   else:
-    # Use managed identity or service principal authentication (whatever is configured in the environment variables)
-    cred = DefaultAzureCredential()
-    token_provider = get_bearer_token_provider(cred, "https://cognitiveservices.azure.com/.default")
+    token_provider = token_provider or create_azure_ad_token_provider((client_settings or CoaiClientSettings()).token_refresh_margin_seconds)
     # Create client with token provider
-    return openai.AzureOpenAI( api_version=api_version, azure_endpoint=azure_endpoint, azure_ad_token_provider=token_provider )
+    return openai.AzureOpenAI( api_version=api_version, azure_endpoint=azure_endpoint, azure_ad_token_provider=token_provider, http_client=http_client )
+
+# Opens num_connections connections of the client's pool (DNS, TCP and TLS handshakes) with cheap concurrent requests.
+# The status of the responses doesn't matter, errors are only logged. Fetches the token first if a token provider is given.
+def warm_up_openai_client(client, token_provider: Optional[CoaiCachedTokenProvider] = None, num_connections: int = 1):
+  if token_provider is not None:
+    try:
+      token_provider.warm_up()
+    except Exception as e:
+      print(f"  Warm-up: Azure AD token could not be acquired: {str(e)}")
+  if num_connections <= 0: return
+  warm_up_client = client.with_options(max_retries=0, timeout=10)
+  def open_connection(_):
+    try:
+      warm_up_client.models.list()
+    except openai.APIStatusError:
+      pass
+    except Exception as e:
+      print(f"  Warm-up: connection failed: {str(e)}")
+  with ThreadPoolExecutor(max_workers=num_connections) as executor: list(executor.map(open_connection, range(num_connections)))
 
-# Retries the given function on rate limit errors
-def retry_on_openai_errors(fn, indentation=0, retries=5, backoff_seconds=10):
+# Retries the given function on rate limit errors (429) with exponential backoff and jitter. Honors the Retry-After header of the 429 response.
+# Within a request deadline (see request_deadline.py), the SDK's own retries are off (see _get_call_client()), so 5xx, timeout and connection errors
+# are retried here too (at most TRANSIENT_ERROR_MAX_ATTEMPTS attempts). No retry is started that can't finish in time: DeadlineExceededError is raised instead.
+def retry_on_openai_errors(fn, indentation=0, retries=5, backoff_seconds=1, max_backoff_seconds=30):
   for attempt in range(retries):
     try:
       return fn()
     except Exception as e:
-      # Only retry on rate limit errors
-      if not (hasattr(e, 'type') and e.type == 'rate_limit_error'):
-        raise e
-      if attempt == retries - 1:  # Last attempt
-        raise e
-      print(f"{' '*indentation}Rate limit reached, retrying in {backoff_seconds} seconds... (attempt {attempt + 2} of {retries})")
-      time.sleep(backoff_seconds)
+      wait_seconds = _get_retry_wait_seconds_or_raise(e, attempt, retries, indentation, backoff_seconds, max_backoff_seconds)
+      with time_phase("retry_wait"): time.sleep(wait_seconds)
+
+# Attempts for 5xx, timeout and connection errors within a request deadline, like the SDK's default of 2 retries
+TRANSIENT_ERROR_MAX_ATTEMPTS = 3
+
+# True for 429 responses. Checks the status code: Azure OpenAI 429 bodies ({"error": {"code": "429", ...}}) have no 'type', so e.type is None.
+def is_rate_limit_error(e) -> bool:
+  return isinstance(e, openai.RateLimitError) or getattr(e, 'status_code', None) == 429
+
+# True for the errors the SDK retries besides 429: timeouts and connection errors, 408, 409 and 5xx responses
+def _is_transient_error(e) -> bool:
+  if isinstance(e, openai.APIConnectionError): return True  # includes openai.APITimeoutError
+  return isinstance(e, openai.APIStatusError) and (e.status_code in (408, 409) or e.status_code >= 500)
+
+# Returns the seconds to wait before the next attempt of retry_on_openai_errors(). Raises e if it is not retried: other errors, the last attempt,
+# and transient errors without request deadline (the SDK has already retried them). Raises DeadlineExceededError if the retry can't finish in time.
+def _get_retry_wait_seconds_or_raise(e, attempt, retries, indentation, backoff_seconds, max_backoff_seconds) -> float:
+  if is_rate_limit_error(e):
+    max_attempts, reason = retries, "Rate limit reached"
+  elif _is_transient_error(e) and get_remaining_seconds() is not None:
+    max_attempts, reason = min(retries, TRANSIENT_ERROR_MAX_ATTEMPTS), f"Upstream error ({type(e).__name__})"
+  else:
+    raise e
+  if attempt >= max_attempts - 1: raise e
+  wait_seconds = _get_retry_wait_seconds(e, attempt, backoff_seconds, max_backoff_seconds)
+  _check_retry_deadline(e, reason, wait_seconds, indentation)
+  print(f"{' '*indentation}{reason}, retrying in {wait_seconds:.1f} seconds... (attempt {attempt + 2} of {max_attempts})")
+  record_retry()
+  return wait_seconds
+
+# Expected duration of a retry attempt if no upstream latency has been observed yet
+DEFAULT_EXPECTED_CALL_SECONDS = 2.0
+
+# Raises DeadlineExceededError (caused by the error e) if waiting wait_seconds plus a typical call (median of the recent
+# upstream latency) would end after the request deadline
+def _check_retry_deadline(e, reason, wait_seconds, indentation):
+  expected_call_seconds = upstream_latency.get_percentile(None, 50) or DEFAULT_EXPECTED_CALL_SECONDS
+  if can_finish_in_time(wait_seconds + expected_call_seconds): return
+  print(f"{' '*indentation}{reason}, no retry: it could not finish before the request deadline ({get_remaining_seconds():.1f} seconds left).")
+  record_deadline_exceeded()
+  raise DeadlineExceededError(f"{reason} and a retry in {wait_seconds:.1f} seconds could not finish before the request deadline.") from e
+
+# Returns the timeout for an upstream call with the given client: timeout (NOT_GIVEN = the client's timeout, e.g. set with with_options()),
+# limited to the time left until the request deadline. Without a deadline timeout is returned as is. Raises DeadlineExceededError if the deadline has passed.
+def _get_call_timeout(client, timeout=NOT_GIVEN):
+  remaining_seconds = get_remaining_seconds()
+  if remaining_seconds is None: return timeout
+  if remaining_seconds <= 0:
+    record_deadline_exceeded()
+    check_deadline("upstream call")
+  # A timeout passed to the call replaces the client's timeout, so the client's timeout has to be limited here as well
+  if isinstance(timeout, NotGiven): timeout = client.timeout
+  if isinstance(timeout, httpx.Timeout):
+    return httpx.Timeout(connect=_min_timeout(timeout.connect, remaining_seconds), read=_min_timeout(timeout.read, remaining_seconds)
+      ,write=_min_timeout(timeout.write, remaining_seconds), pool=_min_timeout(timeout.pool, remaining_seconds))
+  return _min_timeout(timeout, remaining_seconds)
+
+# None (no timeout) and NOT_GIVEN are treated as infinite
+def _min_timeout(timeout, seconds: float) -> float:
+  return min(timeout, seconds) if isinstance(timeout, (int, float)) else seconds
+
+# Returns the client for an upstream call: within a request deadline a copy without the SDK's own retries, which wait for Retry-After and
+# time out per attempt regardless of the deadline. All retries (429, 5xx, timeouts, connection errors) are then done by retry_on_openai_errors(), which checks the deadline.
+def _get_call_client(client):
+  if get_remaining_seconds() is None: return client
+  return client.with_options(max_retries=0)
+
+# Returns the wait time before the next retry: the Retry-After of the response (plus up to 20% jitter) if given,
+# otherwise exponential backoff with jitter between 50% and 100% of backoff_seconds * 2^attempt
+def _get_retry_wait_seconds(e, attempt, backoff_seconds, max_backoff_seconds) -> float:
+  response = getattr(e, 'response', None)
+  retry_after_seconds = get_retry_after_seconds(response.headers) if response is not None else None
+  if retry_after_seconds is not None: return retry_after_seconds * random.uniform(1.0, 1.2)
+  backoff = min(max_backoff_seconds, backoff_seconds * (2 ** attempt))
+  return random.uniform(backoff / 2, backoff)
+
+# Optional client-side rate limiter used by all Responses API calls, see set_rate_limiter()
+_rate_limiter: Optional[RateLimiter] = None
+
+# Sets the rate limiter for all Responses API calls (None to disable). Buckets are kept per model / deployment name.
+def set_rate_limiter(rate_limiter: Optional[RateLimiter]):
+  global _rate_limiter
+  _rate_limiter = rate_limiter
 
 # Uses the file_search tool of the Responses API to get search results from a vector store
 # Why? As of 2025-06-04, Azure Open AI Services does not support the Séarch API. This is a temporary workaround to get similar results.
 # -> Client error '404 Resource Not Found' for url 'https://<ai-resource>.cognitiveservices.azure.com/openai/vector_stores/<VECTOR-STORE-ID>/search?api-version=2025-04-01-preview'
 def get_search_results_using_responses(client, model, query, vector_store_id, max_num_results, temperature, max_output_tokens) -> tuple[List[CoaiSearchResponse], any]:
-  params = CoaiResponseParams(
+  params = _build_search_response_params(model, query, vector_store_id, max_num_results, temperature, max_output_tokens)
+  response = _client_responses_create_wrapper(client, params)
+  return _get_search_results_from_response(response), response
+
+# Streaming version of get_search_results_using_responses(). Yields (event_type, value) tuples as soon as the data is available:
+#   ("search_results", List[CoaiSearchResponse]) -> when the file_search_call is done, before the answer is generated
+#   ("output_text_delta", str)                    -> for each chunk of the answer
+#   ("completed", response)                       -> the final response object (same as the non-streaming response)
+# Rate limit errors are retried while the stream is opened, before anything has been yielded.
+def stream_search_results_using_responses(client, model, query, vector_store_id, max_num_results, temperature, max_output_tokens, indentation=0):
+  params = _build_search_response_params(model, query, vector_store_id, max_num_results, temperature, max_output_tokens)
+  params.stream = True
+  stream = retry_on_openai_errors(lambda: _client_responses_create_wrapper(client, params), indentation=indentation)
+  search_results_sent = False
+  with stream:
+    for event in stream:
+      if event.type == 'response.output_item.done' and event.item.type == 'file_search_call' and not search_results_sent:
+        search_results_sent = True
+        yield "search_results", _set_vector_store_id(_get_search_results_from_output_item(event.item), vector_store_id)
+      elif event.type == 'response.output_text.delta':
+        yield "output_text_delta", event.delta
+      elif event.type in ('response.completed', 'response.incomplete'):
+        # 'incomplete' is also returned by the non-streaming call, e.g. when max_output_tokens is reached
+        if not search_results_sent:
+          search_results_sent = True
+          yield "search_results", _set_vector_store_id(_get_search_results_from_response(event.response), vector_store_id)
+        record_token_usage(params.model, getattr(event.response, 'usage', None))
+        yield "completed", event.response
+      elif event.type == 'response.failed':
+        error = event.response.error
+        raise RuntimeError(f"Response failed: {error.message if error else 'unknown error'}")
+
+def _build_search_response_params(model, query, vector_store_id, max_num_results, temperature, max_output_tokens) -> CoaiResponseParams:
+  return CoaiResponseParams(
     model=model
     ,instructions="Return 'N/A' (without single quotes) if no results are found."
     ,input=query
@@ -104,27 +355,224 @@ def get_search_results_using_responses(client, model, query, vector_store_id, ma
     ,temperature=temperature
     ,include=["file_search_call.results"]
   )
-  response = _client_responses_create_wrapper(client, params)
-  search_results: List[CoaiSearchResponse] = []
+
+# Uses the Search API of the vector store directly (no model call, no tokens). Returns (search_results, None) as there is no generated answer.
+# Supported by OpenAI and by Azure OpenAI with newer API versions. Raises openai.NotFoundError if the service does not support it.
+def get_search_results_using_vector_store_search(client, model, query, vector_store_id, max_num_results, temperature, max_output_tokens) -> tuple[List[CoaiSearchResponse], any]:
+  with time_upstream_call(model, "vector_store_search"):
+    page = _get_call_client(client).vector_stores.search(vector_store_id, query=query, max_num_results=max_num_results, timeout=_get_call_timeout(client))
+  return _get_search_results_from_vector_store_search_page(page), None
+
+# Smallest max_output_tokens value accepted by the Responses API
+RETRIEVAL_ONLY_MAX_OUTPUT_TOKENS = 16
+
+# Returns search results without an answer (response is None). Uses the Search API if the service supports it,
+# otherwise the Responses API with the smallest possible generation (the output is discarded).
+def get_search_results_retrieval_only(client, model, query, vector_store_id, max_num_results, temperature, max_output_tokens) -> tuple[List[CoaiSearchResponse], any]:
+  if _is_search_backend_supported(client, "vector_store_search"):
+    try:
+      return get_search_results_using_vector_store_search(client, model, query, vector_store_id, max_num_results, temperature, max_output_tokens)
+    except openai.NotFoundError:
+      _set_search_backend_unsupported(client, "vector_store_search")
+  search_results, response = get_search_results_using_responses(client, model, query, vector_store_id, max_num_results, temperature, RETRIEVAL_ONLY_MAX_OUTPUT_TOKENS)
+  return search_results, None
+
+# Search backends by name. All have the signature of get_search_results_using_responses() and return (search_results, response),
+# where response is None for backends that do not generate an answer.
+SEARCH_BACKENDS = {
+  "responses": get_search_results_using_responses
+  ,"vector_store_search": get_search_results_using_vector_store_search
+  ,"retrieval_only": get_search_results_retrieval_only
+}
+
+# Backend used if the requested backend is not supported by the service
+SEARCH_BACKEND_FALLBACKS = {
+  "vector_store_search": "responses"
+}
+
+# Backends that returned 404 for a given service, as (base_url, backend_name). Checked before each call to avoid repeating failing requests.
+_unsupported_search_backends = set()
+
+def _is_search_backend_supported(client, backend_name) -> bool:
+  return (str(client.base_url), backend_name) not in _unsupported_search_backends
+
+def _set_search_backend_unsupported(client, backend_name):
+  print(f"  Search backend '{backend_name}' is not supported by '{client.base_url}', using fallback.")
+  _unsupported_search_backends.add((str(client.base_url), backend_name))
+
+# Returns the name of the backend that will be used for the given client, following the fallbacks of unsupported backends
+def resolve_search_backend(client, backend_name) -> str:
+  if backend_name not in SEARCH_BACKENDS: raise ValueError(f"Unknown search backend '{backend_name}'. Supported: {', '.join(SEARCH_BACKENDS.keys())}")
+  while not _is_search_backend_supported(client, backend_name) and backend_name in SEARCH_BACKEND_FALLBACKS:
+    backend_name = SEARCH_BACKEND_FALLBACKS[backend_name]
+  return backend_name
+
+# Gets search results using the given backend. Falls back automatically if the service does not support it (404).
+# The results are tagged with vector_store_id.
+def get_search_results(client, backend_name, model, query, vector_store_id, max_num_results, temperature, max_output_tokens) -> tuple[List[CoaiSearchResponse], any]:
+  backend_name = resolve_search_backend(client, backend_name)
+  try:
+    search_results, response = SEARCH_BACKENDS[backend_name](client, model, query, vector_store_id, max_num_results, temperature, max_output_tokens)
+    return _set_vector_store_id(search_results, vector_store_id), response
+  except openai.NotFoundError:
+    if backend_name not in SEARCH_BACKEND_FALLBACKS: raise
+    _set_search_backend_unsupported(client, backend_name)
+    return get_search_results(client, SEARCH_BACKEND_FALLBACKS[backend_name], model, query, vector_store_id, max_num_results, temperature, max_output_tokens)
+
+# Sets the vector store of the given search results and returns them
+def _set_vector_store_id(search_results: List[CoaiSearchResponse], vector_store_id) -> List[CoaiSearchResponse]:
+  for result in search_results: result.vector_store_id = vector_store_id
+  return search_results
+
+# Merges the search results of multiple vector stores: sorted by score (highest first), duplicates (same file_id and text) removed, top max_num_results returned
+def merge_search_results(search_result_lists: Iterable[List[CoaiSearchResponse]], max_num_results) -> List[CoaiSearchResponse]:
+  all_results = sorted((result for results in search_result_lists for result in results), key=lambda result: result.score, reverse=True)
+  merged_results: List[CoaiSearchResponse] = []
+  seen_keys = set()
+  for result in all_results:
+    key = (result.file_id, result.content[0].text if result.content else "")
+    if key in seen_keys: continue
+    seen_keys.add(key)
+    merged_results.append(result)
+    if len(merged_results) >= max_num_results: break
+  return merged_results
+
+# Generates an answer from already retrieved search results (no file_search tool call). Used for results merged from multiple vector stores.
+def get_answer_for_search_results(client, model, query, search_results: List[CoaiSearchResponse], temperature, max_output_tokens):
+  sources = "\n\n".join(f"Source: {result.filename}\n{result.content[0].text if result.content else ''}" for result in search_results)
+  params = CoaiResponseParams(
+    model=model
+    ,instructions="Answer the question using only the given sources. Cite the sources you use as 【<source>】. Return 'N/A' (without single quotes) if the sources don't contain the answer."
+    ,input=f"Sources:\n\n{sources}\n\nQuestion: {query}"
+    ,max_output_tokens=max_output_tokens
+    ,temperature=temperature
+  )
+  return _client_responses_create_wrapper(client, params)
+
+# Returns the embedding vectors of the given texts (one call for all texts). On Azure OpenAI, model is the deployment name.
+# dimensions shortens the vectors (text-embedding-3 models only), None = full size of the model.
+def get_embeddings(client, model, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+  with time_upstream_call(model, "embeddings"):
+    response = _get_call_client(client).embeddings.create(model=model, input=texts, dimensions=dimensions if dimensions else NOT_GIVEN, timeout=_get_call_timeout(client))
+  return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+# Returns a version string of the vector store that changes when files are added, removed or re-indexed (file counts and size)
+def get_vector_store_version(client, vector_store_id) -> str:
+  vector_store = client.vector_stores.retrieve(vector_store_id)
+  file_counts = vector_store.file_counts
+  return f"{file_counts.completed}/{file_counts.in_progress}/{file_counts.failed}/{vector_store.usage_bytes}"
+
+# Copies the results of a vector store search page into CoaiSearchResponse objects
+def _get_search_results_from_vector_store_search_page(page) -> List[CoaiSearchResponse]:
+  return [
+    CoaiSearchResponse(
+      attributes=result.attributes
+      ,content=[CoaiSearchContent(text=c.text, type="text") for c in result.content]
+      ,file_id=result.file_id
+      ,filename=result.filename
+      ,score=result.score
+    ) for result in page.data
+  ]
+
+# Copies the file_search_call results of the given response into CoaiSearchResponse objects
+def _get_search_results_from_response(response) -> List[CoaiSearchResponse]:
   file_search_call = next((item for item in response.output if item.type == 'file_search_call'), None)
+  return _get_search_results_from_output_item(file_search_call)
+
+# Copies the results of the given file_search_call output item into CoaiSearchResponse objects
+def _get_search_results_from_output_item(file_search_call) -> List[CoaiSearchResponse]:
   file_search_call_results = None if file_search_call is None else getattr(file_search_call, 'results', None)
-  if  file_search_call_results:
-    for result in file_search_call_results:
-        content = [CoaiSearchContent(text=result.text, type="text")]
-        item = CoaiSearchResponse(
-          attributes=result.attributes
-          ,content=content
-          ,file_id=result.file_id
-          ,filename=result.filename
-          ,score=result.score
-        )
-        search_results.append(item)
-  return search_results, response
-
-
-# Internal wrapper around OpenAI response model call
+  if not file_search_call_results: return []
+  return [
+    CoaiSearchResponse(
+      attributes=result.attributes
+      ,content=[CoaiSearchContent(text=result.text, type="text")]
+      ,file_id=result.file_id
+      ,filename=result.filename
+      ,score=result.score
+    ) for result in file_search_call_results
+  ]
+
+
+# Optional pool of deployments for all Responses API calls, see set_deployment_pool()
+_deployment_pool: Optional[DeploymentPool] = None
+
+# Sets the deployment pool for all Responses API calls (None = use the client and model given by the caller).
+# Vector store searches and embeddings always use the given client.
+def set_deployment_pool(deployment_pool: Optional[DeploymentPool]):
+  global _deployment_pool
+  _deployment_pool = deployment_pool
+
+# True if the call uses the file_search tool, which only deployments with access to the vector stores can serve
+def _uses_vector_stores(params: CoaiResponseParams) -> bool:
+  return any(tool.get('type') == 'file_search' for tool in (params.tools or []))
+
+# Optional hedging of Responses API calls (without streams), see set_hedging_policy()
+_hedging_policy: Optional[HedgingPolicy] = None
+
+# Sets the hedging policy for all Responses API calls (None to disable)
+def set_hedging_policy(hedging_policy: Optional[HedgingPolicy]):
+  global _hedging_policy
+  _hedging_policy = hedging_policy
+
+# Returns (client, params) of the hedge: the secondary client and deployment of the hedging policy if configured, otherwise the same call.
+# file_search calls only go to the secondary client if its resource holds the same vector stores (vector stores belong to one resource).
+def _get_hedge_call(client, params: CoaiResponseParams, secondary_client):
+  if secondary_client is not None and _uses_vector_stores(params) and not _hedging_policy.secondary_vector_stores: return client, params
+  if _hedging_policy.secondary_model: params = replace(params, model=_hedging_policy.secondary_model)
+  return secondary_client or client, params
+
+# Internal wrapper around OpenAI response model call. Hedges the call if a hedging policy is set (not for streams).
+# The timeout of the given client (e.g. the per-store timeout of federated searches) also applies to the calls on hedge and pool clients.
 def _client_responses_create_wrapper(client, params: CoaiResponseParams):
-  return client.responses.create(
+  if isinstance(params.timeout, NotGiven): params = replace(params, timeout=client.timeout)
+  if _hedging_policy is None or params.stream is True: return _client_responses_create_attempt(client, params)
+  hedge_client, hedge_params = _get_hedge_call(client, params, _hedging_policy.secondary_client)
+  return _hedging_policy.call(lambda: _client_responses_create_attempt(client, params), lambda: _client_responses_create_attempt(hedge_client, hedge_params), params.model)
+
+# Single Responses API call, sent to the deployment pool if set (the given client and model are then replaced by the selected deployment)
+def _client_responses_create_attempt(client, params: CoaiResponseParams):
+  start_time = time.perf_counter()
+  if _deployment_pool is None:
+    response = _client_responses_create_on_deployment(client, params, params.model)
+  else:
+    response = _deployment_pool.call(lambda deployment: _client_responses_create_on_deployment(deployment.client, replace(params, model=deployment.deployment_name), deployment.name), _uses_vector_stores(params))
+  if params.stream is not True: upstream_latency.record(params.model, time.perf_counter() - start_time)
+  return response
+
+# Responses API call on a single deployment. Waits for the rate limiter (if set, buckets per rate_limit_key) and feeds it the quota headers and token usage of the response.
+# The call's timeout is limited to the request deadline. Streams are timed until the response headers arrive, the token usage of streams is recorded by the stream consumer.
+def _client_responses_create_on_deployment(client, params: CoaiResponseParams, rate_limit_key: str):
+  if _rate_limiter is not None:
+    with time_phase("rate_limit_wait"): _rate_limiter.acquire(rate_limit_key)
+  timeout = _get_call_timeout(client, params.timeout)
+  client = _get_call_client(client)
+  if _rate_limiter is None:
+    with time_upstream_call(params.model, "responses"):
+      response = _client_responses_create(client.responses, params, timeout)
+    record_token_usage(params.model, getattr(response, 'usage', None))
+  else:
+    try:
+      with time_upstream_call(params.model, "responses"):
+        raw_response = _client_responses_create(client.responses.with_raw_response, params, timeout)
+    except openai.RateLimitError as e:
+      _rate_limiter.on_rate_limited(rate_limit_key, get_retry_after_seconds(e.response.headers))
+      raise
+    response = _parse_raw_response(raw_response, params, rate_limit_key)
+  return response
+
+# Feeds the quota headers and token usage of the given raw response into the rate limiter and returns the parsed response (or stream)
+def _parse_raw_response(raw_response, params: CoaiResponseParams, rate_limit_key: str):
+  _rate_limiter.update_from_headers(rate_limit_key, raw_response.headers)
+  response = raw_response.parse()
+  usage = getattr(response, 'usage', None)
+  if usage is not None: _rate_limiter.record_usage(rate_limit_key, usage.total_tokens)
+  record_token_usage(params.model, usage)
+  return response
+
+# Calls create() of client.responses or client.responses.with_raw_response with the given parameters
+def _client_responses_create(responses, params: CoaiResponseParams, timeout=NOT_GIVEN):
+  return responses.create(
     model=params.model,
     input=params.input,
     include=params.include,
@@ -147,5 +595,6 @@ def _client_responses_create_wrapper(client, params: CoaiResponseParams):
     extra_headers=params.extra_headers,
     extra_query=params.extra_query,
     extra_body=params.extra_body,
-    timeout=params.timeout
-  )
\ No newline at end of file
+    timeout=timeout
+  )
+
@@ -0,0 +1,138 @@
+# Crawler settings (domains, sources and their vector stores) as an immutable snapshot with everything the routes derive from them:
+# vector store ids per domain, document library urls, and the pre-serialized /describe body with its ETag. Optionally loaded from a
+# JSON file that is reloaded when it changes.
+# Copyright 2025, Karsten Held (MIT License)
+
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+from json_encoder import dumps_bytes
+
+DESCRIBE_DESCRIPTION = 'This tool can search the content of SharePoint documents.'
+
+
+# Everything derived from one version of the crawler settings. Never modified after creation: a reload replaces the whole snapshot,
+# so a request that took the snapshot once sees consistent values.
+@dataclass(frozen=True, slots=True)
+class CrawlerSettingsSnapshot:
+  settings: Dict[str, Any]
+  vector_store_ids_by_domain: Dict[str, List[str]]
+  source_urls_by_vector_store_id: Dict[str, str]
+  default_source_url: str       # document library url of sources without 'siteUrl', ends with '/'
+  content_root: str             # SharePoint tenant url, e.g. 'https://<tenant>.sharepoint.com/'
+  describe_body: bytes
+  describe_etag: str            # without quotes
+  loaded_at: float
+
+# Returns (vector store ids by domain key, SharePoint document library url by vector store id) from the crawler settings.
+# Sources without 'vectorStoreId' are not searchable yet, sources without 'siteUrl' use the default document library url.
+def load_domain_vector_stores(crawler_settings):
+  vector_store_ids_by_domain = {}
+  source_urls_by_vector_store_id = {}
+  for domain in crawler_settings.get('domains', []):
+    vector_store_ids = []
+    for source in domain.get('sources', []):
+      vector_store_id = source.get('vectorStoreId')
+      if not vector_store_id: continue
+      if vector_store_id not in vector_store_ids: vector_store_ids.append(vector_store_id)
+      if source.get('siteUrl'):
+        source_urls_by_vector_store_id[vector_store_id] = f"{source['siteUrl'].rstrip('/')}/{quote(source.get('documentLibraryUrlName', ''))}/"
+    vector_store_ids_by_domain[domain.get('key', '')] = vector_store_ids
+  return vector_store_ids_by_domain, source_urls_by_vector_store_id
+
+def build_crawler_settings_snapshot(crawler_settings: Dict[str, Any], default_sharepoint_source_url: str) -> CrawlerSettingsSnapshot:
+  vector_store_ids_by_domain, source_urls_by_vector_store_id = load_domain_vector_stores(crawler_settings)
+  # Tenant url: part of the default source url until the 3rd '/'
+  content_root = '/'.join(default_sharepoint_source_url.split('/')[:3]) + '/'
+  describe_body = dumps_bytes({
+    'data': {
+      'description': DESCRIBE_DESCRIPTION,
+      'domains': [
+        {
+          'key': dom.get('key', ''),
+          'name': dom.get('name', ''),
+          'description': dom.get('description', '')
+        } for dom in crawler_settings.get('domains', [])
+      ],
+      'content_root': content_root
+      # 'favicon': 'AAABAAAIACoJQAANgA...APgfAAA='  # base64, optional
+    }
+  })
+  return CrawlerSettingsSnapshot(
+    settings=crawler_settings
+    ,vector_store_ids_by_domain=vector_store_ids_by_domain
+    ,source_urls_by_vector_store_id=source_urls_by_vector_store_id
+    ,default_source_url=default_sharepoint_source_url if default_sharepoint_source_url.endswith('/') else default_sharepoint_source_url + '/'
+    ,content_root=content_root
+    ,describe_body=describe_body
+    ,describe_etag=hashlib.blake2b(describe_body, digest_size=16).hexdigest()
+    ,loaded_at=time.time()
+  )
+
+
+# Crawler settings from a JSON file (reloaded when it changes, at most every reload_interval_seconds) or the built-in settings (demodata.CRAWLER_SETTINGS).
+# Replace the file atomically (write a temporary file, then rename), so a reload never reads a half-written file. If the file is missing or invalid,
+# the last good snapshot is kept.
+class CrawlerSettingsStore:
+  def __init__(self, path: Optional[str], builtin_settings: Dict[str, Any], default_sharepoint_source_url: str, reload_interval_seconds: float = 5):
+    self.path = path
+    self.default_sharepoint_source_url = default_sharepoint_source_url
+    self.reload_interval_seconds = reload_interval_seconds
+    self.reloads = 0
+    self.reload_errors = 0
+    self._snapshot = build_crawler_settings_snapshot(builtin_settings, default_sharepoint_source_url)
+    self._file_signature = None
+    self._next_reload_check = 0.0
+    self._reload_lock = threading.Lock()
+    self.reload_if_changed(force=True)
+
+  # Returns the current snapshot. Take it once per request and use its fields, instead of calling get() for each value.
+  def get(self) -> CrawlerSettingsSnapshot:
+    if self.path: self.reload_if_changed()
+    return self._snapshot
+
+  # Loads the file if it was modified. Other threads keep using the old snapshot meanwhile.
+  def reload_if_changed(self, force: bool = False):
+    if not self.path: return
+    now = time.monotonic()
+    if not force and now < self._next_reload_check: return
+    if not self._reload_lock.acquire(blocking=force): return
+    try:
+      self._next_reload_check = now + self.reload_interval_seconds
+      try:
+        stat = os.stat(self.path)
+      except OSError:
+        if force: print(f"Crawler settings: file '{self.path}' not found, using the built-in settings.")
+        return
+      signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+      if signature == self._file_signature: return
+      # Also set for an invalid file, so it is only loaded again after the next change
+      self._file_signature = signature
+      try:
+        with open(self.path, 'r', encoding='utf-8') as file: settings = json.load(file)
+        snapshot = build_crawler_settings_snapshot(settings, self.default_sharepoint_source_url)
+      except (OSError, ValueError, AttributeError) as e:
+        self.reload_errors += 1
+        print(f"Crawler settings: loading '{self.path}' failed, keeping the previous settings: {str(e)}")
+        return
+      self._snapshot = snapshot
+      if not force: self.reloads += 1
+      print(f"Crawler settings: loaded {len(snapshot.vector_store_ids_by_domain)} domains from '{self.path}'.")
+    finally:
+      self._reload_lock.release()
+
+
+# Creates the crawler settings store from environment variables and the built-in settings
+def create_crawler_settings_store_from_env(builtin_settings: Dict[str, Any], default_sharepoint_source_url: str) -> CrawlerSettingsStore:
+  return CrawlerSettingsStore(
+    path=os.getenv("CRAWLER_SETTINGS_PATH") or None
+    ,builtin_settings=builtin_settings
+    ,default_sharepoint_source_url=default_sharepoint_source_url
+    ,reload_interval_seconds=float(os.getenv("CRAWLER_SETTINGS_RELOAD_INTERVAL_SECONDS", "5"))
+  )
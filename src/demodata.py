@@ -39,7 +39,8 @@ CRAWLER_SETTINGS = {
         {
           "siteUrl": "",
           "documentLibraryUrlName": "Published",
-          "documentFilter": ""
+          "documentFilter": "",
+          "vectorStoreId": ""
         }
       ]
     }
@@ -0,0 +1,283 @@
+# Pool of model deployments (Azure OpenAI and OpenAI) for Responses API calls: each call goes to the least loaded, fastest healthy deployment
+# and fails over to the next one on 429, 5xx and connection errors. Circuit breakers take failing deployments out of the rotation.
+# Copyright 2025, Karsten Held (MIT License)
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import openai
+from rate_limiter import TokenBucket, get_retry_after_seconds
+from request_metrics import record_deployment_error
+
+CIRCUIT_CLOSED = "closed"        # deployment receives calls
+CIRCUIT_OPEN = "open"            # deployment is skipped until open_until
+CIRCUIT_HALF_OPEN = "half_open"  # one probe call decides whether the circuit closes or opens again
+
+
+# Settings of a deployment in the pool, from OPENAI_DEPLOYMENT_POOL (keys in camelCase like the crawler settings)
+@dataclass
+class PoolDeploymentConfig:
+  name: str                            # unique name in stats and logs, e.g. 'swedencentral'
+  service_type: str                    # 'azure_openai' or 'openai'
+  deployment_name: str                 # model deployment (Azure OpenAI) or model (OpenAI)
+  endpoint: Optional[str] = None       # Azure OpenAI endpoint or OpenAI base url (None = api.openai.com)
+  api_key: Optional[str] = None
+  api_version: Optional[str] = None
+  use_key_authentication: bool = False
+  weight: float = 1.0                  # share of the traffic relative to the other deployments when all are equally fast and loaded
+  tokens_per_minute: float = 0         # quota of the deployment, calls avoid it while the quota is used up (0 = unknown)
+  vector_stores: bool = False          # True if the vector stores are in this resource, only these deployments get calls with file_search
+
+# Counters of a deployment (per process)
+@dataclass
+class PoolDeploymentStats:
+  calls: int = 0
+  failures: int = 0         # 5xx and connection errors
+  rate_limited: int = 0     # 429 responses
+  circuit_opened: int = 0
+  tokens_used: int = 0
+
+
+# Circuit breaker of a deployment. Opens after failure_threshold consecutive failures for open_seconds, or immediately on a 429 for its Retry-After.
+# After the open period, a single probe call is let through: success closes the circuit, failure opens it again for twice as long (up to max_open_seconds).
+class CircuitBreaker:
+  def __init__(self, failure_threshold=3, open_seconds=30.0, max_open_seconds=300.0):
+    self.failure_threshold = failure_threshold
+    self.open_seconds = open_seconds
+    self.max_open_seconds = max_open_seconds
+    self.state = CIRCUIT_CLOSED
+    self.open_until = 0.0
+    self._consecutive_failures = 0
+    self._next_open_seconds = open_seconds
+    self._probe_in_flight = False
+
+  # Returns True if a call may be sent now. In the half open state only one probe call at a time. Not thread-safe, called under the pool's lock.
+  def allow_request(self, now: float) -> bool:
+    if self.state == CIRCUIT_CLOSED: return True
+    if self.state == CIRCUIT_OPEN and now >= self.open_until:
+      self.state = CIRCUIT_HALF_OPEN
+      self._probe_in_flight = False
+    if self.state == CIRCUIT_HALF_OPEN and not self._probe_in_flight:
+      self._probe_in_flight = True
+      return True
+    return False
+
+  # Ends a probe call that neither succeeded nor failed (cancelled), so the next call can probe
+  def release_probe(self):
+    self._probe_in_flight = False
+
+  def record_success(self):
+    self.state = CIRCUIT_CLOSED
+    self._consecutive_failures = 0
+    self._next_open_seconds = self.open_seconds
+    self._probe_in_flight = False
+
+  # Returns True if the circuit was opened by this failure. open_seconds overrides the open period (e.g. Retry-After of a 429).
+  def record_failure(self, now: float, open_seconds: Optional[float] = None) -> bool:
+    self._consecutive_failures += 1
+    if self.state != CIRCUIT_HALF_OPEN and open_seconds is None and self._consecutive_failures < self.failure_threshold: return False
+    if open_seconds is None:
+      open_seconds = self._next_open_seconds
+      self._next_open_seconds = min(self.max_open_seconds, self._next_open_seconds * 2)
+    self.state = CIRCUIT_OPEN
+    self.open_until = max(self.open_until, now + open_seconds)
+    self._probe_in_flight = False
+    return True
+
+
+# A deployment of the pool with its clients, circuit breaker, load and latency
+class PoolDeployment:
+  def __init__(self, config: PoolDeploymentConfig, client, breaker: CircuitBreaker, estimated_tokens_per_call: float):
+    self.config = config
+    self.name = config.name
+    self.deployment_name = config.deployment_name
+    self.client = client
+    self.breaker = breaker
+    self.tokens = TokenBucket(config.tokens_per_minute)
+    self.estimated_tokens_per_call = estimated_tokens_per_call
+    self.in_flight = 0
+    self.latency_seconds: Optional[float] = None   # moving average of successful calls
+    self.stats = PoolDeploymentStats()
+
+  # Routing score, lower is better: expected latency times the calls in flight (including this one) relative to the weight
+  def get_score(self, default_latency_seconds: float) -> float:
+    return (self.latency_seconds or default_latency_seconds) * (self.in_flight + 1) / max(self.config.weight, 0.001)
+
+
+# Routes calls over the deployments. call() tries at most max_attempts deployments per call and raises the last error if all of them fail,
+# so retry_on_openai_errors() backs off only when the whole pool is rate limited or failing.
+class DeploymentPool:
+  def __init__(self, deployments: List[PoolDeployment], max_attempts: int = 3, latency_smoothing: float = 0.2):
+    self.deployments = deployments
+    self.max_attempts = max_attempts
+    self.latency_smoothing = latency_smoothing
+    self._lock = threading.Lock()
+
+  # Returns the deployment for the next call and counts it as in flight: the best score among the deployments with a closed circuit and
+  # token quota left, not in exclude. If none is available: for the first attempt of a call the deployment whose circuit reopens first
+  # (the call is sent anyway), for failover attempts None.
+  def select(self, exclude=(), needs_vector_stores: bool = False) -> Optional[PoolDeployment]:
+    with self._lock:
+      now = time.monotonic()
+      candidates = [d for d in self.deployments if d not in exclude and (d.config.vector_stores or not needs_vector_stores)]
+      if not candidates: return None
+      known_latencies = [d.latency_seconds for d in candidates if d.latency_seconds is not None]
+      default_latency_seconds = min(known_latencies) if known_latencies else 1.0
+      for d in candidates: d.tokens.refill(now)
+      healthy = [d for d in candidates if d.breaker.state != CIRCUIT_OPEN or now >= d.breaker.open_until]
+      with_quota = [d for d in healthy if d.tokens.get_wait_seconds(d.estimated_tokens_per_call) <= 0] if healthy else []
+      deployment = None
+      for d in sorted(with_quota or healthy, key=lambda d: d.get_score(default_latency_seconds)):
+        if d.breaker.allow_request(now):
+          deployment = d
+          break
+      if deployment is None:
+        if exclude: return None
+        deployment = min(candidates, key=lambda d: d.breaker.open_until)
+      deployment.in_flight += 1
+      deployment.stats.calls += 1
+      deployment.tokens.consume(deployment.estimated_tokens_per_call)
+      return deployment
+
+  # Calls fn(deployment) on the selected deployment and fails over to the next one on 429, 5xx and connection errors
+  def call(self, fn: Callable[[PoolDeployment], Any], needs_vector_stores: bool = False) -> Any:
+    tried = []
+    while True:
+      deployment = self.select(tried, needs_vector_stores)
+      if deployment is None: raise last_error
+      tried.append(deployment)
+      start_time = time.perf_counter()
+      try:
+        result = fn(deployment)
+      except Exception as e:
+        self._end_call(deployment, e, None, None)
+        if not _is_failover_error(e) or len(tried) >= self.max_attempts: raise
+        last_error = e
+        continue
+      self._end_call(deployment, None, time.perf_counter() - start_time, result)
+      return result
+
+  # Books the end of a call: latency, token usage and circuit breaker. Errors that are not the deployment's fault (e.g. 400) don't count as failures.
+  def _end_call(self, deployment: PoolDeployment, error: Optional[Exception], seconds: Optional[float], result):
+    with self._lock:
+      deployment.in_flight -= 1
+      if error is None:
+        deployment.breaker.record_success()
+        # Streams are timed until the response headers arrive, which is still comparable between deployments
+        alpha = self.latency_smoothing
+        deployment.latency_seconds = seconds if deployment.latency_seconds is None else (1 - alpha) * deployment.latency_seconds + alpha * seconds
+        usage = getattr(result, 'usage', None)
+        if usage is not None:
+          deployment.stats.tokens_used += usage.total_tokens
+          deployment.tokens.consume(usage.total_tokens - deployment.estimated_tokens_per_call)
+        return
+      # The call failed before any usage was recorded, so the estimate charged by select() is given back. Otherwise a burst of errors
+      # would drain the deployment's token budget and route traffic away from it after it recovered.
+      deployment.tokens.refund(deployment.estimated_tokens_per_call)
+      if not _is_failover_error(error):
+        deployment.breaker.release_probe()
+        return
+      now = time.monotonic()
+      if isinstance(error, openai.RateLimitError):
+        deployment.stats.rate_limited += 1
+        retry_after_seconds = get_retry_after_seconds(error.response.headers) if error.response is not None else None
+        opened = deployment.breaker.record_failure(now, retry_after_seconds or deployment.breaker.open_seconds)
+        reason = "rate_limited"
+      else:
+        deployment.stats.failures += 1
+        opened = deployment.breaker.record_failure(now)
+        reason = "error"
+      if opened:
+        deployment.stats.circuit_opened += 1
+        print(f"  Deployment '{deployment.name}': circuit opened for {deployment.breaker.open_until - now:.1f} seconds after {reason} ({type(error).__name__}).")
+    record_deployment_error(deployment.name, reason)
+
+  def get_stats(self) -> Dict[str, Any]:
+    with self._lock:
+      now = time.monotonic()
+      return {
+        d.name: {
+          "service_type": d.config.service_type
+          ,"endpoint": d.config.endpoint
+          ,"deployment": d.deployment_name
+          ,"weight": d.config.weight
+          ,"vector_stores": d.config.vector_stores
+          ,"circuit": d.breaker.state
+          ,"open_seconds_left": round(max(0.0, d.breaker.open_until - now), 1) if d.breaker.state == CIRCUIT_OPEN else 0
+          ,"in_flight": d.in_flight
+          ,"latency_ms": round(d.latency_seconds * 1000) if d.latency_seconds is not None else None
+          ,"calls": d.stats.calls
+          ,"failures": d.stats.failures
+          ,"rate_limited": d.stats.rate_limited
+          ,"circuit_opened": d.stats.circuit_opened
+          ,"tokens_used": d.stats.tokens_used
+          ,"tokens_per_minute": d.config.tokens_per_minute
+        } for d in self.deployments
+      }
+
+# 429, 5xx, timeouts and connection errors are worth a call to another deployment, other errors (e.g. 400 for invalid input) are not
+def _is_failover_error(e: Exception) -> bool:
+  return isinstance(e, (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError))
+
+
+# Returns the deployment configs from OPENAI_DEPLOYMENT_POOL: a JSON array of objects or the path of a JSON file with the array, e.g.
+# [{"name": "swedencentral", "serviceType": "azure_openai", "endpoint": "https://...", "deploymentName": "gpt-4o-mini", "weight": 2, "tokensPerMinute": 150000}]
+# Missing apiVersion, apiKey and useKeyAuthentication are taken from the defaults (AZURE_OPENAI_* or OPENAI_API_KEY). Empty list if not set.
+# Vector stores belong to one resource, so a missing vectorStores is only true for the resource of the app's client (primary_service_type and primary_endpoint).
+def load_deployment_pool_configs_from_env(default_api_version=None, default_api_key=None, default_use_key_authentication=False, default_openai_api_key=None
+  ,primary_service_type=None, primary_endpoint=None) -> List[PoolDeploymentConfig]:
+  value = os.getenv("OPENAI_DEPLOYMENT_POOL", "").strip()
+  if not value: return []
+  if not value.startswith("["):
+    with open(value, "r", encoding="utf-8") as file: value = file.read()
+  configs = []
+  for item in json.loads(value):
+    service_type = item.get("serviceType", "azure_openai")
+    is_azure = service_type == "azure_openai"
+    config = PoolDeploymentConfig(
+      name=item.get("name") or f"{item.get('endpoint') or service_type}/{item['deploymentName']}"
+      ,service_type=service_type
+      ,deployment_name=item["deploymentName"]
+      ,endpoint=item.get("endpoint")
+      ,api_key=item.get("apiKey") or (default_api_key if is_azure else default_openai_api_key)
+      ,api_version=item.get("apiVersion") or default_api_version
+      ,use_key_authentication=item.get("useKeyAuthentication", default_use_key_authentication)
+      ,weight=float(item.get("weight", 1))
+      ,tokens_per_minute=float(item.get("tokensPerMinute", 0))
+    )
+    config.vector_stores = item.get("vectorStores", _is_primary_resource(config, primary_service_type, primary_endpoint, default_openai_api_key))
+    configs.append(config)
+  return configs
+
+# True if the deployment is in the resource of the app's client: the same Azure OpenAI endpoint, or for OpenAI the same base url and API key (project)
+def _is_primary_resource(config: PoolDeploymentConfig, primary_service_type, primary_endpoint, primary_openai_api_key) -> bool:
+  if config.service_type != primary_service_type or _normalize_endpoint(_get_endpoint(config)) != _normalize_endpoint(primary_endpoint): return False
+  return config.service_type == "azure_openai" or config.api_key == primary_openai_api_key
+
+# OpenAI clients without base url use OPENAI_BASE_URL (default api.openai.com)
+def _get_endpoint(config: PoolDeploymentConfig) -> Optional[str]:
+  if config.service_type == "openai": return config.endpoint or os.getenv("OPENAI_BASE_URL")
+  return config.endpoint
+
+def _normalize_endpoint(endpoint: Optional[str]) -> str:
+  return (endpoint or "").strip().rstrip("/").lower()
+
+# Creates the circuit breaker of a deployment from environment variables
+def create_circuit_breaker_from_env() -> CircuitBreaker:
+  return CircuitBreaker(
+    failure_threshold=int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "3"))
+    ,open_seconds=float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", "30"))
+    ,max_open_seconds=float(os.getenv("CIRCUIT_BREAKER_MAX_OPEN_SECONDS", "300"))
+  )
+
+# Creates the pool from deployments given as (config, client). The clients are created by the caller (see init_openai_client() in app.py).
+def create_deployment_pool(deployments_with_clients) -> DeploymentPool:
+  estimated_tokens_per_call = float(os.getenv("RATE_LIMIT_ESTIMATED_TOKENS_PER_REQUEST", "2000"))
+  if deployments_with_clients and not any(config.vector_stores for config, _ in deployments_with_clients):
+    raise ValueError("OPENAI_DEPLOYMENT_POOL: at least one deployment needs access to the vector stores ('vectorStores': true, default only for the resource of AZURE_OPENAI_ENDPOINT).")
+  deployments = [PoolDeployment(config, client, create_circuit_breaker_from_env(), estimated_tokens_per_call) for config, client in deployments_with_clients]
+  return DeploymentPool(deployments, max_attempts=int(os.getenv("DEPLOYMENT_POOL_MAX_ATTEMPTS", "3")))
@@ -0,0 +1,12 @@
+# Gunicorn settings, loaded automatically from the working directory (startup command: gunicorn --bind=0.0.0.0:8000 app:app)
+# Copyright 2025, Karsten Held (MIT License)
+
+# Runs in every worker process after the app has been loaded (after fork), so each worker starts with its own
+# Azure AD token and open connections instead of paying for them in its first request
+def post_worker_init(worker):
+  try:
+    import app
+    app.warm_up()
+  except Exception as e:
+    # A failed warm-up must not stop the worker, requests will connect and authenticate on demand
+    worker.log.warning(f"Warm-up failed: {str(e)}")
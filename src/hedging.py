@@ -0,0 +1,145 @@
+# Hedged upstream requests: if a call has not answered after the observed p95 latency, a second call is sent
+# (optionally to a secondary deployment or region) and the first answer wins
+# Copyright 2025, Karsten Held (MIT License)
+
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, FIRST_COMPLETED, TimeoutError as FuturesTimeoutError, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from request_deadline import can_finish_in_time
+from request_metrics import LatencyTracker, upstream_latency, record_hedge
+
+
+# Counters exposed by the hedging policy (per process)
+@dataclass
+class HedgingStats:
+  calls: int = 0
+  hedged: int = 0
+  primary_wins: int = 0
+  hedge_wins: int = 0
+  skipped: int = 0   # hedge not sent because max_in_flight hedges were running or the deadline was too close
+
+class HedgingPolicy:
+  # delay: percentile of the recent upstream latency of the model, clamped to [min_delay_seconds, max_delay_seconds]. Until enough calls
+  # were observed, fixed_delay_seconds is used (0 = no hedging until then). max_in_flight limits the additional upstream load.
+  # secondary_client / secondary_model: target of the hedge, default is the same client and model.
+  # secondary_vector_stores: True if the secondary client's resource holds the same vector stores, otherwise file_search calls are hedged to the primary.
+  def __init__(self, percentile=95, min_delay_seconds=1.0, max_delay_seconds=10.0, fixed_delay_seconds=0.0, max_in_flight=16
+    ,secondary_client=None, secondary_model=None, secondary_vector_stores=False, latency_tracker: Optional[LatencyTracker] = None):
+    self.percentile = percentile
+    self.min_delay_seconds = min_delay_seconds
+    self.max_delay_seconds = max_delay_seconds
+    self.fixed_delay_seconds = fixed_delay_seconds
+    self.max_in_flight = max_in_flight
+    self.secondary_client = secondary_client
+    self.secondary_model = secondary_model
+    self.secondary_vector_stores = secondary_vector_stores
+    self.latency_tracker = latency_tracker or upstream_latency
+    self.stats = HedgingStats()
+    self._in_flight = 0
+    self._lock = threading.Lock()
+
+  # Returns the seconds to wait for the first call before the hedge is sent, None if the call should not be hedged
+  def get_delay_seconds(self, model: str) -> Optional[float]:
+    delay = self.latency_tracker.get_percentile(model, self.percentile)
+    if delay is None: delay = self.fixed_delay_seconds or None
+    if delay is None: return None
+    return min(self.max_delay_seconds, max(self.min_delay_seconds, delay))
+
+  # Calls primary_fn and, if it has not answered after the hedging delay, also secondary_fn. Returns the first result;
+  # raises the error of the first call if both fail. The slower sync call can't be cancelled, it finishes in its thread and is discarded.
+  def call(self, primary_fn: Callable[[], Any], secondary_fn: Callable[[], Any], model: str) -> Any:
+    delay = self.get_delay_seconds(model)
+    self._count("calls")
+    if delay is None: return primary_fn()
+    primary_future = _start_thread(primary_fn)
+    try:
+      return primary_future.result(timeout=delay)
+    except FuturesTimeoutError:
+      pass
+    if not self._try_start_hedge(delay): return primary_future.result()
+    try:
+      hedge_future = _start_thread(secondary_fn)
+      names = {primary_future: "primary", hedge_future: "hedge"}
+      pending = set(names)
+      first_error = None
+      while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+          if future.exception() is not None:
+            print(f"  Hedged call: {names[future]} call failed: {str(future.exception())}")
+            first_error = first_error or future.exception()
+            continue
+          self._record_winner(model, names[future])
+          return future.result()
+      raise first_error
+    finally:
+      self._end_hedge()
+
+  def get_stats(self) -> Dict[str, Any]:
+    with self._lock:
+      return {
+        "calls": self.stats.calls
+        ,"hedged": self.stats.hedged
+        ,"primary_wins": self.stats.primary_wins
+        ,"hedge_wins": self.stats.hedge_wins
+        ,"skipped": self.stats.skipped
+        ,"in_flight": self._in_flight
+        ,"percentile": self.percentile
+        ,"secondary_model": self.secondary_model
+        ,"secondary_client": self.secondary_client is not None
+        ,"secondary_vector_stores": self.secondary_vector_stores
+      }
+
+  # A hedge is only sent if it can answer before the request deadline (assuming it takes as long as the delay) and max_in_flight is not reached
+  def _try_start_hedge(self, delay: float) -> bool:
+    with self._lock:
+      if self._in_flight >= self.max_in_flight or not can_finish_in_time(delay):
+        self.stats.skipped += 1
+        return False
+      self._in_flight += 1
+      self.stats.hedged += 1
+      return True
+
+  def _end_hedge(self):
+    with self._lock: self._in_flight -= 1
+
+  def _record_winner(self, model: str, winner: str):
+    with self._lock:
+      if winner == "primary": self.stats.primary_wins += 1
+      else: self.stats.hedge_wins += 1
+    record_hedge(model, winner)
+
+  def _count(self, name: str):
+    with self._lock: setattr(self.stats, name, getattr(self.stats, name) + 1)
+
+# Runs fn with a copy of the current context (request timings, priority, deadline) in a new daemon thread and returns its future.
+# Threads instead of a pool, so calls never queue behind other slow calls.
+def _start_thread(fn: Callable[[], Any]) -> Future:
+  future = Future()
+  context = contextvars.copy_context()
+  def run():
+    try:
+      future.set_result(context.run(fn))
+    except BaseException as e:
+      future.set_exception(e)
+  threading.Thread(target=run, name="hedged-call", daemon=True).start()
+  return future
+
+
+# Creates the hedging policy from environment variables. Returns None if hedging is disabled.
+# The secondary clients are set by the caller (see HEDGING_SECONDARY_* in app.py).
+def create_hedging_policy_from_env() -> Optional[HedgingPolicy]:
+  if os.getenv("HEDGING_ENABLED", "false").lower() not in ['true']: return None
+  return HedgingPolicy(
+    percentile=float(os.getenv("HEDGING_PERCENTILE", "95"))
+    ,min_delay_seconds=float(os.getenv("HEDGING_MIN_DELAY_SECONDS", "1"))
+    ,max_delay_seconds=float(os.getenv("HEDGING_MAX_DELAY_SECONDS", "10"))
+    ,fixed_delay_seconds=float(os.getenv("HEDGING_FIXED_DELAY_SECONDS", "0"))
+    ,max_in_flight=int(os.getenv("HEDGING_MAX_IN_FLIGHT", "16"))
+    ,secondary_model=os.getenv("HEDGING_SECONDARY_MODEL_DEPLOYMENT_NAME") or None
+    ,secondary_vector_stores=os.getenv("HEDGING_SECONDARY_VECTOR_STORES", "false").lower() in ['true']
+  )
@@ -0,0 +1,51 @@
+# JSON encoding for all endpoints: orjson if installed, otherwise the standard library
+# Copyright 2025, Karsten Held (MIT License)
+
+import json
+import os
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+  import orjson
+except ImportError:  # optional dependency
+  orjson = None
+
+# 'auto' uses orjson if installed, 'stdlib' always uses the json module
+_json_encoder_setting = os.getenv("JSON_ENCODER", "auto").lower()
+if _json_encoder_setting == "orjson" and orjson is None: print(f"JSON encoder: orjson is not installed, using the standard library.")
+json_encoder_name = "orjson" if (orjson is not None and _json_encoder_setting != "stdlib") else "stdlib"
+
+# Types that neither encoder supports natively (e.g. decimal.Decimal) are converted like Flask does
+_default = DefaultJSONProvider.default
+_orjson_options = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+# Returns compact JSON as UTF-8 bytes. orjson writes non-ASCII characters as UTF-8, the standard library escapes them (its faster C path).
+def dumps_bytes(obj: Any) -> bytes:
+  if json_encoder_name == "orjson": return orjson.dumps(obj, default=_default, option=_orjson_options)
+  return json.dumps(obj, default=_default, separators=(",", ":")).encode("ascii")
+
+# Returns compact JSON as string
+def dumps(obj: Any) -> str:
+  if json_encoder_name == "orjson": return orjson.dumps(obj, default=_default, option=_orjson_options).decode("utf-8")
+  return json.dumps(obj, default=_default, separators=(",", ":"))
+
+
+# Flask JSON provider using orjson for jsonify() and request.get_json(). Keys keep their insertion order.
+class OrjsonJSONProvider(DefaultJSONProvider):
+  def dumps(self, obj: Any, **kwargs: Any) -> str:
+    option = _orjson_options
+    if kwargs.get("indent"): option |= orjson.OPT_INDENT_2
+    if kwargs.get("sort_keys", self.sort_keys): option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode("utf-8")
+
+  def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+    return orjson.loads(s)
+
+# Sets the JSON provider of the given Flask app according to JSON_ENCODER
+def init_json_provider(app):
+  if json_encoder_name != "orjson": return
+  app.json = OrjsonJSONProvider(app)
+  app.json.sort_keys = False
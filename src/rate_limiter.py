@@ -0,0 +1,218 @@
+# Client-side rate limiter for OpenAI calls: request-per-minute and token-per-minute buckets per deployment with priorities
+# Copyright 2025, Karsten Held (MIT License)
+
+import contextvars
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from request_deadline import can_finish_in_time, DeadlineExceededError
+
+# Request priorities, lower values are served first
+PRIORITY_QUERY = 0    # /query from the chat front end
+PRIORITY_BATCH = 1    # /query/batch and other bulk traffic
+PRIORITY_SEARCH = 2   # /search debugging traffic
+
+# Priority of the current request. Set by the route handlers, read by RateLimiter.acquire().
+_request_priority = contextvars.ContextVar("request_priority", default=PRIORITY_QUERY)
+
+def set_request_priority(priority: int):
+  _request_priority.set(priority)
+
+def get_request_priority() -> int:
+  return _request_priority.get()
+
+
+# Token bucket that refills continuously with capacity per minute. capacity=0 means unlimited until a limit is learned from response headers.
+# Azure OpenAI enforces quotas over short windows, so bursts are limited to burst_seconds worth of the capacity.
+class TokenBucket:
+  def __init__(self, capacity_per_minute: float, burst_seconds: float = 10):
+    self.capacity = float(capacity_per_minute)
+    self.burst_seconds = burst_seconds
+    self.level = self.max_level
+    self.updated_at = time.monotonic()
+
+  @property
+  def max_level(self) -> float:
+    return self.capacity * self.burst_seconds / 60.0
+
+  def set_capacity(self, capacity_per_minute: float):
+    self.capacity = float(capacity_per_minute)
+    self.level = self.max_level
+
+  def refill(self, now: float):
+    if self.capacity > 0:
+      self.level = min(self.max_level, self.level + (now - self.updated_at) * self.capacity / 60.0)
+    self.updated_at = now
+
+  # Seconds until the bucket holds the given amount (0 if available now)
+  def get_wait_seconds(self, amount: float) -> float:
+    if self.capacity <= 0 or self.level >= amount: return 0.0
+    # Requests larger than the whole bucket wait for a full bucket instead of forever
+    missing = min(amount, self.max_level) - self.level
+    return max(0.0, missing * 60.0 / self.capacity)
+
+  def consume(self, amount: float):
+    if self.capacity > 0: self.level -= amount
+
+  # Returns a consumed amount that was not used (e.g. the estimate of a failed call), at most up to a full bucket
+  def refund(self, amount: float):
+    if self.capacity > 0: self.level = min(self.max_level, self.level + amount)
+
+@dataclass
+class DeploymentRateLimitStats:
+  requests: int = 0
+  queued: int = 0               # requests that had to wait for the buckets
+  queue_wait_seconds: float = 0.0
+  rate_limited: int = 0         # 429 responses seen despite the limiter
+  tokens_used: int = 0
+
+# Buckets and bookkeeping of a single deployment
+class _DeploymentState:
+  def __init__(self, requests_per_minute, tokens_per_minute, estimated_tokens_per_request):
+    self.requests = TokenBucket(requests_per_minute)
+    self.tokens = TokenBucket(tokens_per_minute)
+    self.estimated_tokens_per_request = float(estimated_tokens_per_request)
+    self.waiting: Dict[int, int] = {}  # priority -> number of waiting requests
+    self.paused_until = 0.0            # set by 429 responses with Retry-After
+    self.stats = DeploymentRateLimitStats()
+
+
+# Proactive rate limiter. acquire() blocks until the deployment has budget for one request and waits while requests with higher priority are queued.
+# update_from_headers() corrects the buckets with the quota reported by the service (x-ratelimit-* headers), which also covers the usage of other workers.
+class RateLimiter:
+  def __init__(self, requests_per_minute=0, tokens_per_minute=0, estimated_tokens_per_request=2000, max_wait_seconds=60):
+    self.requests_per_minute = requests_per_minute
+    self.tokens_per_minute = tokens_per_minute
+    self.estimated_tokens_per_request = estimated_tokens_per_request
+    self.max_wait_seconds = max_wait_seconds
+    self._deployments: Dict[str, _DeploymentState] = {}
+    self._lock = threading.Lock()
+
+  def _get_state(self, deployment: str) -> _DeploymentState:
+    state = self._deployments.get(deployment)
+    if state is None:
+      state = _DeploymentState(self.requests_per_minute, self.tokens_per_minute, self.estimated_tokens_per_request)
+      self._deployments[deployment] = state
+    return state
+
+  # Returns 0 and consumes the budget if the request can start now, otherwise the number of seconds to wait before trying again
+  def _try_acquire(self, deployment: str, priority: int) -> float:
+    with self._lock:
+      state = self._get_state(deployment)
+      now = time.monotonic()
+      state.requests.refill(now)
+      state.tokens.refill(now)
+      wait_seconds = max(state.paused_until - now, state.requests.get_wait_seconds(1), state.tokens.get_wait_seconds(state.estimated_tokens_per_request))
+      if wait_seconds <= 0 and any(count > 0 for p, count in state.waiting.items() if p < priority):
+        # Leave the budget to queued requests with higher priority
+        wait_seconds = 0.05
+      if wait_seconds > 0: return wait_seconds
+      state.requests.consume(1)
+      state.tokens.consume(state.estimated_tokens_per_request)
+      state.stats.requests += 1
+      return 0.0
+
+  def _set_waiting(self, deployment: str, priority: int, delta: int):
+    with self._lock:
+      state = self._get_state(deployment)
+      state.waiting[priority] = state.waiting.get(priority, 0) + delta
+      if delta > 0: state.stats.queued += 1
+
+  def _add_wait_time(self, deployment: str, seconds: float):
+    with self._lock: self._get_state(deployment).stats.queue_wait_seconds += seconds
+
+  # Blocks until the deployment has budget. Gives up waiting after max_wait_seconds and lets the request through (the service will then answer with 429).
+  # Raises DeadlineExceededError instead of waiting past the deadline of the current request (see request_deadline.py).
+  def acquire(self, deployment: str, priority: Optional[int] = None):
+    priority = get_request_priority() if priority is None else priority
+    wait_seconds = self._try_acquire(deployment, priority)
+    if wait_seconds <= 0: return
+    start_time = time.monotonic()
+    self._set_waiting(deployment, priority, 1)
+    try:
+      while wait_seconds > 0 and time.monotonic() - start_time < self.max_wait_seconds:
+        _check_wait_deadline(deployment, wait_seconds)
+        time.sleep(min(wait_seconds, 1.0))
+        wait_seconds = self._try_acquire(deployment, priority)
+    finally:
+      self._set_waiting(deployment, priority, -1)
+      self._add_wait_time(deployment, time.monotonic() - start_time)
+
+  # Corrects the token bucket with the actual usage of a finished request and updates the per-request estimate (moving average)
+  def record_usage(self, deployment: str, total_tokens: int):
+    with self._lock:
+      state = self._get_state(deployment)
+      state.tokens.consume(total_tokens - state.estimated_tokens_per_request)
+      state.estimated_tokens_per_request = 0.8 * state.estimated_tokens_per_request + 0.2 * total_tokens
+      state.stats.tokens_used += total_tokens
+
+  # Reads the remaining quota from the response headers of OpenAI and Azure OpenAI (x-ratelimit-limit-*, x-ratelimit-remaining-*)
+  def update_from_headers(self, deployment: str, headers):
+    limit_requests = _parse_header_number(headers, "x-ratelimit-limit-requests")
+    limit_tokens = _parse_header_number(headers, "x-ratelimit-limit-tokens")
+    remaining_requests = _parse_header_number(headers, "x-ratelimit-remaining-requests")
+    remaining_tokens = _parse_header_number(headers, "x-ratelimit-remaining-tokens")
+    with self._lock:
+      state = self._get_state(deployment)
+      now = time.monotonic()
+      for bucket, limit, remaining in [(state.requests, limit_requests, remaining_requests), (state.tokens, limit_tokens, remaining_tokens)]:
+        bucket.refill(now)
+        # Configured limits take precedence, learned limits are used if none are configured
+        if limit is not None and bucket.capacity <= 0: bucket.set_capacity(limit)
+        if remaining is not None and bucket.capacity > 0: bucket.level = min(bucket.level, remaining)
+
+  # Pauses all requests to the deployment after a 429 response
+  def on_rate_limited(self, deployment: str, retry_after_seconds: Optional[float]):
+    with self._lock:
+      state = self._get_state(deployment)
+      state.stats.rate_limited += 1
+      if retry_after_seconds: state.paused_until = max(state.paused_until, time.monotonic() + retry_after_seconds)
+
+  def get_stats(self) -> Dict[str, Any]:
+    with self._lock:
+      return {
+        deployment: {
+          "requests": state.stats.requests
+          ,"queued": state.stats.queued
+          ,"queue_wait_seconds": round(state.stats.queue_wait_seconds, 3)
+          ,"waiting": sum(state.waiting.values())
+          ,"rate_limited": state.stats.rate_limited
+          ,"tokens_used": state.stats.tokens_used
+          ,"estimated_tokens_per_request": round(state.estimated_tokens_per_request)
+          ,"requests_per_minute": state.requests.capacity
+          ,"tokens_per_minute": state.tokens.capacity
+          ,"remaining_requests": round(state.requests.level) if state.requests.capacity > 0 else None
+          ,"remaining_tokens": round(state.tokens.level) if state.tokens.capacity > 0 else None
+        } for deployment, state in self._deployments.items()
+      }
+
+# Raises DeadlineExceededError if waiting wait_seconds for budget would end after the deadline of the current request
+def _check_wait_deadline(deployment: str, wait_seconds: float):
+  if not can_finish_in_time(wait_seconds): raise DeadlineExceededError(f"Rate limiter: deployment '{deployment}' has no budget before the request deadline.")
+
+def _parse_header_number(headers, name) -> Optional[float]:
+  value = headers.get(name) if headers is not None else None
+  if value is None: return None
+  try: return float(value)
+  except ValueError: return None
+
+# Returns the wait time requested by a 429 response in seconds (retry-after-ms, retry-after), or None
+def get_retry_after_seconds(headers) -> Optional[float]:
+  retry_after_ms = _parse_header_number(headers, "retry-after-ms")
+  if retry_after_ms is not None: return retry_after_ms / 1000.0
+  return _parse_header_number(headers, "retry-after")
+
+
+# Creates the rate limiter from environment variables. Returns None if rate limiting is disabled.
+# Without configured limits, the limits are learned from the x-ratelimit-* response headers.
+def create_rate_limiter_from_env() -> Optional[RateLimiter]:
+  if os.getenv("RATE_LIMIT_ENABLED", "true").lower() not in ['true']: return None
+  return RateLimiter(
+    requests_per_minute=float(os.getenv("RATE_LIMIT_REQUESTS_PER_MINUTE", "0"))
+    ,tokens_per_minute=float(os.getenv("RATE_LIMIT_TOKENS_PER_MINUTE", "0"))
+    ,estimated_tokens_per_request=float(os.getenv("RATE_LIMIT_ESTIMATED_TOKENS_PER_REQUEST", "2000"))
+    ,max_wait_seconds=float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "60"))
+  )
@@ -0,0 +1,34 @@
+# Per-request deadlines: the time by which a request must be answered, propagated to upstream calls and their retries
+# Copyright 2025, Karsten Held (MIT License)
+
+import contextvars
+import time
+from typing import Optional
+
+
+# Raised instead of starting an upstream call or retry that cannot finish before the deadline of the request
+class DeadlineExceededError(TimeoutError):
+  pass
+
+# Deadline of the current request as time.monotonic() value, None = no deadline. Set by the route handlers (see app.py), copied into
+# threads and the background event loop together with the other context variables.
+_request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+# Sets the deadline of the current request to timeout_seconds from now (None or 0 = no deadline)
+def set_request_deadline(timeout_seconds: Optional[float]):
+  _request_deadline.set(time.monotonic() + timeout_seconds if timeout_seconds else None)
+
+# Returns the seconds left until the deadline of the current request, None if it has no deadline
+def get_remaining_seconds() -> Optional[float]:
+  deadline = _request_deadline.get()
+  return None if deadline is None else deadline - time.monotonic()
+
+# Raises DeadlineExceededError if the deadline of the current request has passed
+def check_deadline(operation: str):
+  remaining_seconds = get_remaining_seconds()
+  if remaining_seconds is not None and remaining_seconds <= 0: raise DeadlineExceededError(f"Request deadline exceeded before {operation}.")
+
+# Returns True if an operation that takes about the given seconds can finish before the deadline (always True without deadline)
+def can_finish_in_time(seconds: float) -> bool:
+  remaining_seconds = get_remaining_seconds()
+  return remaining_seconds is None or remaining_seconds >= seconds
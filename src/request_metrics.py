@@ -0,0 +1,241 @@
+# Request latency instrumentation: per-phase timers, Prometheus-style counters and histograms (/metrics) and the Server-Timing header
+# Copyright 2025, Karsten Held (MIT License)
+
+import collections
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Histogram buckets in seconds, from cache hits (milliseconds) to slow model calls with retries
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+  parts = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+  if extra: parts.append(extra)
+  return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape_label_value(value) -> str:
+  return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_number(value: float) -> str:
+  return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+  def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = ()):
+    self.name = name
+    self.help = help
+    self.label_names = label_names
+    self._values: Dict[Tuple[str, ...], float] = {}
+    self._lock = threading.Lock()
+
+  def inc(self, *label_values, value: float = 1):
+    with self._lock: self._values[label_values] = self._values.get(label_values, 0) + value
+
+  def render(self) -> List[str]:
+    lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+    with self._lock:
+      for label_values, value in sorted(self._values.items()):
+        lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_number(value)}")
+    return lines
+
+class Histogram:
+  def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+    self.name = name
+    self.help = help
+    self.label_names = label_names
+    self.buckets = tuple(buckets)
+    # label values -> [count per bucket (not cumulative, last one is +Inf), sum]
+    self._values: Dict[Tuple[str, ...], list] = {}
+    self._lock = threading.Lock()
+
+  def observe(self, value: float, *label_values):
+    # Linear search is faster than bisect for this few buckets
+    bucket_index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+    with self._lock:
+      entry = self._values.get(label_values)
+      if entry is None: entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+      entry[0][bucket_index] += 1
+      entry[1] += value
+
+  def render(self) -> List[str]:
+    lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+    with self._lock:
+      for label_values, (counts, total) in sorted(self._values.items()):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+          cumulative += count
+          le = "+Inf" if bound == float("inf") else _format_number(bound)
+          le_label = f'le="{le}"'
+          lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, le_label)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.label_names, label_values)} {_format_number(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.label_names, label_values)} {cumulative}")
+    return lines
+
+# Metrics of this process. With multiple gunicorn workers each worker has its own metrics, same as the other /*/stats endpoints.
+class MetricsRegistry:
+  def __init__(self):
+    self._metrics = []
+
+  def counter(self, name: str, help: str, label_names: Tuple[str, ...] = ()) -> Counter:
+    metric = Counter(name, help, label_names)
+    self._metrics.append(metric)
+    return metric
+
+  def histogram(self, name: str, help: str, label_names: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+    metric = Histogram(name, help, label_names, buckets)
+    self._metrics.append(metric)
+    return metric
+
+  # Returns all metrics in the Prometheus text exposition format
+  def render(self) -> str:
+    return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+metrics = MetricsRegistry()
+HTTP_REQUESTS = metrics.counter("http_requests_total", "HTTP requests by endpoint and status", ("endpoint", "method", "status"))
+HTTP_REQUEST_DURATION = metrics.histogram("http_request_duration_seconds", "Total time per HTTP request including streaming of the response body", ("endpoint", "method"))
+HTTP_REQUEST_PHASE_DURATION = metrics.histogram("http_request_phase_duration_seconds", "Time per HTTP request spent in each phase", ("endpoint", "phase"))
+OPENAI_REQUESTS = metrics.counter("openai_requests_total", "Upstream OpenAI calls by outcome (ok, rate_limited, error)", ("model", "operation", "outcome"))
+OPENAI_REQUEST_DURATION = metrics.histogram("openai_request_duration_seconds", "Duration of single upstream OpenAI calls (without retry and rate limiter waits)", ("model", "operation"))
+OPENAI_RETRIES = metrics.counter("openai_retries_total", "Retries of upstream OpenAI calls after rate limit errors")
+OPENAI_TOKENS = metrics.counter("openai_tokens_total", "Tokens reported in response.usage", ("model", "type"))
+OPENAI_HEDGES = metrics.counter("openai_hedged_requests_total", "Upstream calls that were hedged with a second call, by the call that answered first", ("model", "winner"))
+OPENAI_DEADLINE_EXCEEDED = metrics.counter("openai_deadline_exceeded_total", "Upstream calls and retries not started because they could not finish before the request deadline")
+OPENAI_DEPLOYMENT_ERRORS = metrics.counter("openai_deployment_errors_total", "429, 5xx and connection errors of the deployments in the pool, answered by failover to another deployment if possible", ("deployment", "reason"))
+
+
+# Phase durations of the current request. Phases that occur multiple times (e.g. upstream calls with retries) are summed up,
+# phases running in parallel (federated searches) can therefore add up to more than the total request time.
+class RequestTimings:
+  def __init__(self, endpoint: str):
+    self.endpoint = endpoint
+    self.start_time = time.perf_counter()
+    self.phases: Dict[str, float] = {}
+    self._lock = threading.Lock()
+
+  def add(self, phase: str, seconds: float):
+    with self._lock: self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+  def get_phases(self) -> List[Tuple[str, float]]:
+    with self._lock: return list(self.phases.items())
+
+  def get_elapsed_seconds(self) -> float:
+    return time.perf_counter() - self.start_time
+
+  # Returns the Server-Timing header value with the phases so far and the total time, in milliseconds
+  def get_server_timing_header(self) -> str:
+    phases = self.get_phases()
+    phases.append(("total", self.get_elapsed_seconds()))
+    return ", ".join(f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in phases)
+
+# Timings of the current request. The value is copied into threads and the background event loop together with the other context variables.
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def start_request_timings(endpoint: str) -> RequestTimings:
+  timings = RequestTimings(endpoint)
+  _request_timings.set(timings)
+  return timings
+
+def get_request_timings() -> Optional[RequestTimings]:
+  return _request_timings.get()
+
+# Records the total time and the phases of a finished request
+def finish_request_timings(timings: RequestTimings, method: str, status: int):
+  HTTP_REQUESTS.inc(timings.endpoint, method, str(status))
+  HTTP_REQUEST_DURATION.observe(timings.get_elapsed_seconds(), timings.endpoint, method)
+  for phase, seconds in timings.get_phases(): HTTP_REQUEST_PHASE_DURATION.observe(seconds, timings.endpoint, phase)
+
+# Adds the given duration to a phase of the current request (no-op outside of requests)
+def record_phase(phase: str, seconds: float):
+  timings = _request_timings.get()
+  if timings is not None: timings.add(phase, seconds)
+
+# Measures the enclosed block as a phase of the current request
+@contextmanager
+def time_phase(phase: str):
+  start_time = time.perf_counter()
+  try:
+    yield
+  finally:
+    record_phase(phase, time.perf_counter() - start_time)
+
+# Measures the enclosed upstream call: 'upstream' phase of the current request plus the openai_request_* metrics
+@contextmanager
+def time_upstream_call(model: str, operation: str):
+  start_time = time.perf_counter()
+  outcome = "error"
+  try:
+    yield
+    outcome = "ok"
+  except Exception as e:
+    # By status code, Azure OpenAI 429 responses have no error type
+    if getattr(e, 'status_code', None) == 429: outcome = "rate_limited"
+    raise
+  finally:
+    seconds = time.perf_counter() - start_time
+    record_phase("upstream", seconds)
+    OPENAI_REQUESTS.inc(model, operation, outcome)
+    OPENAI_REQUEST_DURATION.observe(seconds, model, operation)
+
+# Yields the items of the given iterable and adds the time spent producing them to a phase of the current request.
+# Used for streamed responses, where the time spent sending the items to the client must not count.
+def iter_timed(iterable, phase: str):
+  iterator = iter(iterable)
+  while True:
+    start_time = time.perf_counter()
+    try:
+      item = next(iterator)
+    except StopIteration:
+      record_phase(phase, time.perf_counter() - start_time)
+      return
+    record_phase(phase, time.perf_counter() - start_time)
+    yield item
+
+def record_retry():
+  OPENAI_RETRIES.inc()
+
+# Records the token counts of response.usage (ignored if usage is None)
+def record_token_usage(model: str, usage):
+  if usage is None: return
+  OPENAI_TOKENS.inc(model, "input", value=usage.input_tokens)
+  OPENAI_TOKENS.inc(model, "output", value=usage.output_tokens)
+
+def record_hedge(model: str, winner: str):
+  OPENAI_HEDGES.inc(model, winner)
+
+def record_deadline_exceeded():
+  OPENAI_DEADLINE_EXCEEDED.inc()
+
+def record_deployment_error(deployment: str, reason: str):
+  OPENAI_DEPLOYMENT_ERRORS.inc(deployment, reason)
+
+# Recent durations of successful upstream calls per model, used for latency-based decisions (hedging delay, expected retry duration)
+class LatencyTracker:
+  def __init__(self, window_size: int = 200, min_samples: int = 20):
+    self.window_size = window_size
+    self.min_samples = min_samples
+    self._samples: Dict[str, collections.deque] = {}
+    self._lock = threading.Lock()
+
+  def record(self, key: str, seconds: float):
+    with self._lock:
+      samples = self._samples.get(key)
+      if samples is None: samples = self._samples[key] = collections.deque(maxlen=self.window_size)
+      samples.append(seconds)
+
+  # Returns the given percentile (0-100) of the recent durations of key (None = all keys), None if there are less than min_samples
+  def get_percentile(self, key: Optional[str], percentile: float) -> Optional[float]:
+    with self._lock:
+      samples = self._samples.get(key, ()) if key is not None else [seconds for samples in self._samples.values() for seconds in samples]
+      if len(samples) < self.min_samples: return None
+      sorted_samples = sorted(samples)
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * percentile / 100))]
+
+# Durations of successful Responses API calls (without streams) of this process
+upstream_latency = LatencyTracker()
+
+def render_metrics() -> str:
+  return metrics.render()
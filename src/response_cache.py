@@ -0,0 +1,211 @@
+# Response cache for /query and /search results
+# Copyright 2025, Karsten Held (MIT License)
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Union
+
+
+# A cached response: the data object returned by build_data_object() and its serialized '{"data": ...}' body (UTF-8 bytes)
+@dataclass
+class CachedResponse:
+  data: Dict[str, Any]
+  body: Union[bytes, str]
+
+# Counters exposed by the cache (per process)
+@dataclass
+class ResponseCacheStats:
+  hits: int = 0
+  misses: int = 0
+  memory_hits: int = 0
+  disk_hits: int = 0
+  stores: int = 0
+  evictions: int = 0
+  expirations: int = 0
+
+_PUNCTUATION_REGEX = re.compile(r"[^\w\s]", re.UNICODE)
+_WHITESPACE_REGEX = re.compile(r"\s+", re.UNICODE)
+
+# Normalizes a query for cache lookups. In near-duplicate mode case, punctuation and whitespace differences are ignored.
+def normalize_query(query: str, near_duplicate: bool = False) -> str:
+  if not near_duplicate: return query
+  normalized = _PUNCTUATION_REGEX.sub(" ", query.lower())
+  return _WHITESPACE_REGEX.sub(" ", normalized).strip()
+
+# Returns a stable cache key for the given search parameters
+def build_cache_key(query, vector_store_id, model, max_num_results, temperature, near_duplicate=False, backend="responses") -> str:
+  key_parts = [normalize_query(query, near_duplicate), vector_store_id, model, max_num_results, temperature, backend]
+  return hashlib.sha256(json.dumps(key_parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+# Optional shared tier backed by a sqlite file so that all gunicorn workers on the same machine share hits
+class _SqliteResponseCacheTier:
+  def __init__(self, path: str, max_entries: int):
+    self.path = path
+    self.max_entries = max_entries
+    self._local = threading.local()
+    self._writes_since_prune = 0
+    connection = self._get_connection()
+    connection.execute("CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, body TEXT NOT NULL, expires_at REAL NOT NULL)")
+    connection.execute("CREATE INDEX IF NOT EXISTS response_cache_expires_at ON response_cache (expires_at)")
+    connection.commit()
+
+  # sqlite connections must not be shared between threads, so each thread gets its own
+  def _get_connection(self) -> sqlite3.Connection:
+    connection = getattr(self._local, "connection", None)
+    if connection is None:
+      connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+      connection.execute("PRAGMA journal_mode=WAL")
+      connection.execute("PRAGMA synchronous=NORMAL")
+      self._local.connection = connection
+    return connection
+
+  def get(self, key: str) -> Optional[Union[bytes, str]]:
+    row = self._get_connection().execute("SELECT body, expires_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+    if row is None or row[1] < time.time(): return None
+    return row[0]
+
+  def set(self, key: str, body: Union[bytes, str], ttl_seconds: float):
+    connection = self._get_connection()
+    connection.execute("INSERT OR REPLACE INTO response_cache (key, body, expires_at) VALUES (?, ?, ?)", (key, body, time.time() + ttl_seconds))
+    self._writes_since_prune += 1
+    if self._writes_since_prune >= 100:
+      self._writes_since_prune = 0
+      self.prune()
+
+  # Deletes expired entries and keeps only the newest max_entries rows
+  def prune(self):
+    connection = self._get_connection()
+    connection.execute("DELETE FROM response_cache WHERE expires_at < ?", (time.time(),))
+    connection.execute("DELETE FROM response_cache WHERE key NOT IN (SELECT key FROM response_cache ORDER BY expires_at DESC LIMIT ?)", (self.max_entries,))
+
+  def clear(self):
+    self._get_connection().execute("DELETE FROM response_cache")
+
+
+# Two-tier response cache: in-process LRU with TTL and size-based eviction, plus an optional shared sqlite tier
+class ResponseCache:
+  def __init__(self, max_entries=1000, max_bytes=50*1024*1024, ttl_seconds=300, near_duplicate=False, sqlite_path=None):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.ttl_seconds = ttl_seconds
+    self.near_duplicate = near_duplicate
+    self.stats = ResponseCacheStats()
+    # key -> (expires_at, CachedResponse, size_in_bytes)
+    self._entries: "OrderedDict[str, tuple[float, CachedResponse, int]]" = OrderedDict()
+    self._total_bytes = 0
+    self._lock = threading.Lock()
+    self._disk_tier = _SqliteResponseCacheTier(sqlite_path, max_entries) if sqlite_path else None
+
+  # True if entries are visible to other processes (sqlite tier), e.g. to gunicorn workers waiting for the same call
+  def is_shared_across_processes(self) -> bool:
+    return self._disk_tier is not None
+
+  def make_key(self, query, vector_store_id, model, max_num_results, temperature, backend="responses") -> str:
+    return build_cache_key(query, vector_store_id, model, max_num_results, temperature, self.near_duplicate, backend)
+
+  # Returns the cached response or None if the key is unknown or expired
+  def get(self, key: str) -> Optional[CachedResponse]:
+    now = time.monotonic()
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        if entry[0] >= now:
+          self._entries.move_to_end(key)
+          self.stats.hits += 1
+          self.stats.memory_hits += 1
+          return entry[1]
+        self._remove(key)
+        self.stats.expirations += 1
+    if self._disk_tier is not None:
+      try:
+        body = self._disk_tier.get(key)
+      except sqlite3.Error as e:
+        print(f"  Response cache: sqlite read failed: {str(e)}")
+        body = None
+      if body is not None:
+        cached_response = CachedResponse(data=json.loads(body)["data"], body=body)
+        with self._lock:
+          self._store(key, cached_response)
+          self.stats.hits += 1
+          self.stats.disk_hits += 1
+        return cached_response
+    with self._lock:
+      self.stats.misses += 1
+    return None
+
+  def set(self, key: str, data: Dict[str, Any], body: Union[bytes, str]) -> CachedResponse:
+    cached_response = CachedResponse(data=data, body=body)
+    with self._lock:
+      self._store(key, cached_response)
+      self.stats.stores += 1
+    if self._disk_tier is not None:
+      try:
+        self._disk_tier.set(key, body, self.ttl_seconds)
+      except sqlite3.Error as e:
+        print(f"  Response cache: sqlite write failed: {str(e)}")
+    return cached_response
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self._total_bytes = 0
+    if self._disk_tier is not None: self._disk_tier.clear()
+
+  def get_stats(self) -> Dict[str, Any]:
+    with self._lock:
+      lookups = self.stats.hits + self.stats.misses
+      return {
+        "hits": self.stats.hits
+        ,"misses": self.stats.misses
+        ,"memory_hits": self.stats.memory_hits
+        ,"disk_hits": self.stats.disk_hits
+        ,"stores": self.stats.stores
+        ,"evictions": self.stats.evictions
+        ,"expirations": self.stats.expirations
+        ,"hit_ratio": (self.stats.hits / lookups) if lookups else 0.0
+        ,"entries": len(self._entries)
+        ,"bytes": self._total_bytes
+        ,"max_entries": self.max_entries
+        ,"max_bytes": self.max_bytes
+        ,"ttl_seconds": self.ttl_seconds
+        ,"near_duplicate": self.near_duplicate
+        ,"shared_tier": self._disk_tier.path if self._disk_tier else None
+      }
+
+  # Must be called with self._lock held
+  def _store(self, key: str, cached_response: CachedResponse):
+    body = cached_response.body
+    size = len(body) if isinstance(body, bytes) else len(body.encode("utf-8"))
+    if key in self._entries: self._remove(key)
+    if size > self.max_bytes: return
+    self._entries[key] = (time.monotonic() + self.ttl_seconds, cached_response, size)
+    self._total_bytes += size
+    while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+      oldest_key = next(iter(self._entries))
+      self._remove(oldest_key)
+      self.stats.evictions += 1
+
+  # Must be called with self._lock held
+  def _remove(self, key: str):
+    entry = self._entries.pop(key, None)
+    if entry is not None: self._total_bytes -= entry[2]
+
+
+# Creates the response cache from environment variables. Returns None if caching is disabled.
+def create_response_cache_from_env() -> Optional[ResponseCache]:
+  if os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() not in ['true']: return None
+  return ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    ,max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(50*1024*1024)))
+    ,ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+    ,near_duplicate=os.getenv("RESPONSE_CACHE_NEAR_DUPLICATE", "false").lower() in ['true']
+    ,sqlite_path=os.getenv("RESPONSE_CACHE_SQLITE_PATH") or None
+  )
@@ -0,0 +1,349 @@
+# Semantic answer cache for /query: returns the answer of a previous query with a similar meaning (embedding cosine similarity)
+# Copyright 2025, Karsten Held (MIT License)
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from response_cache import normalize_query
+
+try:
+  import numpy as np
+except ImportError:  # optional dependency, the semantic cache is disabled without it
+  np = None
+
+
+# Result of a semantic cache hit: the cached data object and body of the stored query with its similarity to the current query
+@dataclass
+class SemanticCacheHit:
+  query: str
+  similarity: float
+  data: Dict[str, Any]
+  body: Union[bytes, str]
+
+@dataclass(slots=True)
+class _SemanticCacheEntry:
+  scope: str
+  vector_store_ids: Tuple[str, ...]
+  query: str
+  data: Dict[str, Any]
+  body: Union[bytes, str]
+  stored_at: float
+
+# Counters exposed by the cache (per process)
+@dataclass
+class SemanticCacheStats:
+  hits: int = 0
+  misses: int = 0
+  stores: int = 0
+  evictions: int = 0
+  expirations: int = 0
+  invalidations: int = 0
+  errors: int = 0
+
+# Vectors files not referenced by entries.json are removed by save() once they are older than this. Younger files may belong to a save
+# of another worker process that has not replaced entries.json yet.
+UNREFERENCED_VECTORS_FILE_MIN_AGE_SECONDS = 60
+
+
+# Deterministic local embedding without a model: signed feature hashing of words, word pairs and character trigrams.
+# Finds reworded and reordered queries, but not synonyms ('vacation' vs. 'holiday'). For tests and benchmarks only: it only sees shared words,
+# so a negation scores like a filler word ('is remote work allowed for contractors' vs. '... not allowed ...': 0.932, a hit at 0.92).
+def create_local_embedding_function(dimensions: int = 256) -> Callable[[str], Any]:
+  def embed(text: str):
+    words = normalize_query(text, near_duplicate=True).split()
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])] + [f"#{word[i:i+3]}" for word in words for i in range(max(1, len(word) - 2))]
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature in features:
+      hash_value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+      vector[hash_value % dimensions] += 1.0 if hash_value >> 63 else -1.0
+    return vector
+  return embed
+
+
+# Vector index of answered queries. Embeddings are kept normalized in a (capacity x dimensions) float32 matrix, so one matrix-vector
+# product returns the cosine similarity to all entries. Entries only match queries with the same scope (vector stores and search parameters).
+# Full caches evict the least recently used entry. Optionally persisted as snapshot in 'path', loaded memory-mapped (copy-on-write),
+# so worker processes share the pages of the snapshot until they change them.
+class SemanticCache:
+  def __init__(self, embed_fn: Callable[[str], Any], embedding_name: str, capacity=10000, min_similarity=0.92, ttl_seconds=86400, path=None, save_interval_seconds=300
+    ,version_fn: Optional[Callable[[str], str]] = None, version_check_interval_seconds=300):
+    self.embed_fn = embed_fn
+    self.embedding_name = embedding_name
+    self.capacity = capacity
+    self.min_similarity = min_similarity
+    self.ttl_seconds = ttl_seconds
+    self.path = path
+    self.save_interval_seconds = save_interval_seconds
+    self.version_fn = version_fn
+    self.version_check_interval_seconds = version_check_interval_seconds
+    self.stats = SemanticCacheStats()
+    self.dimensions = 0
+    self._vectors = None      # (capacity, dimensions) float32, allocated with the first entry or loaded from the snapshot
+    self._scope_ids = None    # scope id per slot, -1 = free
+    self._last_used = None    # time.time() of the last hit or store per slot
+    self._entries: List[Optional[_SemanticCacheEntry]] = []
+    self._size = 0            # slots in use or freed, the matrix is searched up to here
+    self._free_slots: List[int] = []
+    self._scope_ids_by_key: Dict[str, int] = {}
+    # vector store id -> (version, time.time() of the last check)
+    self._versions: Dict[str, Tuple[str, float]] = {}
+    self._lock = threading.Lock()
+    self._save_lock = threading.Lock()
+    self._dirty = False
+    self._saved_at = time.monotonic()
+    self._snapshot_file = None
+    if path: self._load()
+
+  # Returns the normalized embedding of the query. Raises the errors of the embedding function.
+  def embed(self, query: str):
+    vector = np.asarray(self.embed_fn(query), dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm > 0 else vector
+
+  # Returns the most similar entry with the given scope if its similarity is at least min_similarity, otherwise None
+  def get(self, vector, scope: str) -> Optional[SemanticCacheHit]:
+    with self._lock:
+      scope_id = self._scope_ids_by_key.get(scope)
+      if scope_id is None or self._size == 0 or vector.shape[0] != self.dimensions:
+        self.stats.misses += 1
+        return None
+      size = self._size
+      similarities = self._vectors[:size] @ vector
+      similarities[self._scope_ids[:size] != scope_id] = -np.inf
+      slot = int(np.argmax(similarities))
+      similarity = float(similarities[slot])
+      if similarity < self.min_similarity:
+        self.stats.misses += 1
+        return None
+      entry = self._entries[slot]
+      now = time.time()
+      if entry.stored_at + self.ttl_seconds < now:
+        self._remove(slot)
+        self.stats.expirations += 1
+        self.stats.misses += 1
+        return None
+      self._last_used[slot] = now
+      self.stats.hits += 1
+      return SemanticCacheHit(query=entry.query, similarity=similarity, data=entry.data, body=entry.body)
+
+  # Stores the data object and body of an answered query
+  def set(self, vector, scope: str, vector_store_ids: Iterable[str], query: str, data: Dict[str, Any], body: Union[bytes, str]):
+    with self._lock:
+      if self._vectors is None: self._allocate(vector.shape[0])
+      if vector.shape[0] != self.dimensions: return
+      if self._free_slots:
+        slot = self._free_slots.pop()
+      elif self._size < self.capacity:
+        slot = self._size
+        self._size += 1
+        self._entries.append(None)
+      else:
+        slot = int(np.argmin(self._last_used[:self._size]))
+        self._remove(slot)
+        self._free_slots.pop()
+        self.stats.evictions += 1
+      scope_id = self._scope_ids_by_key.setdefault(scope, len(self._scope_ids_by_key))
+      now = time.time()
+      self._vectors[slot] = vector
+      self._scope_ids[slot] = scope_id
+      self._last_used[slot] = now
+      self._entries[slot] = _SemanticCacheEntry(scope=scope, vector_store_ids=tuple(vector_store_ids), query=query, data=data, body=body, stored_at=now)
+      self.stats.stores += 1
+      self._dirty = True
+    if self.path and time.monotonic() - self._saved_at >= self.save_interval_seconds: self.save()
+
+  # Removes all entries that include the given vector store (e.g. after it was re-indexed) or all entries if None. Returns the number of removed entries.
+  def invalidate(self, vector_store_id: Optional[str] = None) -> int:
+    with self._lock:
+      slots = [slot for slot, entry in enumerate(self._entries) if entry is not None and (vector_store_id is None or vector_store_id in entry.vector_store_ids)]
+      for slot in slots: self._remove(slot)
+      self.stats.invalidations += len(slots)
+      if slots: self._dirty = True
+    if slots: print(f"  Semantic cache: {len(slots)} entries of vector store '{vector_store_id or '*'}' invalidated.")
+    return len(slots)
+
+  # Invalidates the entries of vector stores whose version (see version_fn) changed since the last check. Each store is checked at most
+  # once per version_check_interval_seconds, errors of version_fn are logged and the store is checked again after the interval.
+  def check_versions(self, vector_store_ids: Iterable[str]):
+    if self.version_fn is None or self.version_check_interval_seconds <= 0: return
+    now = time.time()
+    for vector_store_id in vector_store_ids:
+      previous_version, checked_at = self._versions.get(vector_store_id, (None, 0.0))
+      if now - checked_at < self.version_check_interval_seconds: continue
+      # Claim the check so that concurrent requests don't repeat it
+      self._versions[vector_store_id] = (previous_version, now)
+      try:
+        version = self.version_fn(vector_store_id)
+      except Exception as e:
+        print(f"  Semantic cache: version of vector store '{vector_store_id}' unknown: {str(e)}")
+        continue
+      self._versions[vector_store_id] = (version, now)
+      if previous_version is not None and version != previous_version:
+        print(f"  Semantic cache: vector store '{vector_store_id}' changed ({previous_version} -> {version}).")
+        self.invalidate(vector_store_id)
+
+  # Counts a failed embedding or lookup (the request continues without the semantic cache)
+  def record_error(self):
+    with self._lock: self.stats.errors += 1
+
+  def get_stats(self) -> Dict[str, Any]:
+    with self._lock:
+      lookups = self.stats.hits + self.stats.misses
+      return {
+        "hits": self.stats.hits
+        ,"misses": self.stats.misses
+        ,"stores": self.stats.stores
+        ,"evictions": self.stats.evictions
+        ,"expirations": self.stats.expirations
+        ,"invalidations": self.stats.invalidations
+        ,"errors": self.stats.errors
+        ,"hit_ratio": (self.stats.hits / lookups) if lookups else 0.0
+        ,"entries": self._size - len(self._free_slots)
+        ,"capacity": self.capacity
+        ,"dimensions": self.dimensions
+        ,"min_similarity": self.min_similarity
+        ,"ttl_seconds": self.ttl_seconds
+        ,"embedding": self.embedding_name
+        ,"path": self.path
+      }
+
+  # Writes the snapshot: vectors as .npy file with a unique name, then the entries as JSON that references it (replaced atomically).
+  # With multiple worker processes the last snapshot wins. Skipped if another save is running.
+  def save(self):
+    if not self.path or not self._save_lock.acquire(blocking=False): return
+    try:
+      with self._lock:
+        if not self._dirty or self._vectors is None: return
+        vectors = np.array(self._vectors)
+        entries = [
+          {"slot": slot, "scope": entry.scope, "vector_store_ids": list(entry.vector_store_ids), "query": entry.query, "stored_at": entry.stored_at, "last_used": float(self._last_used[slot])
+           ,"body": entry.body.decode("utf-8") if isinstance(entry.body, bytes) else entry.body}
+          for slot, entry in enumerate(self._entries) if entry is not None
+        ]
+        versions = {vector_store_id: version for vector_store_id, (version, checked_at) in self._versions.items() if version is not None}
+        self._dirty = False
+        self._saved_at = time.monotonic()
+      os.makedirs(self.path, exist_ok=True)
+      vectors_file = f"vectors-{uuid.uuid4().hex}.npy"
+      np.save(os.path.join(self.path, vectors_file), vectors)
+      snapshot = {"embedding": self.embedding_name, "dimensions": self.dimensions, "capacity": self.capacity, "vectors_file": vectors_file, "versions": versions, "entries": entries}
+      temp_path = os.path.join(self.path, f"entries.json.{os.getpid()}.tmp")
+      with open(temp_path, "w", encoding="utf-8") as file: json.dump(snapshot, file, ensure_ascii=False)
+      os.replace(temp_path, os.path.join(self.path, "entries.json"))
+      # The previous vectors file of this process and old files of other processes and earlier runs are no longer referenced
+      # (processes that mapped them keep their pages)
+      if self._snapshot_file and self._snapshot_file != vectors_file: _remove_file(os.path.join(self.path, self._snapshot_file))
+      self._snapshot_file = vectors_file
+      self._remove_unreferenced_vectors_files()
+      print(f"  Semantic cache: snapshot with {len(entries)} entries saved.")
+    except (OSError, ValueError) as e:
+      print(f"  Semantic cache: saving the snapshot failed: {str(e)}")
+    finally:
+      self._save_lock.release()
+
+  # Removes the vectors files in path that entries.json does not reference and that are older than UNREFERENCED_VECTORS_FILE_MIN_AGE_SECONDS
+  def _remove_unreferenced_vectors_files(self):
+    try:
+      with open(os.path.join(self.path, "entries.json"), "r", encoding="utf-8") as file: referenced_file = json.load(file).get("vectors_file")
+      file_names = os.listdir(self.path)
+    except (OSError, ValueError) as e:
+      print(f"  Semantic cache: old snapshot files not removed: {str(e)}")
+      return
+    now = time.time()
+    for file_name in file_names:
+      if not (file_name.startswith("vectors-") and file_name.endswith(".npy")) or file_name == referenced_file: continue
+      file_path = os.path.join(self.path, file_name)
+      try:
+        if now - os.path.getmtime(file_path) < UNREFERENCED_VECTORS_FILE_MIN_AGE_SECONDS: continue
+      except OSError:
+        continue
+      _remove_file(file_path)
+
+  # Must be called with self._lock held (or from __init__)
+  def _allocate(self, dimensions: int, vectors=None):
+    self.dimensions = dimensions
+    self._vectors = vectors if vectors is not None else np.zeros((self.capacity, dimensions), dtype=np.float32)
+    self._scope_ids = np.full(self.capacity, -1, dtype=np.int32)
+    self._last_used = np.zeros(self.capacity, dtype=np.float64)
+
+  # Must be called with self._lock held
+  def _remove(self, slot: int):
+    if self._entries[slot] is None: return
+    self._entries[slot] = None
+    self._scope_ids[slot] = -1
+    self._last_used[slot] = 0.0
+    self._free_slots.append(slot)
+
+  # Loads the snapshot written by save(). Snapshots of another embedding or capacity and expired entries are ignored.
+  def _load(self):
+    entries_path = os.path.join(self.path, "entries.json")
+    if not os.path.exists(entries_path): return
+    try:
+      with open(entries_path, "r", encoding="utf-8") as file: snapshot = json.load(file)
+      if snapshot.get("embedding") != self.embedding_name or snapshot.get("capacity") != self.capacity:
+        print(f"  Semantic cache: snapshot in '{self.path}' was written with other settings, ignored.")
+        return
+      # Copy-on-write mapping: the file is not changed and unchanged pages are shared with other processes
+      vectors = np.load(os.path.join(self.path, snapshot["vectors_file"]), mmap_mode="c")
+      if vectors.shape != (self.capacity, snapshot["dimensions"]): raise ValueError(f"unexpected shape {vectors.shape}")
+    except (OSError, ValueError, KeyError) as e:
+      print(f"  Semantic cache: snapshot in '{self.path}' could not be loaded: {str(e)}")
+      return
+    self._allocate(snapshot["dimensions"], vectors)
+    # Replaced by the next save() of this process like its own snapshots
+    self._snapshot_file = snapshot["vectors_file"]
+    now = time.time()
+    loaded = 0
+    for item in snapshot["entries"]:
+      slot = item["slot"]
+      if item["stored_at"] + self.ttl_seconds < now or slot >= self.capacity: continue
+      while len(self._entries) <= slot: self._entries.append(None)
+      body = item["body"].encode("utf-8")
+      self._entries[slot] = _SemanticCacheEntry(scope=item["scope"], vector_store_ids=tuple(item["vector_store_ids"]), query=item["query"], data=json.loads(body)["data"], body=body, stored_at=item["stored_at"])
+      self._scope_ids[slot] = self._scope_ids_by_key.setdefault(item["scope"], len(self._scope_ids_by_key))
+      self._last_used[slot] = item["last_used"]
+      loaded += 1
+    self._size = len(self._entries)
+    self._free_slots = [slot for slot, entry in enumerate(self._entries) if entry is None]
+    # The first check_versions() compares the versions of the snapshot with the current ones
+    self._versions = {vector_store_id: (version, 0.0) for vector_store_id, version in snapshot.get("versions", {}).items()}
+    print(f"Semantic cache: {loaded} entries loaded from '{self.path}'.")
+
+def _remove_file(path: str):
+  try:
+    os.remove(path)
+  except OSError:
+    pass
+
+
+# Creates the semantic cache from environment variables. Returns None if disabled or numpy is not installed.
+# embed_fn is used for SEMANTIC_CACHE_EMBEDDING=model, version_fn returns the version of a vector store (see check_versions()).
+def create_semantic_cache_from_env(embed_fn: Callable[[str], Any], version_fn: Optional[Callable[[str], str]] = None) -> Optional[SemanticCache]:
+  if os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() not in ['true']: return None
+  if np is None:
+    print(f"Semantic cache: numpy is not installed, semantic cache disabled.")
+    return None
+  embedding = os.getenv("SEMANTIC_CACHE_EMBEDDING", "model").lower()
+  if embedding == "local":
+    print(f"Semantic cache: the local embedding is for tests and benchmarks only, it does not understand meaning (e.g. negations). Use SEMANTIC_CACHE_EMBEDDING=model in production.")
+    dimensions = int(os.getenv("SEMANTIC_CACHE_LOCAL_DIMENSIONS", "256"))
+    embed_fn, embedding_name = create_local_embedding_function(dimensions), f"local-{dimensions}"
+  else:
+    embedding_name = os.getenv("SEMANTIC_CACHE_EMBEDDING_MODEL", "text-embedding-3-small")
+  return SemanticCache(
+    embed_fn=embed_fn
+    ,embedding_name=embedding_name
+    ,capacity=int(os.getenv("SEMANTIC_CACHE_CAPACITY", "10000"))
+    ,min_similarity=float(os.getenv("SEMANTIC_CACHE_MIN_SIMILARITY", "0.92"))
+    ,ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))
+    ,path=os.getenv("SEMANTIC_CACHE_PATH") or None
+    ,save_interval_seconds=float(os.getenv("SEMANTIC_CACHE_SAVE_INTERVAL_SECONDS", "300"))
+    ,version_fn=version_fn
+    ,version_check_interval_seconds=float(os.getenv("SEMANTIC_CACHE_VERSION_CHECK_INTERVAL_SECONDS", "300"))
+  )
@@ -0,0 +1,158 @@
+# Request coalescing (single-flight): concurrent identical requests wait for one upstream call and share its result
+# Copyright 2025, Karsten Held (MIT License)
+
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+import openai
+
+from request_deadline import DeadlineExceededError, get_remaining_seconds
+
+try:
+  import fcntl
+except ImportError:  # Windows (local development only)
+  fcntl = None
+
+# Seconds between attempts to get the file lock of another worker's call within a request deadline
+FILE_LOCK_POLL_SECONDS = 0.05
+
+
+@dataclass
+class SingleFlightStats:
+  calls: int = 0          # calls that executed fn (leaders)
+  coalesced: int = 0      # calls that got the result of another thread's call
+  coalesced_cross_process: int = 0  # calls that got the result of another worker process's call (via recheck)
+  errors: int = 0         # leader calls that raised, the exception is re-raised in the waiting calls (except deadline errors, see do())
+  deadline_exceeded: int = 0  # calls that stopped waiting for another call at their request deadline
+  takeovers: int = 0      # waiting calls that ran fn themselves after the leader hit its request deadline
+
+# Call in progress, shared by the leader and all waiting threads
+class _Call:
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.exception: Optional[BaseException] = None
+    self.waiters = 0
+
+
+class SingleFlight:
+  # lock_dir: if set, calls are also coalesced across processes (gunicorn workers) using file locks in this directory.
+  # Waiting processes don't receive the result directly, they call recheck() after the lock is released (e.g. a lookup in a shared cache).
+  def __init__(self, lock_dir: Optional[str] = None):
+    self.lock_dir = lock_dir if (lock_dir and fcntl is not None) else None
+    if lock_dir and fcntl is None: print(f"Single-flight: cross-process mode is not supported on this platform, using in-process mode only.")
+    if self.lock_dir: os.makedirs(self.lock_dir, exist_ok=True)
+    self.stats = SingleFlightStats()
+    self._calls: Dict[str, _Call] = {}
+    self._lock = threading.Lock()
+
+  # Executes fn() once for all concurrent calls with the same key. Returns (result, shared) where shared is True if the result came from another call.
+  # recheck() is only used in cross-process mode and must return None if there is no result yet.
+  # Waiting calls wait at most until their request deadline (see request_deadline.py), then DeadlineExceededError is raised.
+  # Deadlines differ per request (X-Request-Timeout), so if the leader fails with a deadline error, waiting calls with time left don't
+  # get its error: they start the call again (one of them becomes the new leader).
+  def do(self, key: str, fn: Callable[[], Any], recheck: Optional[Callable[[], Any]] = None) -> tuple[Any, bool]:
+    while True:
+      with self._lock:
+        call = self._calls.get(key)
+        if call is not None:
+          call.waiters += 1
+          self.stats.coalesced += 1
+          is_leader = False
+        else:
+          call = _Call()
+          self._calls[key] = call
+          is_leader = True
+      if is_leader: break
+
+      if not call.done.wait(get_remaining_seconds()):
+        with self._lock: self.stats.deadline_exceeded += 1
+        raise DeadlineExceededError("Request deadline exceeded while waiting for an identical in-flight request.")
+      if call.exception is None: return call.result, True
+      if not (_is_deadline_error(call.exception) and _has_time_left()): raise call.exception
+      with self._lock: self.stats.takeovers += 1
+
+    try:
+      call.result, shared = self._execute(key, fn, recheck)
+      return call.result, shared
+    except BaseException as e:
+      call.exception = e
+      with self._lock: self.stats.errors += 1
+      raise
+    finally:
+      with self._lock: del self._calls[key]
+      call.done.set()
+
+  def _execute(self, key: str, fn: Callable[[], Any], recheck: Optional[Callable[[], Any]]) -> tuple[Any, bool]:
+    if self.lock_dir is None or recheck is None:
+      with self._lock: self.stats.calls += 1
+      return fn(), False
+    lock_path = os.path.join(self.lock_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".lock")
+    with open(lock_path, "a") as lock_file:
+      self._acquire_file_lock(lock_file)
+      try:
+        # Another worker may have finished the same call while this one was waiting for the lock
+        result = recheck()
+        if result is not None:
+          with self._lock: self.stats.coalesced_cross_process += 1
+          return result, True
+        with self._lock: self.stats.calls += 1
+        return fn(), False
+      finally:
+        # Deleting the lock file while other processes wait on it can at worst cause one duplicate call, never a wrong result
+        try: os.remove(lock_path)
+        except OSError: pass
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+  # Waits for the file lock, within a request deadline only until the deadline (polling, flock() has no timeout)
+  def _acquire_file_lock(self, lock_file):
+    if get_remaining_seconds() is None:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      return
+    while True:
+      try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return
+      except BlockingIOError:
+        remaining_seconds = get_remaining_seconds()
+        if remaining_seconds <= 0:
+          with self._lock: self.stats.deadline_exceeded += 1
+          raise DeadlineExceededError("Request deadline exceeded while waiting for an identical request in another worker.")
+        time.sleep(min(FILE_LOCK_POLL_SECONDS, remaining_seconds))
+
+  def get_stats(self) -> Dict[str, Any]:
+    with self._lock:
+      return {
+        "calls": self.stats.calls
+        ,"coalesced": self.stats.coalesced
+        ,"coalesced_cross_process": self.stats.coalesced_cross_process
+        ,"errors": self.stats.errors
+        ,"deadline_exceeded": self.stats.deadline_exceeded
+        ,"takeovers": self.stats.takeovers
+        ,"in_flight": len(self._calls)
+        ,"cross_process": self.lock_dir is not None
+      }
+
+# Errors of a call that ran out of its request deadline (or into the client timeout), not errors of the upstream service
+def _is_deadline_error(e: BaseException) -> bool:
+  return isinstance(e, (DeadlineExceededError, openai.APITimeoutError))
+
+def _has_time_left() -> bool:
+  remaining_seconds = get_remaining_seconds()
+  return remaining_seconds is None or remaining_seconds > 0
+
+
+# Creates the single-flight group from environment variables. Returns None if request coalescing is disabled.
+# shared_result_store: True if the recheck() of the caller sees results of other processes (e.g. the sqlite tier of the response cache).
+# Without it, cross-process mode would only serialize identical requests of different workers (each still calls upstream), so it is turned off.
+def create_single_flight_from_env(shared_result_store: bool = False) -> Optional[SingleFlight]:
+  if os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() not in ['true']: return None
+  lock_dir = os.getenv("SINGLE_FLIGHT_LOCK_DIR") or None
+  if lock_dir and not shared_result_store:
+    print(f"Single-flight: SINGLE_FLIGHT_LOCK_DIR is ignored, cross-process mode needs a shared cache (RESPONSE_CACHE_SQLITE_PATH). Using in-process mode only.")
+    lock_dir = None
+  return SingleFlight(lock_dir=lock_dir)
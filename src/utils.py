@@ -1,5 +1,6 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Iterable, Iterator
 import datetime
+import time
 
 # Format a file size in bytes into a human-readable string
 def format_filesize(num_bytes):
@@ -13,17 +14,19 @@ def format_filesize(num_bytes):
 def format_timestamp(ts):
   return ('' if not ts else datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'))
 
+# Logs the start of a function and returns the start time for log_function_footer() (monotonic, high resolution)
 def log_function_header(name):
-  start_time = datetime.datetime.now()
-  print(f"[{start_time.strftime('%Y-%m-%d %H:%M:%S')}] START: {name}...")
-  return start_time
+  print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] START: {name}...")
+  return time.perf_counter()
 
 def log_function_footer(name, start_time):
-  end_time = datetime.datetime.now()
-  secs = (end_time - start_time).total_seconds()
-  parts = [(int(secs // 3600), 'hour'), (int((secs % 3600) // 60), 'min'), (int(secs % 60), 'sec')]
+  print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] END: {name} ({format_duration(time.perf_counter() - start_time)}).")
+
+# Format a duration in seconds into a human-readable string with millisecond resolution
+def format_duration(secs):
+  parts = [(int(secs // 3600), 'hour'), (int((secs % 3600) // 60), 'min')]
   total_time = ', '.join(f"{val} {unit}{'s' if val != 1 else ''}" for val, unit in parts if val > 0)
-  print(f"[{end_time.strftime('%Y-%m-%d %H:%M:%S')}] END: {name} ({total_time}).")
+  return (total_time + ', ' if total_time else '') + f"{secs % 60:.3f} secs"
 
 def truncate_string(string, max_length):
   if len(string) > max_length:
@@ -34,34 +37,55 @@ import html
 
 # Returns a nested html table from the given data (Dict or List or Array)
 def convert_to_nested_html_table(data: Any, max_depth: int = 10) -> str:
-  def handle_value(v: Any, depth: int) -> str:
-    if depth >= max_depth: return html.escape(str(v))
-    if isinstance(v, dict): return handle_dict(v, depth + 1)
-    elif isinstance(v, list): return handle_list(v, depth + 1)
-    else: return html.escape(str(v))
+  return ''.join(iter_nested_html_table(data, max_depth))
 
-  def handle_list(items: List[Any], depth: int) -> str:
-    if not items or depth >= max_depth: return html.escape(str(items))
-    # For simple lists, just return the string representation
-    if not any(isinstance(item, (dict, list)) for item in items): return html.escape(str(items))
-    # For complex lists, create a table
-    rows = [f"<tr><td>[{i}]</td><td>{handle_value(item, depth)}</td></tr>" for i, item in enumerate(items)]
-    return f"<table border=1>{''.join(rows)}</table>"
-  
-  def handle_dict(d: Dict[str, Any], depth: int) -> str:
-    if not d or depth >= max_depth: return html.escape(str(d))
-    rows = [f"<tr><td>{html.escape(str(k))}</td><td>{handle_value(v, depth)}</td></tr>" for k, v in d.items()]
-    return f"<table border=1>{''.join(rows)}</table>"
-  return handle_value(data, 1)
+# Yields the nested html table of convert_to_nested_html_table() as fragments in a single pass, without building the document in memory.
+# max_string_length and max_list_items (0 = unlimited) truncate long values and lists, e.g. the chunk texts of many search results.
+def iter_nested_html_table(data: Any, max_depth: int = 10, max_string_length: int = 0, max_list_items: int = 0) -> Iterator[str]:
+  escape = html.escape
 
-def log_function_header(name):
-  start_time = datetime.datetime.now()
-  print(f"[{start_time.strftime('%Y-%m-%d %H:%M:%S')}] START: {name}...")
-  return start_time
+  def handle_leaf(v: Any) -> str:
+    text = v if isinstance(v, str) else str(v)
+    if max_string_length and len(text) > max_string_length:
+      return f"{escape(text[:max_string_length])}... ({len(text) - max_string_length} more characters)"
+    return escape(text)
 
-def log_function_footer(name, start_time):
-  end_time = datetime.datetime.now()
-  secs = (end_time - start_time).total_seconds()
-  parts = [(int(secs // 3600), 'hour'), (int((secs % 3600) // 60), 'min'), (int(secs % 60), 'sec')]
-  total_time = ', '.join(f"{val} {unit}{'s' if val != 1 else ''}" for val, unit in parts if val > 0)
-  print(f"[{end_time.strftime('%Y-%m-%d %H:%M:%S')}] END: {name} ({total_time}).")
+  def handle_value(v: Any, depth: int) -> Iterator[str]:
+    if depth < max_depth:
+      if isinstance(v, dict):
+        if v and depth + 1 < max_depth:
+          yield "<table border=1>"
+          for k, item in v.items():
+            yield f"<tr><td>{escape(str(k))}</td><td>"
+            yield from handle_value(item, depth + 1)
+            yield "</td></tr>"
+          yield "</table>"
+          return
+      # Simple lists are shown as their string representation, lists with dicts or lists as table
+      elif isinstance(v, list):
+        if v and depth + 1 < max_depth and any(isinstance(item, (dict, list)) for item in v):
+          yield "<table border=1>"
+          for i, item in enumerate(v):
+            if max_list_items and i >= max_list_items:
+              yield f"<tr><td>...</td><td>{len(v) - i} more items</td></tr>"
+              break
+            yield f"<tr><td>[{i}]</td><td>"
+            yield from handle_value(item, depth + 1)
+            yield "</td></tr>"
+          yield "</table>"
+          return
+    yield handle_leaf(v)
+  return handle_value(data, 1)
+
+# Joins small fragments into chunks of about chunk_size characters, so streamed responses are not written in many tiny pieces
+def iter_chunks(fragments: Iterable[str], chunk_size: int = 16384) -> Iterator[str]:
+  buffer = []
+  buffer_size = 0
+  for fragment in fragments:
+    buffer.append(fragment)
+    buffer_size += len(fragment)
+    if buffer_size >= chunk_size:
+      yield ''.join(buffer)
+      buffer = []
+      buffer_size = 0
+  if buffer: yield ''.join(buffer)
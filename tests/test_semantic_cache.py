@@ -0,0 +1,211 @@
+# Offline tests of the semantic answer cache with the deterministic local embedding (no model, no network)
+# Copyright 2025, Karsten Held (MIT License)
+#
+# Usage: python -m pytest tests
+
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+np = pytest.importorskip("numpy")
+import semantic_cache
+from semantic_cache import SemanticCache, create_local_embedding_function
+
+SCOPE = "scope-vs_a"
+QUERY = "What is the travel expense policy?"
+
+
+# time.time() of the cache module under test control, advanced with clock.advance(seconds)
+class FakeClock:
+  def __init__(self):
+    self.now = 1_700_000_000.0
+
+  def time(self):
+    return self.now
+
+  def advance(self, seconds):
+    self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+  fake_clock = FakeClock()
+  monkeypatch.setattr(semantic_cache.time, "time", fake_clock.time)
+  return fake_clock
+
+def create_cache(**kwargs):
+  return SemanticCache(create_local_embedding_function(256), "local-256", **kwargs)
+
+# Data object and body as stored by app.py
+def make_answer(query):
+  data = {"query": query, "answer": f"Answer to '{query}'", "source_markers": ["【", "】"], "sources": [{"data": "text", "source": "https://t/doc.pdf", "metadata": None}]}
+  return data, json.dumps({"data": data}).encode("utf-8")
+
+def store(cache, query, scope=SCOPE, vector_store_ids=("vs_a",)):
+  data, body = make_answer(query)
+  cache.set(cache.embed(query), scope, vector_store_ids, query, data, body)
+
+def lookup(cache, query, scope=SCOPE):
+  return cache.get(cache.embed(query), scope)
+
+
+def test_local_embedding_is_deterministic():
+  embed = create_local_embedding_function(256)
+  assert np.array_equal(embed(QUERY), embed(QUERY))
+  assert np.array_equal(embed(QUERY), embed("what is the TRAVEL expense policy"))
+
+def test_hit_and_miss_at_threshold():
+  reworded = "How many vacation days do I get per year?"
+  cache = create_cache()
+  similarity = float(cache.embed("How many vacation days do I get?") @ cache.embed(reworded))
+  for min_similarity, expect_hit in [(similarity - 0.01, True), (similarity + 0.01, False)]:
+    cache = create_cache(min_similarity=min_similarity)
+    store(cache, "How many vacation days do I get?")
+    hit = lookup(cache, reworded)
+    assert (hit is not None) == expect_hit
+    if expect_hit:
+      assert hit.similarity == pytest.approx(similarity, abs=1e-5)
+      assert hit.query == "How many vacation days do I get?"
+  assert lookup(cache, "Who approves purchase orders?") is None
+  assert cache.get_stats()["misses"] == 2
+
+def test_exact_query_hits_with_stored_data():
+  cache = create_cache()
+  store(cache, QUERY)
+  hit = lookup(cache, QUERY)
+  assert hit.similarity == pytest.approx(1.0, abs=1e-5)
+  assert hit.data == make_answer(QUERY)[0]
+  assert hit.body == make_answer(QUERY)[1]
+
+def test_scopes_are_isolated():
+  cache = create_cache()
+  store(cache, QUERY, scope="scope-vs_a")
+  assert lookup(cache, QUERY, scope="scope-vs_b") is None
+  store(cache, QUERY, scope="scope-vs_b", vector_store_ids=("vs_b",))
+  assert lookup(cache, QUERY, scope="scope-vs_a").data["query"] == QUERY
+  assert lookup(cache, QUERY, scope="scope-vs_b") is not None
+
+def test_least_recently_used_entry_is_evicted(clock):
+  cache = create_cache(capacity=2)
+  store(cache, "first question about travel")
+  clock.advance(1)
+  store(cache, "second question about holidays")
+  clock.advance(1)
+  # Makes the first entry the most recently used one
+  assert lookup(cache, "first question about travel") is not None
+  clock.advance(1)
+  store(cache, "third question about salaries")
+  assert cache.get_stats()["evictions"] == 1
+  assert cache.get_stats()["entries"] == 2
+  assert lookup(cache, "second question about holidays") is None
+  assert lookup(cache, "first question about travel") is not None
+  assert lookup(cache, "third question about salaries") is not None
+
+def test_entries_expire_after_ttl(clock):
+  cache = create_cache(ttl_seconds=60)
+  store(cache, QUERY)
+  clock.advance(59)
+  assert lookup(cache, QUERY) is not None
+  clock.advance(2)
+  assert lookup(cache, QUERY) is None
+  stats = cache.get_stats()
+  assert stats["expirations"] == 1
+  assert stats["entries"] == 0
+
+def test_invalidate_by_vector_store_and_all():
+  cache = create_cache()
+  store(cache, QUERY, scope="scope-a", vector_store_ids=("vs_a",))
+  store(cache, QUERY, scope="scope-ab", vector_store_ids=("vs_a", "vs_b"))
+  store(cache, QUERY, scope="scope-b", vector_store_ids=("vs_b",))
+  assert cache.invalidate("vs_a") == 2
+  assert lookup(cache, QUERY, scope="scope-a") is None
+  assert lookup(cache, QUERY, scope="scope-ab") is None
+  assert lookup(cache, QUERY, scope="scope-b") is not None
+  assert cache.invalidate() == 1
+  assert cache.get_stats()["entries"] == 0
+  # Freed slots are reused
+  store(cache, QUERY, scope="scope-a")
+  assert cache.get_stats()["entries"] == 1
+
+def test_check_versions_invalidates_changed_vector_stores(clock):
+  versions = {"vs_a": "10/0/0/1000", "vs_b": "5/0/0/500"}
+  calls = []
+  def version_fn(vector_store_id):
+    calls.append(vector_store_id)
+    return versions[vector_store_id]
+  cache = create_cache(version_fn=version_fn, version_check_interval_seconds=300)
+  cache.check_versions(["vs_a", "vs_b"])
+  store(cache, QUERY, scope="scope-a", vector_store_ids=("vs_a",))
+  store(cache, QUERY, scope="scope-b", vector_store_ids=("vs_b",))
+  versions["vs_a"] = "11/0/0/1100"
+  # Within the interval the version is not fetched again
+  clock.advance(10)
+  cache.check_versions(["vs_a", "vs_b"])
+  assert calls == ["vs_a", "vs_b"]
+  assert lookup(cache, QUERY, scope="scope-a") is not None
+  clock.advance(300)
+  cache.check_versions(["vs_a", "vs_b"])
+  assert lookup(cache, QUERY, scope="scope-a") is None
+  assert lookup(cache, QUERY, scope="scope-b") is not None
+  assert cache.get_stats()["invalidations"] == 1
+
+def test_check_versions_keeps_entries_on_errors(clock):
+  def version_fn(vector_store_id):
+    raise RuntimeError("service unavailable")
+  cache = create_cache(version_fn=version_fn)
+  store(cache, QUERY)
+  cache.check_versions(["vs_a"])
+  assert lookup(cache, QUERY) is not None
+
+def test_snapshot_save_and_load(tmp_path):
+  path = str(tmp_path / "semantic_cache")
+  cache = create_cache(capacity=100, path=path, version_fn=lambda vector_store_id: "1/0/0/100")
+  cache.check_versions(["vs_a"])
+  store(cache, QUERY)
+  store(cache, "How many vacation days do I get?", scope="scope-vs_b", vector_store_ids=("vs_b",))
+  cache.save()
+
+  loaded = create_cache(capacity=100, path=path, version_fn=lambda vector_store_id: "2/0/0/200")
+  assert loaded.get_stats()["entries"] == 2
+  hit = lookup(loaded, QUERY)
+  assert hit.data == make_answer(QUERY)[0]
+  assert lookup(loaded, "How many vacation days do I get?", scope="scope-vs_b") is not None
+  # The versions of the snapshot are compared with the current ones on the first check
+  loaded.check_versions(["vs_a"])
+  assert lookup(loaded, QUERY) is None
+
+def test_snapshot_of_other_settings_is_ignored(tmp_path):
+  path = str(tmp_path / "semantic_cache")
+  cache = create_cache(capacity=100, path=path)
+  store(cache, QUERY)
+  cache.save()
+  assert create_cache(capacity=50, path=path).get_stats()["entries"] == 0
+  assert SemanticCache(create_local_embedding_function(128), "local-128", capacity=100, path=path).get_stats()["entries"] == 0
+
+def test_save_removes_unreferenced_vectors_files(tmp_path, monkeypatch):
+  path = tmp_path / "semantic_cache"
+  cache = create_cache(capacity=10, path=str(path))
+  store(cache, QUERY)
+  cache.save()
+  # Left over by another worker process or an earlier run
+  old_file = path / "vectors-0123456789abcdef.npy"
+  old_file.write_bytes(b"")
+  old_time = time.time() - semantic_cache.UNREFERENCED_VECTORS_FILE_MIN_AGE_SECONDS - 10
+  os.utime(old_file, (old_time, old_time))
+  # Possibly written by a save of another process that has not replaced entries.json yet
+  new_file = path / "vectors-fedcba9876543210.npy"
+  new_file.write_bytes(b"")
+
+  # A restarted process replaces the loaded snapshot with its own
+  restarted = create_cache(capacity=10, path=str(path))
+  store(restarted, "How many vacation days do I get?")
+  restarted.save()
+  store(restarted, "Who approves purchase orders?")
+  restarted.save()
+
+  referenced_file = json.loads((path / "entries.json").read_text(encoding="utf-8"))["vectors_file"]
+  assert sorted(file.name for file in path.glob("vectors-*.npy")) == sorted([referenced_file, new_file.name])
+  assert create_cache(capacity=10, path=str(path)).get_stats()["entries"] == 3